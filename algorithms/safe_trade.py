@@ -1,23 +1,25 @@
-from datetime import datetime
-
 from lib.algorithm_interface import AlgorithmInterface
 from lib.exchange_interface import ExchangeInterface
-from lib.logger import logger, float_to_human_readable
+from lib.logger import logger, HumanReadableFloat
+from lib.records import ActionRecord
 
 
 class SafeTrade(AlgorithmInterface):
     exchange: ExchangeInterface
     last_bought_price: float
     last_sold_price: float
+    _force_purchase: bool
     wallet_crypto_amount: float
     wallet_fiat_amount: float
+    supports_vectorized = True
 
     def __init__(self, exchange: ExchangeInterface, id_in_list: str, cached_vars: dict):
         super().__init__(exchange, id_in_list, cached_vars)
 
     def get_current_vars(self) -> dict:
         return {
-            "last_bought_price": self.last_bought_price,
+            # keep forcing a purchase after a restart if the first action never happened
+            "last_bought_price": 0.0 if self._force_purchase else self.last_bought_price,
             "last_sold_price": self.last_sold_price,
             "wallet_crypto_amount": self.wallet_crypto_amount,
             "wallet_fiat_amount": self.wallet_fiat_amount
@@ -25,41 +27,42 @@ class SafeTrade(AlgorithmInterface):
 
     def set_current_vars(self, new_vars: dict):
         self.last_bought_price = new_vars.get("last_bought_price", 0.0)
-        # force a purchase on next action if last_bought_price is not set
-        if self.last_bought_price == 0.0:
-            logger.warning(f"Last_bought_price is not set, forcing a purchase on next action.")
-            self.last_sold_price = self.exchange.get_current_price() * 10
-            self.last_bought_price = self.exchange.get_current_price() * 10
+        # force a purchase on next action if last_bought_price is not set. The thresholds are derived from the price
+        # of the first action, so no price has to be fetched while starting up.
+        self._force_purchase = self.last_bought_price == 0.0
+        if self._force_purchase:
+            logger.warning("Last_bought_price is not set, forcing a purchase on next action.")
+            self.last_sold_price = 0.0
         else:
             self.last_sold_price = new_vars.get("last_sold_price", 0.0)
         self.wallet_crypto_amount = self.exchange.get_crypto_wallet_amount()
         self.wallet_fiat_amount = self.exchange.get_fiat_wallet_amount()
         if new_vars.get("wallet_fiat_amount") is not None and self.wallet_fiat_amount != new_vars.get(
                 "wallet_fiat_amount"):
-            logger.warning(f"Provided/cached wallet_fiat_amount ({new_vars.get('wallet_fiat_amount')}) "
-                           f"does not match wallet_fiat_amount reported by exchange ({self.wallet_fiat_amount})."
-                           f"Ignoring new value and using exchange wallet amount.")
+            logger.warning("Provided/cached wallet_fiat_amount (%s) does not match wallet_fiat_amount reported by "
+                           "exchange (%s).Ignoring new value and using exchange wallet amount.",
+                           new_vars.get("wallet_fiat_amount"), self.wallet_fiat_amount)
         if new_vars.get("wallet_crypto_amount") is not None and self.wallet_crypto_amount != new_vars.get(
                 "wallet_crypto_amount"):
-            logger.warning(f"Provided/cached wallet_crypto_amount ({new_vars.get('wallet_crypto_amount')}) "
-                           f"does not match wallet_crypto_amount reported by exchange ({self.wallet_crypto_amount})."
-                           f"Ignoring new value and using exchange wallet amount.")
+            logger.warning("Provided/cached wallet_crypto_amount (%s) does not match wallet_crypto_amount reported by "
+                           "exchange (%s).Ignoring new value and using exchange wallet amount.",
+                           new_vars.get("wallet_crypto_amount"), self.wallet_crypto_amount)
 
-    def perform_action(self) -> dict:
+    def perform_action(self) -> ActionRecord:
         current_price = self.exchange.get_current_price()
-        logger.debug(
-            f"{self.codename}: Current price for {self.exchange.crypto_codename}: {float_to_human_readable(current_price)}")
-        result = {
-            "action": "hold",
-            "action_result": None,
-            "transacted_amount": None,
-        }
+        if self._force_purchase:
+            self.last_sold_price = current_price * 10
+            self.last_bought_price = current_price * 10
+            self._force_purchase = False
+        logger.debug("%s: Current price for %s: %s", self.codename, self.exchange.crypto_codename,
+                     HumanReadableFloat(current_price))
+        result = ActionRecord("hold")
         if current_price * (
                 1 - self.exchange.exchange_fee * 2) > self.last_bought_price and self.wallet_crypto_amount != 0:
             expected_fiat_amount: float = current_price * self.wallet_crypto_amount * (1 - self.exchange.exchange_fee)
             # sell entire crypto wallet
             result = self.perform_crypto_sale(self.wallet_crypto_amount, expected_fiat_amount)
-            if result["action_result"] != "failure":
+            if result.action_result != "failure":
                 self.last_sold_price = current_price
 
         elif current_price * (
@@ -68,15 +71,29 @@ class SafeTrade(AlgorithmInterface):
                     1 - self.exchange.exchange_fee)
             # use entire fiat wallet to buy
             result = self.perform_crypto_purchase(self.wallet_fiat_amount, expected_crypto_amount)
-            if result["action_result"] != "failure":
+            if result.action_result != "failure":
                 self.last_bought_price = current_price
         else:
-            logger.debug(f"{self.codename}: Performing no action for {self.exchange.crypto_codename}")
+            logger.debug("%s: Performing no action for %s", self.codename, self.exchange.crypto_codename)
 
-        result["wallet_fiat_amount"] = self.wallet_fiat_amount
-        result["wallet_crypto_amount"] = self.wallet_crypto_amount
-        result["current_price"] = current_price
-        result["unix_timestamp"] = datetime.now().timestamp()
-        result["id"] = self.id_in_list
+        result.wallet_fiat_amount = self.wallet_fiat_amount
+        result.wallet_crypto_amount = self.wallet_crypto_amount
+        result.current_price = current_price
+        result.unix_timestamp = self.exchange.get_current_timestamp()
+        result.id = self.id_in_list
 
         return result
+
+    @classmethod
+    def evaluate_vectorized(cls, timestamps, prices, exchange_vars: dict, algorithm_vars: dict) -> dict:
+        from lib.vectorized import threshold_kernel
+
+        # same initialization as set_current_vars with the first price as the current price
+        last_bought_price = algorithm_vars.get("last_bought_price", 0.0)
+        if last_bought_price == 0.0:
+            last_sold_price = float(prices[0]) * 10
+            last_bought_price = float(prices[0]) * 10
+        else:
+            last_sold_price = algorithm_vars.get("last_sold_price", 0.0)
+        return threshold_kernel(timestamps, prices, exchange_vars["exchange_fee"], last_bought_price, last_sold_price,
+                                exchange_vars["wallet_crypto_amount"], exchange_vars["wallet_fiat_amount"])
@@ -0,0 +1,145 @@
+from typing import Tuple
+
+import numpy as np
+
+from lib.candles import Bars
+from lib.exchange_interface import ExchangeInterface
+from lib.logger import logger
+from lib.price_series import load_price_series
+
+
+class Replay(ExchangeInterface):
+    """
+    Offline exchange that serves historical prices instead of live ones. Trades are filled like in the Simulator. The
+    replay position is moved with advance(), so a backtest controls how fast time passes.
+
+    Prices come from the arrays passed in, the price_file of the exchange_vars, or, with market_data_interval (e.g.
+    "1m") in the exchange_vars, from the closes of the bars of crypto_codename in the local market data store
+    (optionally limited to market_data_start <= unix_timestamp < market_data_end).
+    """
+    _wallet_crypto_amount: float
+    _wallet_fiat_amount: float
+    price_file: str | None
+    market_data_interval: str | None
+
+    def __init__(self, cached_vars=None, timestamps: np.ndarray = None, prices: np.ndarray = None):
+        super().__init__()
+        if cached_vars is None:
+            logger.warning("No cached vars provided, using BTC-EUR as crypto_codename, 0.001 as exchange_fee, "
+                           "assuming empty crypto wallet and 100.0 in fiat wallet")
+            cached_vars = {
+                "crypto_codename": "BTC-EUR",
+                "exchange_fee": 0.001,
+                "wallet_crypto_amount": 0,
+                "wallet_fiat_amount": 100.0
+            }
+        self.set_current_vars(cached_vars)
+        if prices is None:
+            if self.price_file is not None:
+                timestamps, prices = load_price_series(self.price_file)
+            elif self.market_data_interval is not None:
+                timestamps, prices = self._load_market_data()
+            else:
+                raise ValueError("Replay needs price arrays, a price_file or a market_data_interval in its "
+                                 "exchange_vars")
+        self.set_series(timestamps, prices)
+
+    def _load_market_data(self) -> Tuple[np.ndarray, np.ndarray]:
+        from lib.market_data import get_market_data_store
+
+        bars = get_market_data_store().load(self.crypto_codename, self.market_data_start, self.market_data_end,
+                                            self.market_data_interval)
+        if len(bars) == 0:
+            raise ValueError(f"No {self.market_data_interval} market data stored for {self.crypto_codename}, "
+                             f"run with --sync-market-data first")
+        return bars["unix_timestamp"], bars["close"]
+
+    def set_series(self, timestamps: np.ndarray, prices: np.ndarray):
+        # plain python floats are much faster than numpy scalars in the per-tick arithmetic
+        self._timestamps = np.asarray(timestamps, dtype=np.float64).tolist()
+        self._prices = np.asarray(prices, dtype=np.float64).tolist()
+        self.position = 0
+        # built on the first get_candles call, so replays of algorithms without bars do not pay for them
+        self._candles = None
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def advance(self) -> bool:
+        """
+        Moves to the next replayed price.
+        :return: False if the end of the series was reached
+        """
+        if self.position + 1 >= len(self._prices):
+            return False
+        self.position += 1
+        return True
+
+    def get_current_vars(self) -> dict:
+        current_vars = {
+            "crypto_codename": self.crypto_codename,
+            "exchange_fee": self.exchange_fee,
+            "wallet_crypto_amount": self._wallet_crypto_amount,
+            "wallet_fiat_amount": self._wallet_fiat_amount
+        }
+        if self.price_file is not None:
+            current_vars["price_file"] = self.price_file
+        for name in ("market_data_interval", "market_data_start", "market_data_end"):
+            if getattr(self, name) is not None:
+                current_vars[name] = getattr(self, name)
+        return current_vars
+
+    def set_current_vars(self, new_vars: dict):
+        self.crypto_codename = new_vars["crypto_codename"]
+        self.exchange_fee = new_vars["exchange_fee"]
+        self._wallet_crypto_amount = new_vars["wallet_crypto_amount"]
+        self._wallet_fiat_amount = new_vars["wallet_fiat_amount"]
+        self.price_file = new_vars.get("price_file", None)
+        self.market_data_interval = new_vars.get("market_data_interval", None)
+        self.market_data_start = new_vars.get("market_data_start", None)
+        self.market_data_end = new_vars.get("market_data_end", None)
+
+    def get_crypto_wallet_amount(self) -> float:
+        return self._wallet_crypto_amount
+
+    def get_fiat_wallet_amount(self) -> float:
+        return self._wallet_fiat_amount
+
+    def get_current_price(self) -> float:
+        return self._prices[self.position]
+
+    def get_current_timestamp(self) -> float:
+        return self._timestamps[self.position]
+
+    def get_candles(self, timeframe: str, count: int = None, include_open: bool = True) -> Bars:
+        # replayed time differs per instance, so every replay aggregates its own prices, up to the replay position
+        if self._candles is None or self.position < self._candles_position:
+            from lib.candles import CandleAggregator, get_candle_aggregator
+
+            shared = get_candle_aggregator()
+            self._candles = CandleAggregator(shared.timeframes, shared.capacity)
+            self._candles_position = -1
+        for position in range(self._candles_position + 1, self.position + 1):
+            self._candles.update(self.crypto_codename, self._prices[position], self._timestamps[position])
+        self._candles_position = self.position
+        return self._candles.bars(self.crypto_codename, timeframe, count, include_open)
+
+    def buy_crypto(self, fiat_to_spend_amount: float) -> Tuple[bool, float]:
+        if fiat_to_spend_amount > self._wallet_fiat_amount:
+            logger.error(f"Not enough fiat to in wallet to spend requested amount {fiat_to_spend_amount}. "
+                         f"Current fiat total: {self._wallet_fiat_amount}")
+            return False, 0
+        self._wallet_crypto_amount = 1 / self.get_current_price() * self._wallet_fiat_amount * (1 - self.exchange_fee)
+        self._wallet_fiat_amount = 0
+        # replays never fail
+        return True, self._wallet_crypto_amount
+
+    def sell_crypto(self, crypto_to_sell_amount: float) -> Tuple[bool, float]:
+        if crypto_to_sell_amount > self._wallet_crypto_amount:
+            logger.error(f"Not enough crypto to sell requested amount ({crypto_to_sell_amount}). "
+                         f"Current crypto total: {self._wallet_crypto_amount}")
+            return False, 0
+        self._wallet_fiat_amount = self.get_current_price() * self._wallet_crypto_amount * (1 - self.exchange_fee)
+        self._wallet_crypto_amount = 0
+        # replays never fail
+        return True, self._wallet_fiat_amount
@@ -1,15 +1,37 @@
-import json
-import urllib.request
-from typing import Tuple
+import time
+from typing import Dict, Iterable, Tuple
 
-from lib.exchange_interface import ExchangeInterface
+from lib.exchange_interface import ExchangeInterface, DEFAULT_PRICE_FETCH_WORKERS
+from lib.http_client import http_client
 from lib.logger import logger
+from lib.quote_cache import quote_cache
+
+YAHOO_BASE_URL = "https://query1.finance.yahoo.com"
+# maximum number of symbols yahoo accepts in one spark request
+YAHOO_SPARK_BATCH_SIZE = 20
+DAY = 86400
+# interval -> (longest time range of one chart request, how far back yahoo serves the interval or None)
+YAHOO_CHART_LIMITS = {
+    "1m": (7 * DAY, 30 * DAY),
+    "2m": (60 * DAY, 60 * DAY),
+    "5m": (60 * DAY, 60 * DAY),
+    "15m": (60 * DAY, 60 * DAY),
+    "30m": (60 * DAY, 60 * DAY),
+    "1h": (730 * DAY, 730 * DAY),
+    "1d": (3650 * DAY, None),
+    "1wk": (3650 * DAY, None)
+}
 
 
 class Simulator(ExchangeInterface):
     _wallet_crypto_amount: float
     _wallet_fiat_amount: float
 
+    # prices come from yahoo and do not depend on the wallet
+    shared_quotes = True
+    # replaceable to price against a local stub server
+    base_url = YAHOO_BASE_URL
+
     def __init__(self, cached_vars=None):
         super().__init__()
         if cached_vars is None:
@@ -44,12 +66,85 @@ class Simulator(ExchangeInterface):
         return self._wallet_fiat_amount
 
     def get_current_price(self) -> float:
+        # all jobs on the same crypto_codename share one request per cache ttl, usually the batch of prefetch_prices
+        return quote_cache.get(self.crypto_codename, self.fetch_price)
+
+    @classmethod
+    def fetch_price(cls, symbol: str) -> float:
         # get current price from yahoo
-        yahoo_dat = (urllib.request.urlopen(f"https://query1.finance.yahoo.com/v8/finance/chart/{self.crypto_codename}")
-                     .read().decode("utf-8"))
-        result_dictionary = json.loads(yahoo_dat)
+        result_dictionary = http_client.get_json(f"{cls.base_url}/v8/finance/chart/{symbol}")
         return result_dictionary["chart"]["result"][0]["meta"]["regularMarketPrice"]
 
+    @classmethod
+    def fetch_chart(cls, symbol: str, start: float, end: float, interval: str = "1m"):
+        """
+        Fetches the OHLCV bars of [start, end) from yahoo's chart endpoint, split into as many requests as the interval
+        needs. Parts older than yahoo serves the interval are skipped.
+        :return: (bars, served_start): a structured array with lib.market_data.OHLCV_DTYPE and the start of the part
+            that was requested from yahoo, later than start if older bars were skipped
+        """
+        import numpy as np
+        from lib.market_data import OHLCV_DTYPE
+
+        if interval not in YAHOO_CHART_LIMITS:
+            raise ValueError(f"Yahoo does not serve {interval} bars. Use one of {', '.join(YAHOO_CHART_LIMITS)}")
+        max_span, max_age = YAHOO_CHART_LIMITS[interval]
+        if max_age is not None and start < time.time() - max_age:
+            logger.warning("Yahoo serves %s bars only for the last %s days, skipping older bars of %s", interval,
+                           max_age // DAY, symbol)
+            # a little margin, yahoo rejects requests that start right at the limit
+            start = time.time() - max_age + 60
+        served_start = start
+        parts = []
+        while start < end:
+            request_end = min(end, start + max_span)
+            result_dictionary = http_client.get_json(f"{cls.base_url}/v8/finance/chart/{symbol}", {
+                "period1": int(start), "period2": int(request_end), "interval": interval,
+                "includePrePost": "false"})
+            chart = result_dictionary["chart"]
+            if chart.get("error"):
+                raise ValueError(f"Chart request for {symbol} failed: {chart['error']}")
+            result = chart["result"][0]
+            timestamps = result.get("timestamp") or []
+            quote = (result.get("indicators", {}).get("quote") or [{}])[0]
+            bars = np.empty(len(timestamps), dtype=OHLCV_DTYPE)
+            bars["unix_timestamp"] = timestamps
+            for column in ("open", "high", "low", "close", "volume"):
+                # yahoo reports missing values as null
+                bars[column] = np.array(quote.get(column) or [None] * len(timestamps), dtype=np.float64)
+            parts.append(bars[~np.isnan(bars["close"])])
+            start = request_end
+        return np.concatenate(parts) if parts else np.empty(0, dtype=OHLCV_DTYPE), served_start
+
+    @classmethod
+    def get_current_prices(cls, symbols: Iterable[str],
+                           max_workers: int = DEFAULT_PRICE_FETCH_WORKERS) -> Dict[str, float]:
+        symbols = list(dict.fromkeys(symbols))
+        prices = {}
+        for start in range(0, len(symbols), YAHOO_SPARK_BATCH_SIZE):
+            batch = symbols[start:start + YAHOO_SPARK_BATCH_SIZE]
+            try:
+                prices.update(cls._fetch_yahoo_spark(batch))
+            except Exception as e:
+                logger.warning("Batch price request for %s failed: %r", ",".join(batch), e)
+        # price whatever the batch requests did not return one by one
+        missing = [symbol for symbol in symbols if symbol not in prices]
+        if missing:
+            prices.update(super().get_current_prices(missing, max_workers))
+        return prices
+
+    @classmethod
+    def _fetch_yahoo_spark(cls, symbols: list) -> Dict[str, float]:
+        result_dictionary = http_client.get_json(f"{cls.base_url}/v7/finance/spark",
+                                                 {"symbols": ",".join(symbols), "range": "1d", "interval": "1d"})
+        prices = {}
+        for result in result_dictionary["spark"]["result"]:
+            responses = result.get("response") or []
+            price = responses[0].get("meta", {}).get("regularMarketPrice") if responses else None
+            if price is not None:
+                prices[result["symbol"]] = price
+        return prices
+
     def buy_crypto(self, fiat_to_spend_amount: float) -> Tuple[bool, float]:
         if fiat_to_spend_amount > self._wallet_fiat_amount:
             logger.error(f"Not enough fiat to in wallet to spend requested amount {fiat_to_spend_amount}. "
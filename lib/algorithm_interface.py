@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
 
+from lib.candles import Bars
 from lib.exchange_interface import ExchangeInterface
 from lib.logger import logger
+from lib.metrics import instrument
+from lib.records import ActionRecord
 
 
 class AlgorithmInterface(ABC):
@@ -9,6 +12,8 @@ class AlgorithmInterface(ABC):
     id_in_list: str
     wallet_fiat_amount: float
     wallet_crypto_amount: float
+    # set to True by algorithms that implement evaluate_vectorized
+    supports_vectorized: bool = False
 
     def __init__(self, exchange: ExchangeInterface, id_in_list: str, cached_vars=None):
         if cached_vars is None:
@@ -18,6 +23,12 @@ class AlgorithmInterface(ABC):
         self.id_in_list = id_in_list
         self.set_current_vars(cached_vars)
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # record the latency of every action per job
+        if "perform_action" in cls.__dict__:
+            cls.perform_action = instrument("perform_action_seconds", job_labels)(cls.perform_action)
+
     @abstractmethod
     def get_current_vars(self) -> dict:
         """
@@ -35,109 +46,113 @@ class AlgorithmInterface(ABC):
         """
         pass
 
-    def perform_crypto_sale(self, crypto_to_sell_amount: float, expected_fiat_amount: float) -> dict:
+    def perform_crypto_sale(self, crypto_to_sell_amount: float, expected_fiat_amount: float) -> ActionRecord:
         """
-        Performs a crypto sale and returns a dictionary with the results.
+        Performs a crypto sale and returns an ActionRecord with the results.
         :param crypto_to_sell_amount: Amount of crypto to sell
         :param expected_fiat_amount: Expected amount of fiat to be received in the exchange.
-        :return: A dictionary with the following structure:
-            {
-                "action": "sell_crypto",
-                "action_result": str # "success" | "failure" | "partial"
-                "transacted_amount": float,  # The amount of fiat that was received or None
-            }
+        :return: An ActionRecord with action "sell_crypto", action_result "success" | "failure" | "partial" and the
+            amount of fiat that was received as transacted_amount. The wallet, price and timestamp fields are left to
+            perform_action.
         """
-        result_dict: dict = {
-            "action": "sell_crypto",
-            "action_result": None,
-            "transacted_amount": None
-        }
+        result = ActionRecord("sell_crypto")
         # perform sale on the exchange
-        logger.debug(f"{self.codename}: Selling {crypto_to_sell_amount} {self.exchange.crypto_codename} "
-                     f"for {expected_fiat_amount} fiat")
+        logger.debug("%s: Selling %s %s for %s fiat", self.codename, crypto_to_sell_amount,
+                     self.exchange.crypto_codename, expected_fiat_amount)
         action_success, received_fiat = self.exchange.sell_crypto(crypto_to_sell_amount)
 
         # evaluate sale results
         if action_success:
             if received_fiat != expected_fiat_amount:
-                result_dict["action_result"] = "partial"
-                logger.warning(
-                    f"{self.codename}: Partial crypto sale: Expected {expected_fiat_amount} fiat, received {received_fiat} fiat")
+                result.action_result = "partial"
+                logger.warning("%s: Partial crypto sale: Expected %s fiat, received %s fiat", self.codename,
+                               expected_fiat_amount, received_fiat)
             else:
-                result_dict["action_result"] = "success"
-                logger.info(
-                    f"{self.codename}: Successful crypto sale: Expected {expected_fiat_amount} fiat, received {received_fiat} fiat")
+                result.action_result = "success"
+                logger.info("%s: Successful crypto sale: Expected %s fiat, received %s fiat", self.codename,
+                            expected_fiat_amount, received_fiat)
         else:
-            result_dict["action_result"] = "failure"
-            logger.error(
-                f"{self.codename}: Failed crypto sale: Expected {expected_fiat_amount} fiat, received {received_fiat} fiat")
-        result_dict["transacted_amount"] = received_fiat
+            result.action_result = "failure"
+            logger.error("%s: Failed crypto sale: Expected %s fiat, received %s fiat", self.codename,
+                         expected_fiat_amount, received_fiat)
+        result.transacted_amount = received_fiat
 
         # update local wallet amounts with exchange reported amounts
         self.wallet_fiat_amount = self.exchange.get_fiat_wallet_amount()
         self.wallet_crypto_amount = self.exchange.get_crypto_wallet_amount()
 
-        return result_dict
+        return result
 
-    def perform_crypto_purchase(self, fiat_to_spend_amount: float, expected_crypto_amount: float) -> dict:
+    def perform_crypto_purchase(self, fiat_to_spend_amount: float, expected_crypto_amount: float) -> ActionRecord:
         """
-        Performs a crypto purchase and returns a dictionary with the results.
+        Performs a crypto purchase and returns an ActionRecord with the results.
         :param fiat_to_spend_amount: Amount of fiat to spend
         :param expected_crypto_amount: Expected amount of crypto to be received
-        :return: A dictionary with the following structure:
-            {
-                "action": "buy_crypto",
-                "action_result": str, # "success", "failure" or "partial"
-                "transacted_amount": float,  # The amount of crypto that was bought or None
-            }
+        :return: An ActionRecord with action "buy_crypto", action_result "success" | "failure" | "partial" and the
+            amount of crypto that was bought as transacted_amount. The wallet, price and timestamp fields are left to
+            perform_action.
         """
-        result_dict: dict = {
-            "action": "buy_crypto",
-            "action_result": None,
-            "transacted_amount": None
-        }
+        result = ActionRecord("buy_crypto")
 
         # perform purchase on the exchange
-        logger.debug(f"{self.codename}: Purchasing {expected_crypto_amount} {self.exchange.crypto_codename} "
-                     f"for {fiat_to_spend_amount} fiat")
+        logger.debug("%s: Purchasing %s %s for %s fiat", self.codename, expected_crypto_amount,
+                     self.exchange.crypto_codename, fiat_to_spend_amount)
         action_success, bought_amount = self.exchange.buy_crypto(fiat_to_spend_amount)
 
         # evaluate purchase results
         if action_success:
             if bought_amount != expected_crypto_amount:
-                result_dict["action_result"] = "partial"
-                logger.warning(
-                    f"{self.codename}: Partial purchase: Expected {expected_crypto_amount}, received {bought_amount}")
+                result.action_result = "partial"
+                logger.warning("%s: Partial purchase: Expected %s, received %s", self.codename,
+                               expected_crypto_amount, bought_amount)
             else:
-                result_dict["action_result"] = "success"
-                logger.info(
-                    f"{self.codename}: Successful purchase: Expected {expected_crypto_amount}, received {bought_amount}")
+                result.action_result = "success"
+                logger.info("%s: Successful purchase: Expected %s, received %s", self.codename,
+                            expected_crypto_amount, bought_amount)
         else:
-            result_dict["action_result"] = "failure"
-            logger.error(
-                f"{self.codename}: Failed purchase: Expected {expected_crypto_amount}, received {bought_amount}")
-        result_dict["transacted_amount"] = bought_amount
+            result.action_result = "failure"
+            logger.error("%s: Failed purchase: Expected %s, received %s", self.codename,
+                         expected_crypto_amount, bought_amount)
+        result.transacted_amount = bought_amount
 
         # update local wallet amounts with exchange reported amounts
         self.wallet_fiat_amount = self.exchange.get_fiat_wallet_amount()
         self.wallet_crypto_amount = self.exchange.get_crypto_wallet_amount()
 
-        return result_dict
+        return result
+
+    def get_candles(self, timeframe: str, count: int = None, include_open: bool = True) -> Bars:
+        """
+        Returns the last count OHLC bars of the traded crypto at timeframe (see ExchangeInterface.get_candles). The
+        bars are a snapshot shared by all jobs on the same crypto and are never modified afterwards.
+        :param timeframe: One of the aggregated timeframes (candle_timeframes setting), e.g. "1m" or "1h"
+        :param count: Number of bars, all kept bars if None
+        :param include_open: Include the bar that is still in progress as the last bar
+        :return:
+        """
+        return self.exchange.get_candles(timeframe, count, include_open)
 
     @abstractmethod
-    def perform_action(self) -> dict:
+    def perform_action(self) -> ActionRecord:
         """
         Calculates the decision to buy or sell and performs it or does nothing .
-        :return: A dictionary with the following structure:
-            {
-                "action": str,  # "buy_crypto" | "sell_crypto" | "hold"
-                "action_result": str, # "success" | "failure" | "partial"
-                "transacted_amount": float,  # Amount that was bought or sold or None
-                "wallet_fiat_amount": float,  # Fiat that is currently in the exchange wallet
-                "wallet_crypto_amount": float,  # Crypto that is currently in the exchange wallet
-                "current_price": float # Reported market price at time of action
-                "unix_timestamp": int # The current unix timestamp
-                "id": str # id of the algorithm
-            }
+        :return: An ActionRecord with all fields set (see ActionRecord.__init__)
         """
         pass
+
+    @classmethod
+    def evaluate_vectorized(cls, timestamps, prices, exchange_vars: dict, algorithm_vars: dict) -> dict:
+        """
+        Optional bulk evaluation of a whole price series, used by backtests instead of calling perform_action once per
+        price. Must produce exactly the same results as replaying the series tick by tick through a Replay exchange.
+        :param timestamps: numpy array of unix timestamps
+        :param prices: numpy array of prices
+        :param exchange_vars: Exchange variables the replay would start with
+        :param algorithm_vars: Algorithm variables the replay would start with
+        :return: A dictionary as returned by lib.vectorized.threshold_kernel
+        """
+        raise NotImplementedError(f"{cls.__name__} does not support vectorized evaluation")
+
+
+def job_labels(algorithm: AlgorithmInterface) -> dict:
+    return {"job": f"{algorithm.codename}:{algorithm.id_in_list}", "exchange": algorithm.exchange.codename}
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Tuple
+
+from lib.algorithm_interface import AlgorithmInterface
+from lib.exchange_interface import ExchangeInterface
+from lib.logger import logger
+from lib.metrics import metrics, timed_from_queue
+from lib.records import ActionRecord
+from lib.scheduler import TickScheduler
+
+MAX_WORKER_THREADS = 128
+
+
+class AsyncExchangeInterface(ABC):
+    """
+    Coroutine variant of ExchangeInterface for exchanges with a native async client. See ExchangeInterface for the
+    meaning of each method.
+    """
+    codename: str
+
+    exchange_fee: float
+    crypto_codename: str
+
+    @abstractmethod
+    def get_current_vars(self) -> dict:
+        pass
+
+    @abstractmethod
+    def set_current_vars(self, new_vars: dict):
+        pass
+
+    @abstractmethod
+    async def get_current_price(self) -> float:
+        pass
+
+    @abstractmethod
+    async def get_crypto_wallet_amount(self) -> float:
+        pass
+
+    @abstractmethod
+    async def get_fiat_wallet_amount(self) -> float:
+        pass
+
+    @abstractmethod
+    async def buy_crypto(self, fiat_to_spend_amount: float) -> Tuple[bool, float]:
+        pass
+
+    @abstractmethod
+    async def sell_crypto(self, crypto_to_sell_amount: float) -> Tuple[bool, float]:
+        pass
+
+
+class AsyncAlgorithmInterface(ABC):
+    """
+    Coroutine variant of AlgorithmInterface. perform_action must return an ActionRecord with all fields set, like
+    AlgorithmInterface.perform_action.
+    """
+    codename: str
+    id_in_list: str
+    exchange: AsyncExchangeInterface | ExchangeInterface
+
+    @abstractmethod
+    def get_current_vars(self) -> dict:
+        pass
+
+    @abstractmethod
+    async def perform_action(self) -> ActionRecord:
+        pass
+
+
+class SyncAlgorithmAdapter(AsyncAlgorithmInterface):
+    """
+    Runs a blocking AlgorithmInterface (e.g. SafeTrade) inside the async engine. perform_action is executed in the
+    event loop's default thread pool, which is reused across ticks.
+    """
+
+    def __init__(self, algorithm: AlgorithmInterface):
+        self.wrapped = algorithm
+        self.codename = algorithm.codename
+        self.id_in_list = algorithm.id_in_list
+        self.exchange = algorithm.exchange
+
+    def get_current_vars(self) -> dict:
+        return self.wrapped.get_current_vars()
+
+    async def perform_action(self) -> ActionRecord:
+        return await asyncio.to_thread(timed_from_queue, self.wrapped.perform_action, time.perf_counter())
+
+
+class AsyncEngine:
+    """
+    Runs all jobs concurrently once per tick on a TickScheduler. Each job gets job_timeout seconds per tick; a job that
+    times out or fails is left out of that tick's results instead of stalling or aborting the other jobs.
+    """
+
+    def __init__(self, jobs: list, action_interval: float, job_timeout: float,
+                 on_tick_complete: Callable[[list], None], on_tick_start: Callable[[], None] = None):
+        """
+        :param jobs: AlgorithmInterface or AsyncAlgorithmInterface instances. Blocking ones are wrapped automatically.
+        :param action_interval: Seconds between ticks
+        :param job_timeout: Seconds a single job may take per tick
+        :param on_tick_complete: Called in a worker thread with a list of (algorithm, action_report) tuples
+        :param on_tick_start: Optionally called in a worker thread before the jobs of a tick are started, e.g. to
+            prefetch prices
+        """
+        self.jobs = [job if isinstance(job, AsyncAlgorithmInterface) else SyncAlgorithmAdapter(job) for job in jobs]
+        self.scheduler = TickScheduler(action_interval)
+        self.job_timeout = job_timeout
+        self.on_tick_complete = on_tick_complete
+        self.on_tick_start = on_tick_start
+        self.timed_out_jobs = 0
+        # job -> task of an action that timed out, collected by the first tick after it finished. Jobs whose timed out
+        # action is still running are not started again
+        self._running = {}
+
+    async def _run_job(self, job: AsyncAlgorithmInterface) -> list:
+        """
+        :return: The (job, action_report) tuples of the job for this tick: the result of an action that timed out in
+            an earlier tick and finished since, and the result of this tick's action
+        """
+        results = []
+        task = self._running.get(job)
+        if task is not None:
+            if not task.done():
+                logger.warning(f"{job.codename} {job.id_in_list}: previous action still running, skipping this tick")
+                return results
+            # the purchase or sale happened on the exchange, so its late result still has to be persisted
+            del self._running[job]
+            try:
+                results.append((job, task.result()))
+            except Exception as e:
+                logger.error(f"{job.codename} {job.id_in_list}: timed out action failed: {e!r}")
+        task = asyncio.ensure_future(job.perform_action())
+        try:
+            # shield the task so a timeout does not cancel a purchase or sale halfway through
+            results.append((job, await asyncio.wait_for(asyncio.shield(task), self.job_timeout)))
+        except asyncio.TimeoutError:
+            self._running[job] = task
+            self.timed_out_jobs += 1
+            metrics.increment("job_timeouts_total", job=f"{job.codename}:{job.id_in_list}")
+            logger.error(f"{job.codename} {job.id_in_list}: action timed out after {self.job_timeout}s")
+        except Exception as e:
+            logger.error(f"{job.codename} {job.id_in_list}: action failed: {e!r}")
+        return results
+
+    async def run_tick(self) -> list:
+        if self.on_tick_start is not None:
+            try:
+                await asyncio.to_thread(self.on_tick_start)
+            except Exception as e:
+                logger.error(f"Preparing the tick failed: {e!r}")
+        job_results = await asyncio.gather(*(self._run_job(job) for job in self.jobs))
+        completed = [result for results in job_results for result in results]
+        # persistence is blocking I/O, keep it off the event loop
+        await asyncio.to_thread(self.on_tick_complete, completed)
+        return completed
+
+    async def run_forever(self):
+        # one worker thread per blocking job plus one for persistence, created once instead of per tick
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=min(len(self.jobs) + 1, MAX_WORKER_THREADS)))
+        while True:
+            logger.info(f"Performing actions...")
+            tick_start = time.monotonic()
+            completed = await self.run_tick()
+            metrics.observe("tick_seconds", time.monotonic() - tick_start)
+            logger.info(f"Tick finished in {time.monotonic() - tick_start:.2f}s, "
+                        f"{len(completed)}/{len(self.jobs)} jobs completed")
+            logger.info(f"Tick metrics: {metrics.tick_summary()}")
+
+            wait_time = self.scheduler.time_until_next_tick()
+            logger.info(f"Sleeping until next action ({wait_time:.2f}s)")
+            await asyncio.sleep(wait_time)
+
@@ -0,0 +1,118 @@
+import logging
+import math
+import time
+from typing import Iterator
+
+import numpy as np
+
+from exchanges.replay import Replay
+from lib.history_store import HistoryBackend, ACTIONS, ACTION_RESULTS
+from lib.logger import logger
+from lib.records import ActionRecord
+from lib.vectorized import iter_action_records
+
+BACKTEST_HISTORY_DIR = "cache/backtest/history"
+
+
+class ReplayRun:
+    """
+    Tick-by-tick replay of a price series through one algorithm. Iterating yields the action reports.
+    """
+
+    def __init__(self, algorithm_class, algo_id, exchange_vars: dict, algorithm_vars: dict, timestamps: np.ndarray,
+                 prices: np.ndarray):
+        self.exchange = Replay(dict(exchange_vars), timestamps, prices)
+        self.algorithm = algorithm_class(self.exchange, algo_id, dict(algorithm_vars or {}))
+
+    def __iter__(self) -> Iterator[ActionRecord]:
+        # per-tick debug and info lines would dominate the replay time
+        previous_level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            while True:
+                yield self.algorithm.perform_action()
+                if not self.exchange.advance():
+                    break
+        finally:
+            logger.setLevel(previous_level)
+
+
+def run_backtest(algorithm_class, algo_id, exchange_vars: dict, algorithm_vars: dict, timestamps: np.ndarray,
+                 prices: np.ndarray, history_backend: HistoryBackend, vectorized: bool = False) -> dict:
+    """
+    Replays a price series through one algorithm as fast as possible. Every tick is written to history_backend in the
+    same record layout as log_action, under the exchange name "Replay".
+    :param algorithm_class: An AlgorithmInterface subclass, e.g. SafeTrade
+    :param algo_id: Id stored with every history record
+    :param exchange_vars: Exchange variables as in settings.yaml (crypto_codename, exchange_fee, wallets)
+    :param algorithm_vars: Algorithm variables as in settings.yaml
+    :param timestamps: Unix timestamps of the replayed prices
+    :param prices: Replayed prices
+    :param history_backend: Backend that receives the history records
+    :param vectorized: Use the algorithm's evaluate_vectorized if it supports it
+    :return: A summary dictionary with the final algorithm and exchange variables
+    """
+    start = time.perf_counter()
+    if vectorized and algorithm_class.supports_vectorized:
+        result = algorithm_class.evaluate_vectorized(timestamps, prices, exchange_vars, algorithm_vars or {})
+        for record in iter_action_records(result, algo_id):
+            history_backend.append(Replay.__name__, algorithm_class.__name__, record)
+        final_exchange_vars = dict(exchange_vars)
+        final_exchange_vars["wallet_crypto_amount"] = result["wallet_crypto_amount_final"]
+        final_exchange_vars["wallet_fiat_amount"] = result["wallet_fiat_amount_final"]
+        final_algorithm_vars = {
+            "last_bought_price": result["last_bought_price"],
+            "last_sold_price": result["last_sold_price"],
+            "wallet_crypto_amount": result["wallet_crypto_amount_final"],
+            "wallet_fiat_amount": result["wallet_fiat_amount_final"]
+        }
+    else:
+        if vectorized:
+            logger.warning(f"{algorithm_class.__name__} does not support vectorized evaluation, replaying per tick")
+        replay = ReplayRun(algorithm_class, algo_id, exchange_vars, algorithm_vars, timestamps, prices)
+        exchange_name = replay.exchange.codename
+        algorithm_name = replay.algorithm.codename
+        append = history_backend.append
+        for action_report in replay:
+            append(exchange_name, algorithm_name, action_report)
+        final_exchange_vars = replay.exchange.get_current_vars()
+        final_algorithm_vars = replay.algorithm.get_current_vars()
+    history_backend.commit()
+
+    return {
+        "id": algo_id,
+        "codename": algorithm_class.__name__,
+        "ticks": len(prices),
+        "seconds": time.perf_counter() - start,
+        "algorithm_vars": final_algorithm_vars,
+        "exchange_vars": final_exchange_vars
+    }
+
+
+def verify_vectorized_parity(algorithm_class, algo_id, exchange_vars: dict, algorithm_vars: dict,
+                             timestamps: np.ndarray, prices: np.ndarray) -> int:
+    """
+    Replays the series tick by tick and compares every action report with the algorithm's evaluate_vectorized result.
+    Values must match exactly, not just approximately.
+    :return: The number of mismatching ticks (mismatches are logged)
+    """
+    result = algorithm_class.evaluate_vectorized(timestamps, prices, exchange_vars, algorithm_vars or {})
+    replay = ReplayRun(algorithm_class, algo_id, exchange_vars, algorithm_vars, timestamps, prices)
+    mismatches = 0
+    for tick, action_report in enumerate(replay):
+        transacted_amount = float(result["transacted_amount"][tick])
+        expected = {
+            "action": ACTIONS[result["action"][tick]],
+            "action_result": ACTION_RESULTS[result["action_result"][tick]],
+            "transacted_amount": None if math.isnan(transacted_amount) else transacted_amount,
+            "wallet_fiat_amount": float(result["wallet_fiat_amount"][tick]),
+            "wallet_crypto_amount": float(result["wallet_crypto_amount"][tick]),
+            "current_price": float(result["current_price"][tick]),
+            "unix_timestamp": float(result["unix_timestamp"][tick])
+        }
+        differences = {key: (getattr(action_report, key), value) for key, value in expected.items()
+                       if getattr(action_report, key) != value}
+        if differences:
+            mismatches += 1
+            logger.error(f"{algorithm_class.__name__}: vectorized result differs at tick {tick}: {differences}")
+    return mismatches
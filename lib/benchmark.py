@@ -0,0 +1,251 @@
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Tuple
+
+from lib.candles import configure_candles
+from lib.exchange_interface import ExchangeInterface
+from lib.history_reader import HistoryReader
+from lib.history_store import configure_history, get_history_backend
+from lib.logger import logger, log_action, flush_history, store_state
+from lib.metrics import metrics
+from lib.plugins import load_class
+from lib.records import ActionRecord, JobState
+from lib.state_store import configure_state_store, StateStore
+
+BENCHMARK_OUTPUT = "cache/benchmark.json"
+TICK_JOB_COUNTS = (1, 10, 100, 1000)
+HISTORY_SIZES = (0, 10_000, 100_000)
+GRAPH_HISTORY_SIZES = (10_000, 100_000)
+RESTORE_JOB_COUNTS = (100, 1000)
+# a benchmark that got slower than its baseline by more than this factor is reported as a regression
+DEFAULT_REGRESSION_THRESHOLD = 1.2
+
+
+class StubExchange(ExchangeInterface):
+    """
+    Network-free exchange for benchmarks. All instances share a deterministic price curve that moves one step per
+    advance(), so jobs trade like they would on a volatile market.
+    """
+    step = 0
+
+    def __init__(self, cached_vars=None):
+        super().__init__()
+        self.set_current_vars(cached_vars or {"crypto_codename": "STUB-EUR", "exchange_fee": 0.001,
+                                              "wallet_crypto_amount": 0.0, "wallet_fiat_amount": 100.0})
+
+    @classmethod
+    def advance(cls):
+        cls.step += 1
+
+    def get_current_vars(self) -> dict:
+        return {
+            "crypto_codename": self.crypto_codename,
+            "exchange_fee": self.exchange_fee,
+            "wallet_crypto_amount": self._wallet_crypto_amount,
+            "wallet_fiat_amount": self._wallet_fiat_amount
+        }
+
+    def set_current_vars(self, new_vars: dict):
+        self.crypto_codename = new_vars["crypto_codename"]
+        self.exchange_fee = new_vars["exchange_fee"]
+        self._wallet_crypto_amount = new_vars["wallet_crypto_amount"]
+        self._wallet_fiat_amount = new_vars["wallet_fiat_amount"]
+
+    def get_current_price(self) -> float:
+        return 30000.0 * (1 + 0.02 * math.sin(self.step * 0.9))
+
+    def get_crypto_wallet_amount(self) -> float:
+        return self._wallet_crypto_amount
+
+    def get_fiat_wallet_amount(self) -> float:
+        return self._wallet_fiat_amount
+
+    def buy_crypto(self, fiat_to_spend_amount: float) -> Tuple[bool, float]:
+        self._wallet_crypto_amount = fiat_to_spend_amount / self.get_current_price() * (1 - self.exchange_fee)
+        self._wallet_fiat_amount -= fiat_to_spend_amount
+        return True, self._wallet_crypto_amount
+
+    def sell_crypto(self, crypto_to_sell_amount: float) -> Tuple[bool, float]:
+        received = crypto_to_sell_amount * self.get_current_price() * (1 - self.exchange_fee)
+        self._wallet_fiat_amount += received
+        self._wallet_crypto_amount -= crypto_to_sell_amount
+        return True, received
+
+
+def _measure(function: Callable[[], None], repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {"median": statistics.median(durations), "min": min(durations), "repeat": repeat}
+
+
+def _create_jobs(count: int) -> list:
+    algorithm_class = load_class("algorithms", "SafeTrade")
+    algorithm_vars = {"last_bought_price": 30000.0, "last_sold_price": 30100.0}
+    return [algorithm_class(StubExchange(), str(algo_id), dict(algorithm_vars)) for algo_id in range(count)]
+
+
+def _report(algo_id: int, step: int) -> ActionRecord:
+    return ActionRecord("hold", None, None, 100.0, 0.0, 30000.0 + step % 100, 1700000000.0 + step * 60, str(algo_id))
+
+
+def _fill_history(exchange_name: str, algorithm_name: str, records: int, ids: int = 10):
+    backend = get_history_backend()
+    for step in range(records):
+        backend.append(exchange_name, algorithm_name, _report(step % ids, step))
+    backend.commit()
+
+
+def _job_state(job_count: int) -> dict:
+    return {"exchanges": {"StubExchange": {"algorithms": [
+        {"id": str(algo_id), "codename": "SafeTrade",
+         "algorithm_vars": {"last_bought_price": 30000.0, "last_sold_price": 30100.0, "wallet_crypto_amount": 0.0,
+                            "wallet_fiat_amount": 100.0},
+         "exchange_vars": {"crypto_codename": "STUB-EUR", "exchange_fee": 0.001, "wallet_crypto_amount": 0.0,
+                           "wallet_fiat_amount": 100.0}} for algo_id in range(job_count)]}}}
+
+
+def run_benchmarks(run_tick: Callable, persist_results: Callable, history_backend: str = "jsonl",
+                   repeat: int = 5) -> dict:
+    """
+    Runs all benchmarks in a temporary directory and returns the results.
+    :param run_tick: main.run_tick, called as run_tick(executor, jobs)
+    :param persist_results: main.persist_results
+    :param history_backend: History backend to benchmark (see history_store.BACKENDS)
+    :param repeat: Number of measurements per benchmark, the median is compared against baselines
+    :return: {"meta": {...}, "results": {name: {"median", "min", "repeat"}}} with durations in seconds
+    """
+    results: Dict[str, dict] = {}
+    working_dir = os.getcwd()
+    previous_level = logger.level
+    # per-job log lines would only measure the console
+    logger.setLevel(logging.WARNING)
+    metrics.enabled = True
+    with tempfile.TemporaryDirectory(prefix="volatenium-benchmark-") as directory:
+        os.chdir(directory)
+        try:
+            # one full tick of the trading loop: all actions plus history and state persistence
+            for job_count in TICK_JOB_COUNTS:
+                configure_history(history_backend, root=os.path.join("ticks", str(job_count), "history"))
+                configure_state_store(root=os.path.join("ticks", str(job_count)))
+                configure_candles(root=os.path.join("ticks", str(job_count), "candles"))
+                jobs = _create_jobs(job_count)
+                with ThreadPoolExecutor() as executor:
+                    def tick():
+                        StubExchange.advance()
+                        persist_results(run_tick(executor, jobs))
+
+                    tick()
+                    results[f"tick_{job_count}_jobs"] = _measure(tick, repeat)
+
+            # persistence against existing history of growing size, 100 jobs per tick
+            for history_size in HISTORY_SIZES:
+                configure_history(history_backend, root=os.path.join("persist", str(history_size), "history"))
+                configure_state_store(root=os.path.join("persist", str(history_size)))
+                _fill_history("StubExchange", "SafeTrade", history_size)
+                step = [0]
+
+                def log_tick():
+                    step[0] += 1
+                    for algo_id in range(100):
+                        log_action(_report(algo_id, step[0]), "StubExchange", "SafeTrade")
+                    flush_history()
+
+                results[f"log_action_100_jobs_{history_size}_records"] = _measure(log_tick, repeat)
+                state = _job_state(100)
+
+                def store_tick():
+                    step[0] += 1
+                    # every job changed, the worst case for the incremental state store
+                    for entry in state["exchanges"]["StubExchange"]["algorithms"]:
+                        # a new dictionary, the store holds on to the previous one
+                        entry["algorithm_vars"] = dict(entry["algorithm_vars"], last_bought_price=30000.0 + step[0])
+                    store_state(state)
+
+                results[f"store_state_100_jobs_{history_size}_records"] = _measure(store_tick, repeat)
+
+            # history loading as done by generate_graph, first without and then with the segment index
+            for history_size in GRAPH_HISTORY_SIZES:
+                backend = configure_history(history_backend, segment_size=1024 * 1024,
+                                            root=os.path.join("graph", str(history_size), "history"))
+                _fill_history("StubExchange", "SafeTrade", history_size)
+
+                def cold_load():
+                    for path, _, files in os.walk(backend.root):
+                        for file_name in files:
+                            if file_name == "index.json" or file_name.endswith(".npy"):
+                                os.remove(os.path.join(path, file_name))
+                    HistoryReader(backend).load("StubExchange", "SafeTrade", "1")
+
+                results[f"graph_load_cold_{history_size}_records"] = _measure(cold_load, repeat)
+                results[f"graph_load_warm_{history_size}_records"] = _measure(
+                    lambda: HistoryReader(backend).load("StubExchange", "SafeTrade", "1"), repeat)
+            from lib.graph_generator import generate_graph
+
+            # generate_graph saves to cache/graph.svg
+            os.makedirs("cache", exist_ok=True)
+            results["generate_graph_10000_records"] = _measure(
+                lambda: generate_graph("SafeTrade", "StubExchange", "1",
+                                       HistoryReader(configure_history(history_backend, segment_size=1024 * 1024,
+                                                                       root=os.path.join("graph", "10000",
+                                                                                         "history")))), repeat)
+
+            # startup: restoring the state of all jobs and creating them
+            for job_count in RESTORE_JOB_COUNTS:
+                root = os.path.join("restore", str(job_count))
+                state_store = StateStore(root)
+                for entry in _job_state(job_count)["exchanges"]["StubExchange"]["algorithms"]:
+                    state_store.update("StubExchange", JobState.from_dict(entry))
+                state_store.commit()
+                results[f"restore_state_{job_count}_jobs"] = _measure(lambda: StateStore(root).load(), repeat)
+                results[f"create_jobs_{job_count}_jobs"] = _measure(lambda: _create_jobs(job_count), repeat)
+        finally:
+            get_history_backend().close()
+            os.chdir(working_dir)
+            logger.setLevel(previous_level)
+            metrics.enabled = False
+
+    return {
+        "meta": {
+            "created": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "history_backend": history_backend,
+            "repeat": repeat
+        },
+        "results": results
+    }
+
+
+def compare_with_baseline(report: dict, baseline: dict,
+                          threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> Dict[str, dict]:
+    """
+    Compares the medians of report with those of an earlier report.
+    :return: name -> {"median", "baseline", "ratio", "regression"} for every benchmark in both reports
+    """
+    comparison = {}
+    for name, result in report["results"].items():
+        baseline_result = baseline.get("results", {}).get(name)
+        if baseline_result is None or baseline_result["median"] <= 0:
+            continue
+        ratio = result["median"] / baseline_result["median"]
+        comparison[name] = {"median": result["median"], "baseline": baseline_result["median"], "ratio": ratio,
+                            "regression": ratio > threshold}
+    return comparison
+
+
+def write_report(report: dict, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
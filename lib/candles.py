@@ -0,0 +1,281 @@
+import json
+import os
+import struct
+import threading
+import time
+import urllib.parse
+from array import array
+from typing import Dict, List, Tuple
+
+from lib.logger import logger
+
+CANDLE_DIR = "cache/candles"
+DEFAULT_TIMEFRAMES = ("1m", "5m", "15m", "1h", "1d")
+# bars kept per symbol and timeframe
+DEFAULT_CAPACITY = 500
+OPEN_BARS_FILE = "open.json"
+# start, open, high, low, close, ticks
+BAR_RECORD = struct.Struct("<dddddd")
+_INTERVAL_UNITS = {"m": 60, "h": 3600, "d": 86400, "wk": 604800}
+
+
+def interval_seconds(interval: str) -> int:
+    """
+    Converts a yahoo style interval ("1m", "15m", "1h", "1d", "1wk") into seconds.
+    """
+    for unit, seconds in _INTERVAL_UNITS.items():
+        if interval.endswith(unit) and interval[:-len(unit)].isdigit():
+            return int(interval[:-len(unit)]) * seconds
+    raise ValueError(f"Unknown interval: {interval}")
+
+
+class Bars:
+    """
+    Snapshot of the bars of one symbol and timeframe, oldest first. Every field is a tuple with one entry per bar;
+    start is the unix timestamp the bar starts at and ticks the number of prices it was built from. Unless requested
+    otherwise the last bar is the one still in progress.
+    """
+    __slots__ = ("timeframe", "start", "open", "high", "low", "close", "ticks")
+
+    def __init__(self, timeframe: str, start: tuple, open: tuple, high: tuple, low: tuple, close: tuple, ticks: tuple):
+        self.timeframe = timeframe
+        self.start = start
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.ticks = ticks
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def __repr__(self) -> str:
+        return f"Bars(timeframe={self.timeframe!r}, bars={len(self)})"
+
+
+class CandleSeries:
+    """
+    The last capacity bars of one symbol and timeframe in fixed size arrays (one array('d') per field, used as a
+    ring). The newest bar is updated in place until a price of a later bar arrives.
+    """
+    __slots__ = ("seconds", "capacity", "_columns", "_head", "count", "closed")
+
+    def __init__(self, seconds: int, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.seconds = seconds
+        self.capacity = capacity
+        self._columns = tuple(array("d", bytes(8 * capacity)) for _ in range(BAR_RECORD.size // 8))
+        # position of the newest bar
+        self._head = 0
+        self.count = 0
+        # bars closed since the last commit of the aggregator
+        self.closed: List[tuple] = []
+
+    def update(self, price: float, unix_timestamp: float):
+        start = unix_timestamp // self.seconds * self.seconds
+        if self.count:
+            starts, _, highs, lows, closes, ticks = self._columns
+            head = self._head
+            if start == starts[head]:
+                if price > highs[head]:
+                    highs[head] = price
+                elif price < lows[head]:
+                    lows[head] = price
+                closes[head] = price
+                ticks[head] += 1
+                return
+            if start < starts[head]:
+                # a price of an earlier bar, e.g. from a delayed fetch
+                return
+            self.closed.append(self.newest())
+        self.push((start, price, price, price, price, 1.0))
+
+    def push(self, bar: tuple):
+        """
+        Appends a complete (start, open, high, low, close, ticks) bar, dropping the oldest one if the series is full.
+        """
+        if self.count:
+            self._head = (self._head + 1) % self.capacity
+        for column, value in zip(self._columns, bar):
+            column[self._head] = value
+        self.count = min(self.count + 1, self.capacity)
+
+    def newest(self) -> tuple | None:
+        if not self.count:
+            return None
+        return tuple(column[self._head] for column in self._columns)
+
+    def snapshot(self, timeframe: str, count: int = None, include_open: bool = True) -> Bars:
+        available = self.count if include_open else max(0, self.count - 1)
+        count = available if count is None else min(count, available)
+        # positions oldest first, ending at the newest bar or the one before it
+        end = self._head + 1 if include_open else self._head
+        positions = [(end - count + offset) % self.capacity for offset in range(count)]
+        return Bars(timeframe, *(tuple(column[position] for position in positions) for column in self._columns))
+
+
+class CandleAggregator:
+    """
+    Builds OHLC bars of several timeframes from a stream of prices, incrementally and in fixed size arrays (see
+    CandleSeries). One aggregator serves every job of the process, so each price of a symbol is aggregated once no
+    matter how many jobs trade it.
+
+    With a root directory, commit() persists the bars for warm restarts: closed bars are appended to
+    <root>/<symbol>/<timeframe>.bin (BAR_RECORD records), the bars in progress are rewritten into <root>/open.json.
+    """
+
+    def __init__(self, timeframes=DEFAULT_TIMEFRAMES, capacity: int = DEFAULT_CAPACITY, root: str = None):
+        """
+        :param timeframes: Yahoo style intervals, e.g. ("1m", "1h")
+        :param root: Directory the bars are persisted in, None to keep them only in memory
+        """
+        self.timeframes: Dict[str, int] = {timeframe: interval_seconds(timeframe) for timeframe in timeframes}
+        self.capacity = capacity
+        self.root = root
+        self._series: Dict[Tuple[str, str], CandleSeries] = {}
+        self._by_symbol: Dict[str, List[Tuple[str, CandleSeries]]] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _symbol_series(self, symbol: str) -> List[Tuple[str, CandleSeries]]:
+        symbol_series = self._by_symbol.get(symbol)
+        if symbol_series is None:
+            symbol_series = self._by_symbol[symbol] = [(timeframe, CandleSeries(seconds, self.capacity))
+                                                       for timeframe, seconds in self.timeframes.items()]
+            for timeframe, series in symbol_series:
+                self._series[(symbol, timeframe)] = series
+        return symbol_series
+
+    def update(self, symbol: str, price: float, unix_timestamp: float = None):
+        """
+        Adds a price of symbol to the bars of every timeframe.
+        :param unix_timestamp: Time of the price, defaults to now
+        """
+        unix_timestamp = time.time() if unix_timestamp is None else unix_timestamp
+        with self._lock:
+            for _, series in self._symbol_series(symbol):
+                series.update(price, unix_timestamp)
+            self._dirty.add(symbol)
+
+    def bars(self, symbol: str, timeframe: str, count: int = None, include_open: bool = True) -> Bars:
+        """
+        Returns the last count bars (all kept bars if None) of symbol.
+        :param include_open: Include the bar that is still in progress as the last bar
+        """
+        if timeframe not in self.timeframes:
+            raise ValueError(f"Bars of {timeframe} are not aggregated. Available: {', '.join(self.timeframes)}")
+        with self._lock:
+            series = self._series.get((symbol, timeframe))
+            if series is None:
+                return Bars(timeframe, (), (), (), (), (), ())
+            return series.snapshot(timeframe, count, include_open)
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return sorted(self._by_symbol)
+
+    def _series_path(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, urllib.parse.quote(symbol, safe="-_.=^"), f"{timeframe}.bin")
+
+    def load(self):
+        """
+        Restores the persisted bars of the configured timeframes.
+        """
+        if self.root is None or not os.path.isdir(self.root):
+            return
+        open_bars = {}
+        open_bars_path = os.path.join(self.root, OPEN_BARS_FILE)
+        if os.path.exists(open_bars_path):
+            try:
+                with open(open_bars_path, "r") as f:
+                    open_bars = json.load(f)
+            except ValueError:
+                logger.warning(f"Ignoring corrupt {open_bars_path}")
+        symbols = {urllib.parse.unquote(name) for name in os.listdir(self.root)
+                   if os.path.isdir(os.path.join(self.root, name))} | open_bars.keys()
+        with self._lock:
+            for symbol in symbols:
+                for timeframe, series in self._symbol_series(symbol):
+                    path = self._series_path(symbol, timeframe)
+                    if os.path.exists(path):
+                        for bar in self._read_tail(path):
+                            series.push(bar)
+                    open_bar = open_bars.get(symbol, {}).get(timeframe)
+                    newest = series.newest()
+                    if open_bar is not None and (newest is None or open_bar[0] > newest[0]):
+                        series.push(tuple(open_bar))
+        logger.info(f"Restored the bars of {len(symbols)} symbols from {self.root}")
+
+    def _read_tail(self, path: str) -> List[tuple]:
+        with open(path, "rb") as f:
+            # ignore a torn trailing record
+            records = os.path.getsize(path) // BAR_RECORD.size
+            f.seek(max(0, records - self.capacity) * BAR_RECORD.size)
+            data = f.read(min(records, self.capacity) * BAR_RECORD.size)
+        return list(BAR_RECORD.iter_unpack(data))
+
+    def commit(self):
+        """
+        Persists the bars that changed since the last commit. Meant to be called once per tick. Bars can be rebuilt
+        from prices, so unlike the history they are not fsynced.
+        """
+        if self.root is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            closed = {}
+            for symbol in self._dirty:
+                for timeframe, series in self._symbol_series(symbol):
+                    if series.closed:
+                        closed[(symbol, timeframe)] = series.closed
+                        series.closed = []
+            open_bars = {}
+            for (symbol, timeframe), series in self._series.items():
+                open_bars.setdefault(symbol, {})[timeframe] = series.newest()
+            self._dirty.clear()
+
+        for (symbol, timeframe), bars in closed.items():
+            path = self._series_path(symbol, timeframe)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(b"".join(BAR_RECORD.pack(*bar) for bar in bars))
+            if os.path.getsize(path) > 2 * self.capacity * BAR_RECORD.size:
+                # only the last capacity bars are ever read again
+                tail = self._read_tail(path)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(b"".join(BAR_RECORD.pack(*bar) for bar in tail))
+                os.replace(path + ".tmp", path)
+        open_bars_path = os.path.join(self.root, OPEN_BARS_FILE)
+        os.makedirs(self.root, exist_ok=True)
+        with open(open_bars_path + ".tmp", "w") as f:
+            json.dump(open_bars, f)
+        os.replace(open_bars_path + ".tmp", open_bars_path)
+
+
+_candle_aggregator: CandleAggregator | None = None
+_unsubscribe = None
+
+
+def configure_candles(timeframes=DEFAULT_TIMEFRAMES, capacity: int = DEFAULT_CAPACITY,
+                      root: str = None) -> CandleAggregator:
+    """
+    Replaces the process-wide aggregator, restores its persisted bars and feeds it with every price that enters the
+    quote cache (batch prefetches, shard price broadcasts, streamed prices and single fetches alike).
+    """
+    from lib.quote_cache import quote_cache
+
+    global _candle_aggregator, _unsubscribe
+    if _unsubscribe is not None:
+        _unsubscribe()
+    _candle_aggregator = CandleAggregator(timeframes, capacity, root)
+    _candle_aggregator.load()
+    _unsubscribe = quote_cache.subscribe(_candle_aggregator.update)
+    return _candle_aggregator
+
+
+def get_candle_aggregator() -> CandleAggregator:
+    if _candle_aggregator is None:
+        return configure_candles()
+    return _candle_aggregator
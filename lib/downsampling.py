@@ -0,0 +1,76 @@
+import numpy as np
+
+# number of min/max candidates per output point that minmax_lttb preselects before running LTTB
+DEFAULT_MINMAX_RATIO = 4
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps the first and last point and from each of n_out - 2 equally
+    sized buckets in between the point that forms the largest triangle with the previously kept point and the average
+    of the next bucket.
+    :param x: Increasing x values, e.g. timestamps
+    :return: Sorted indices of the kept points (all indices if there are at most n_out points)
+    """
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+    if n_out < 3:
+        raise ValueError("n_out must be at least 3")
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # averages of every bucket, the last bucket looks ahead at the last point
+    average_x = np.append(np.add.reduceat(x[1:n - 1], starts - 1) / counts, x[n - 1])
+    average_y = np.append(np.add.reduceat(y[1:n - 1], starts - 1) / counts, y[n - 1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = starts[bucket], edges[bucket + 1]
+        previous_x, previous_y = x[previous], y[previous]
+        next_x, next_y = average_x[bucket + 1], average_y[bucket + 1]
+        # twice the triangle area, the constant factor does not change the argmax
+        areas = np.abs((previous_x - next_x) * (y[start:end] - previous_y)
+                       - (previous_x - x[start:end]) * (next_y - previous_y))
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_lttb(x: np.ndarray, y: np.ndarray, n_out: int, minmax_ratio: int = DEFAULT_MINMAX_RATIO) -> np.ndarray:
+    """
+    Downsamples to about n_out points without losing spikes: the minimum and maximum of n_out * minmax_ratio / 2
+    buckets are preselected in one vectorized pass, LTTB picks n_out points among them, and the global minimum and
+    maximum are always kept.
+    :return: Sorted indices of the kept points (at most n_out + 2)
+    """
+    n = len(x)
+    y = np.asarray(y, dtype=np.float64)
+    if n <= n_out:
+        return np.arange(n)
+    extremes = [int(y.argmin()), int(y.argmax())]
+    if n <= n_out * minmax_ratio:
+        return np.union1d(lttb(x, y, n_out), extremes)
+
+    buckets = n_out * minmax_ratio // 2
+    edges = np.linspace(1, n - 1, buckets + 1).astype(np.int64)
+    interior = y[1:n - 1]
+    starts = edges[:-1] - 1
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+
+    def first_match(bucket_values: np.ndarray) -> np.ndarray:
+        matches = np.flatnonzero(interior == bucket_values[bucket_of])
+        # matches are sorted, so the first match of every bucket starts a run of equal bucket numbers
+        matched_buckets = bucket_of[matches]
+        first = np.flatnonzero(np.diff(matched_buckets, prepend=-1))
+        return matches[first] + 1
+
+    candidates = np.unique(np.concatenate((
+        [0], first_match(np.minimum.reduceat(interior, starts)), first_match(np.maximum.reduceat(interior, starts)),
+        [n - 1])))
+    return np.union1d(candidates[lttb(np.asarray(x)[candidates], y[candidates], n_out)], extremes)
@@ -1,5 +1,18 @@
 from abc import ABC, abstractmethod
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+from lib.candles import Bars, get_candle_aggregator
+from lib.logger import logger
+from lib.metrics import instrument, metrics
+from lib.quote_cache import quote_cache
+
+# methods whose latency is recorded for every exchange implementation
+INSTRUMENTED_METHODS = ("get_current_price", "get_crypto_wallet_amount", "get_fiat_wallet_amount", "buy_crypto",
+                        "sell_crypto")
+# upper bound of concurrent requests when an exchange has no batch price request
+DEFAULT_PRICE_FETCH_WORKERS = 8
 
 
 class ExchangeInterface(ABC):
@@ -8,10 +21,22 @@ class ExchangeInterface(ABC):
     exchange_fee: float
     crypto_codename: str
 
+    # True if the price only depends on crypto_codename, so one quote per symbol can serve every instance. Prices of
+    # such exchanges are fetched in one batch per tick (see prefetch_prices) and read from the quote cache by
+    # get_current_price.
+    shared_quotes: bool = False
+
     @abstractmethod
     def __init__(self, cached_vars: dict = None):
         self.codename = self.__class__.__name__
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method in INSTRUMENTED_METHODS:
+            if method in cls.__dict__:
+                setattr(cls, method, instrument("exchange_call_seconds", exchange_labels, method=method)(
+                    cls.__dict__[method]))
+
     @abstractmethod
     def get_current_vars(self) -> dict:
         """
@@ -36,6 +61,58 @@ class ExchangeInterface(ABC):
         """
         pass
 
+    @classmethod
+    def fetch_price(cls, symbol: str) -> float:
+        """
+        Returns the current price of symbol without needing an instance. Required for shared_quotes exchanges that do
+        not override get_current_prices.
+        :return:
+        """
+        raise NotImplementedError(f"{cls.__name__} can not fetch prices by symbol")
+
+    @classmethod
+    def get_current_prices(cls, symbols: Iterable[str],
+                           max_workers: int = DEFAULT_PRICE_FETCH_WORKERS) -> Dict[str, float]:
+        """
+        Returns the current price of every symbol. Exchanges with a multi-symbol request should override this, the
+        default fans out to fetch_price with at most max_workers concurrent requests.
+        :param symbols: Symbols to price, e.g. ["BTC-EUR", "ETH-EUR"]
+        :param max_workers: Maximum number of concurrent requests
+        :return: A dictionary symbol -> price. Symbols that could not be priced are left out.
+        """
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+
+        def fetch(symbol: str):
+            try:
+                return symbol, cls.fetch_price(symbol)
+            except Exception as e:
+                logger.error("%s: Fetching the price of %s failed: %r", cls.__name__, symbol, e)
+                return symbol, None
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(symbols))) as executor:
+            return {symbol: price for symbol, price in executor.map(fetch, symbols) if price is not None}
+
+    def get_current_timestamp(self) -> float:
+        """
+        Returns the unix timestamp the current price belongs to. Live exchanges use the wall clock, replaying
+        exchanges return the timestamp of the replayed price.
+        :return:
+        """
+        return datetime.now().timestamp()
+
+    def get_candles(self, timeframe: str, count: int = None, include_open: bool = True) -> Bars:
+        """
+        Returns the last count bars of crypto_codename. Live exchanges read them from the process-wide candle
+        aggregator, which is fed with every price in the quote cache, so only shared_quotes exchanges have bars here.
+        :param timeframe: One of the aggregated timeframes, e.g. "1m" or "1h"
+        :param count: Number of bars, all kept bars if None
+        :param include_open: Include the bar that is still in progress as the last bar
+        :return:
+        """
+        return get_candle_aggregator().bars(self.crypto_codename, timeframe, count, include_open)
+
     @abstractmethod
     def get_crypto_wallet_amount(self) -> float:
         """
@@ -75,3 +152,23 @@ class ExchangeInterface(ABC):
             transaction fails.
         """
         pass
+
+
+def exchange_labels(exchange: ExchangeInterface) -> dict:
+    return {"exchange": exchange.codename, "symbol": exchange.crypto_codename}
+
+
+def prefetch_prices(exchanges: Iterable[ExchangeInterface]):
+    """
+    Fetches the prices of all symbols in use with one get_current_prices call per shared_quotes exchange class and
+    stores them in the quote cache, so the get_current_price calls of the following tick are served from memory.
+    """
+    symbols_by_class = {}
+    for exchange in exchanges:
+        if getattr(exchange, "shared_quotes", False):
+            symbols_by_class.setdefault(type(exchange), set()).add(exchange.crypto_codename)
+    for exchange_class, symbols in symbols_by_class.items():
+        with metrics.timed("price_fetch_seconds", exchange=exchange_class.__name__):
+            prices = exchange_class.get_current_prices(sorted(symbols))
+        for symbol, price in prices.items():
+            quote_cache.put(symbol, price)
@@ -1,64 +1,200 @@
-import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from fnmatch import fnmatchcase
+from typing import List, Tuple
 
 import matplotlib.dates as mdates
-from matplotlib import pyplot as plt
+import numpy as np
+# Figure without pyplot renders with the Agg canvas and needs no display or GUI backend
+from matplotlib.figure import Figure
 
+from lib.downsampling import minmax_lttb
+from lib.history_reader import HistoryReader, action_mask, id_sort_key, parse_selector
 from lib.logger import logger
 
+GRAPH_OUTPUT_DIR = "cache/graphs"
+IMAGE_FORMATS = ("auto", "png", "svg")
+# points of each line after downsampling, "auto" switches to PNG for series longer than this
+DEFAULT_MAX_POINTS = 2000
+GRAPH_DPI = 150
+# ids of one series rendered by one worker task
+GRAPHS_PER_TASK = 16
+
+# reader of the worker process, opened once per worker
+_worker_reader = None
+# (exchange, algorithm, records sorted by id) of the series the worker rendered last, reused by its next task
+_worker_series = None
+
+
+def render_graph(columns: np.ndarray, title: str, output_path: str, image_format: str = "auto",
+                 max_points: int = DEFAULT_MAX_POINTS) -> str:
+    """
+    Renders the price line with buy and sell markers and, below it, the equity curve (fiat wallet plus crypto wallet
+    valued at the current price) against buying and holding. Lines are downsampled with minmax_lttb to max_points.
+    :param columns: History records of one id as returned by HistoryReader.load
+    :param output_path: Path without extension, the extension of the chosen format is appended
+    :param image_format: "png", "svg" or "auto" (SVG for short series, PNG for dense ones)
+    :return: The path of the written image
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}. Use one of {', '.join(IMAGE_FORMATS)}")
+    if image_format == "auto":
+        image_format = "svg" if len(columns) <= max_points else "png"
+
+    # Convert UNIX timestamps to matplotlib date format (UTC, displayed in local time by the formatter)
+    timestamps = mdates.date2num((columns["unix_timestamp"] * 1000).astype("datetime64[ms]"))
+    prices = np.asarray(columns["current_price"], dtype=np.float64)
+    equity = columns["fiat_wallet"] + columns["crypto_wallet"] * prices
+    buy_and_hold = equity[0] * prices / prices[0] if prices[0] else np.full(len(prices), equity[0])
+
+    fig = Figure(figsize=(12, 8))
+    price_ax, equity_ax = fig.subplots(2, 1, sharex=True, height_ratios=(2, 1))
+
+    price_points = minmax_lttb(timestamps, prices, max_points)
+    price_ax.plot(timestamps[price_points], prices[price_points], c="blue", linewidth=0.8, label="Price")
+    buy = action_mask(columns, "buy_crypto")
+    sell = action_mask(columns, "sell_crypto")
+    price_ax.scatter(timestamps[buy], prices[buy], c="red", s=20, label="Buy", zorder=3)
+    price_ax.scatter(timestamps[sell], prices[sell], c="green", s=20, label="Sell", zorder=3)
+    price_ax.set_ylabel("Crypto Price")
+    price_ax.set_title(title)
+    price_ax.legend()
+
+    equity_points = minmax_lttb(timestamps, equity, max_points)
+    equity_ax.plot(timestamps[equity_points], equity[equity_points], c="purple", linewidth=0.8, label="Equity")
+    hold_points = minmax_lttb(timestamps, buy_and_hold, max_points)
+    equity_ax.plot(timestamps[hold_points], buy_and_hold[hold_points], c="gray", linewidth=0.8, linestyle="--",
+                   label="Buy and hold")
+    equity_ax.set_ylabel("Equity (fiat)")
+    equity_ax.set_xlabel("Timestamp")
+    equity_ax.legend()
 
-def generate_graph(algorithm_name: str, exchange_name: str, algo_id: str):
+    # Format x-axis as date and y-axis as human-readable numbers
+    equity_ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d %H:%M",
+                                                             tz=datetime.now().astimezone().tzinfo))
+    for ax in (price_ax, equity_ax):
+        ax.yaxis.get_major_formatter().set_scientific(False)
+    for label in equity_ax.get_xticklabels():
+        label.set_rotation(45)
+
+    fig.tight_layout()
+    path = f"{output_path}.{image_format}"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fig.savefig(path, format=image_format, dpi=GRAPH_DPI)
+    return path
+
+
+def generate_graph(algorithm_name: str, exchange_name: str, algo_id: str, reader=None,
+                   output_path: str = "cache/graph", image_format: str = "auto",
+                   max_points: int = DEFAULT_MAX_POINTS) -> str | None:
+    """
+    Renders the graph of one id (see render_graph).
+    :return: The path of the written image or None if there is no history for the id
+    """
     # Prepare data for plotting
-    with open("cache/history.json", "r") as f:
-        data = json.load(f)[exchange_name][algorithm_name]
-
-    if data is None:
+    if reader is None:
+        reader = HistoryReader()
+    if (exchange_name, algorithm_name) not in reader.series():
         logger.error(f"No data found for {algorithm_name} on {exchange_name}.")
-        return
+        return None
 
-    # Only use data from one id
-    filtered_data = [item for item in data if item["id"] == algo_id]
+    # Only load data from one id
+    filtered_data = reader.load(exchange_name, algorithm_name, algo_id)
 
-    if not filtered_data:
+    if len(filtered_data) == 0:
         logger.error(f"No data found for {exchange_name} on {algorithm_name} with id: {algo_id}.")
-        return
-
-    # Convert UNIX timestamps to datetime and then to matplotlib date format
-    timestamps = [mdates.date2num(datetime.fromtimestamp(item["unix_timestamp"])) for item in filtered_data]
-    prices = [item["current_price"] for item in filtered_data]
-
-    # Separate data by action type
-    buy_x = [timestamps[i] for i, item in enumerate(filtered_data) if item["action"] == "buy_crypto"]
-    buy_y = [prices[i] for i, item in enumerate(filtered_data) if item["action"] == "buy_crypto"]
-
-    sell_x = [timestamps[i] for i, item in enumerate(filtered_data) if item["action"] == "sell_crypto"]
-    sell_y = [prices[i] for i, item in enumerate(filtered_data) if item["action"] == "sell_crypto"]
-
-    hold_x = [timestamps[i] for i, item in enumerate(filtered_data) if item["action"] == "hold"]
-    hold_y = [prices[i] for i, item in enumerate(filtered_data) if item["action"] == "hold"]
-
-    # Plot
-    fig, ax = plt.subplots(figsize=(10, 6))
-
-    # Plot buy, sell, and hold actions
-    ax.scatter(buy_x, buy_y, c="red", s=20, label="Buy")
-    ax.scatter(sell_x, sell_y, c="green", s=20, label="Sell")
-    ax.scatter(hold_x, hold_y, c="blue", s=20, label="Hold")
-
-    # Format x-axis as date and y-axis as human-readable numbers
-    ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d %H:%M"))
-    ax.yaxis.get_major_formatter().set_scientific(False)
-
-    # Labels and legend
-    ax.set_xlabel("Timestamp")
-    ax.set_ylabel("Crypto Price")
-    plt.xticks(rotation=45)
-    ax.legend()
-    # add title
-    ax.set_title(f"{algorithm_name} on {exchange_name}")
-
-    # Save the graph as an SVG file at the specified path
-    plt.tight_layout()
-    plt.savefig("cache/graph.svg", format="svg")
-    logger.info(f"Graph saved at cache/graph.svg")
-    plt.close()
+        return None
+
+    path = render_graph(filtered_data, f"{algorithm_name} {algo_id} on {exchange_name}", output_path, image_format,
+                        max_points)
+    logger.info(f"Graph saved at {path}")
+    return path
+
+
+def select_graphs(reader, selectors: List[str]) -> List[Tuple[str, str, str]]:
+    """
+    Lists the (exchange, algorithm, id) of every id with history that matches at least one selector (shell-style
+    wildcards, see parse_selector). No selectors select everything.
+    """
+    patterns = [parse_selector(selector) for selector in selectors] or [("*", "*", "*")]
+    selected = []
+    for exchange_name, algorithm_name in reader.series():
+        series_patterns = [pattern for pattern in patterns if fnmatchcase(exchange_name, pattern[0])
+                           and fnmatchcase(algorithm_name, pattern[1])]
+        if not series_patterns:
+            continue
+        # loading the whole series once also builds the segment index and column files for the workers
+        ids = {raw_id.decode("utf-8") for raw_id in np.unique(reader.load(exchange_name, algorithm_name)["id"])}
+        for algo_id in sorted(ids, key=id_sort_key):
+            if any(fnmatchcase(algo_id, pattern[2]) for pattern in series_patterns):
+                selected.append((exchange_name, algorithm_name, algo_id))
+    return selected
+
+
+def _open_worker_reader(backend_class: type, root: str, segment_size: int):
+    from lib.sharding import open_history_reader
+
+    global _worker_reader, _worker_series
+    _worker_reader = open_history_reader(backend_class(root, segment_size))
+    _worker_series = None
+
+
+def _series_by_id(exchange_name: str, algorithm_name: str) -> np.ndarray:
+    """
+    Loads a series once per worker, sorted by id so that the records of every id are one slice.
+    """
+    global _worker_series
+    if _worker_series is None or _worker_series[:2] != (exchange_name, algorithm_name):
+        columns = _worker_reader.load(exchange_name, algorithm_name)
+        # stable, so the records of an id stay in insertion order
+        _worker_series = (exchange_name, algorithm_name, columns[np.argsort(columns["id"], kind="stable")])
+    return _worker_series[2]
+
+
+def _render_ids(exchange_name: str, algorithm_name: str, algo_ids: List[str], output_dir: str, image_format: str,
+                max_points: int) -> List[str]:
+    columns = _series_by_id(exchange_name, algorithm_name)
+    paths = []
+    for algo_id in algo_ids:
+        raw_id = algo_id.encode("utf-8")
+        id_columns = columns[np.searchsorted(columns["id"], raw_id, side="left"):
+                             np.searchsorted(columns["id"], raw_id, side="right")]
+        if len(id_columns):
+            paths.append(render_graph(id_columns, f"{algorithm_name} {algo_id} on {exchange_name}",
+                                      os.path.join(output_dir, exchange_name, algorithm_name, algo_id), image_format,
+                                      max_points))
+    return paths
+
+
+def generate_graphs(backend, selectors: List[str], output_dir: str = GRAPH_OUTPUT_DIR, workers: int = None,
+                    image_format: str = "auto", max_points: int = DEFAULT_MAX_POINTS) -> List[str]:
+    """
+    Renders one graph per selected id (see select_graphs) into <output_dir>/<exchange>/<algorithm>/<id>.<format>
+    without prompting. Graphs are rendered in a process pool unless workers is 1.
+    :param backend: The HistoryBackend of the trading loop, merged with the shard histories of a sharded run
+    :return: The paths of the written images
+    """
+    from lib.sharding import open_history_reader
+
+    selected = select_graphs(open_history_reader(backend), selectors)
+    logger.info(f"Rendering {len(selected)} graphs into {output_dir}")
+    series_ids = {}
+    for exchange_name, algorithm_name, algo_id in selected:
+        series_ids.setdefault((exchange_name, algorithm_name), []).append(algo_id)
+    tasks = [(exchange_name, algorithm_name, algo_ids[start:start + GRAPHS_PER_TASK])
+             for (exchange_name, algorithm_name), algo_ids in series_ids.items()
+             for start in range(0, len(algo_ids), GRAPHS_PER_TASK)]
+
+    arguments = (type(backend), backend.root, backend.segment_size)
+    paths = []
+    if workers == 1 or len(tasks) <= 1:
+        _open_worker_reader(*arguments)
+        for task in tasks:
+            paths.extend(_render_ids(*task, output_dir, image_format, max_points))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_reader, initargs=arguments) as executor:
+            futures = [executor.submit(_render_ids, *task, output_dir, image_format, max_points) for task in tasks]
+            for future in as_completed(futures):
+                paths.extend(future.result())
+    return sorted(paths)
@@ -0,0 +1,246 @@
+import json
+import os
+from typing import Tuple
+
+import numpy as np
+
+from lib.history_store import HistoryBackend, BinaryHistoryBackend, ACTIONS, ACTION_RESULTS, get_history_backend
+from lib.logger import logger
+
+# Same layout as history_store.BINARY_RECORD, so binary segments can be memory-mapped as-is
+HISTORY_DTYPE = np.dtype([
+    ("unix_timestamp", "<f8"),
+    ("id", "S32"),
+    ("action", "u1"),
+    ("action_result", "u1"),
+    ("transacted_amount", "<f8"),
+    ("current_price", "<f8"),
+    ("crypto_wallet", "<f8"),
+    ("fiat_wallet", "<f8")
+])
+INDEX_FILE = "index.json"
+# buckets of one rollup partition file: a week of hourly buckets, 24 weeks of daily ones
+ROLLUP_BUCKETS_PER_PARTITION = 168
+
+
+class HistoryReader:
+    """
+    Columnar read access to the history of a HistoryBackend. Records are returned as numpy structured arrays with
+    HISTORY_DTYPE (actions and action results as indices into ACTIONS and ACTION_RESULTS, ids as utf-8 bytes, missing
+    transacted amounts as NaN).
+
+    Every segment that is no longer appended to is indexed once (ids it contains and its time range) in index.json of
+    its series directory, so reads can skip segments without opening them. Binary segments are memory-mapped; sealed
+    JSONL segments are converted once into a memory-mappable .npy column file next to the segment. History rolled up by
+    lib/history_retention.py is read from its rollup partitions (.npy files with HISTORY_DTYPE) and returned in front
+    of the segments.
+    """
+
+    def __init__(self, backend: HistoryBackend = None):
+        self.backend = backend if backend is not None else get_history_backend()
+
+    def series(self) -> list:
+        return self.backend.list_series()
+
+    def load(self, exchange_name: str, algorithm_name: str, algo_id=None, start: float = None,
+             end: float = None) -> np.ndarray:
+        """
+        Returns all records of one series, optionally restricted to one algorithm id and a time range.
+        :param algo_id: Only return records of this id (compared as string, so 0 and "0" are the same id)
+        :param start: Only return records with unix_timestamp >= start
+        :param end: Only return records with unix_timestamp <= end
+        :return: A structured array with HISTORY_DTYPE in insertion order
+        """
+        segments = self.backend.list_segments(exchange_name, algorithm_name)
+        raw_id = None if algo_id is None else str(algo_id).encode("utf-8")
+        # rolled up history is older than every remaining segment, see lib/history_retention.py
+        parts = self._load_rollups(exchange_name, algorithm_name, raw_id, start, end)
+        if not segments:
+            return parts[0] if parts else np.empty(0, dtype=HISTORY_DTYPE)
+
+        series_dir = self.backend.series_dir(exchange_name, algorithm_name)
+        index = self._read_index(series_dir)
+        index_changed = False
+        for position, (_, _, path) in enumerate(segments):
+            sealed = position < len(segments) - 1
+            file_name = os.path.basename(path)
+            entry = index.get(file_name) if sealed else None
+            try:
+                if entry is None:
+                    columns = self.segment_columns(path, sealed)
+                    if sealed:
+                        entry = index[file_name] = self._index_entry(columns)
+                        index_changed = True
+                else:
+                    columns = None
+
+                # skip segments that can not contain matching records
+                if entry is not None:
+                    if raw_id is not None and raw_id.decode("utf-8") not in entry["ids"]:
+                        continue
+                    if (start is not None and entry["last_timestamp"] < start) or \
+                            (end is not None and entry["first_timestamp"] > end):
+                        continue
+                if columns is None:
+                    columns = self.segment_columns(path, sealed)
+            except FileNotFoundError:
+                # rolled up by a compaction after it was listed; the rollups, listed after it, contain its records
+                continue
+
+            parts.append(columns[_record_mask(columns, raw_id, start, end)])
+
+        if index_changed:
+            self._write_index(series_dir, index)
+        if not parts:
+            return np.empty(0, dtype=HISTORY_DTYPE)
+        return np.concatenate(parts)
+
+    def _load_rollups(self, exchange_name: str, algorithm_name: str, raw_id: bytes | None, start: float | None,
+                      end: float | None) -> list:
+        parts = []
+        for resolution, partition_start, path in self.backend.list_rollups(exchange_name, algorithm_name):
+            if (start is not None and partition_start + resolution * ROLLUP_BUCKETS_PER_PARTITION <= start) or \
+                    (end is not None and partition_start > end):
+                continue
+            columns = np.load(path, mmap_mode="r")
+            parts.append(columns[_record_mask(columns, raw_id, start, end)])
+        parts = [part for part in parts if len(part)]
+        if len(parts) <= 1:
+            return parts
+        # tiers of different resolutions can overlap in time if the retention settings changed
+        merged = np.concatenate(parts)
+        return [merged[np.argsort(merged["unix_timestamp"], kind="stable")]]
+
+    def segment_columns(self, path: str, sealed: bool) -> np.ndarray:
+        """
+        Reads one segment of the backend as a structured array with HISTORY_DTYPE.
+        :param sealed: Whether the segment is no longer appended to, so the column file of a JSONL segment can be
+            written and reused
+        """
+        if isinstance(self.backend, BinaryHistoryBackend):
+            # ignore a torn trailing record
+            count = os.path.getsize(path) // HISTORY_DTYPE.itemsize
+            if count == 0:
+                return np.empty(0, dtype=HISTORY_DTYPE)
+            return np.memmap(path, dtype=HISTORY_DTYPE, mode="r", shape=(count,))
+
+        column_file = path + ".npy"
+        if sealed and os.path.exists(column_file):
+            return np.load(column_file, mmap_mode="r")
+        columns = records_to_columns(self.backend.decode_segment(path))
+        if sealed:
+            temporary_file = column_file + ".tmp"
+            with open(temporary_file, "wb") as f:
+                np.save(f, columns)
+            os.replace(temporary_file, column_file)
+        return columns
+
+    @staticmethod
+    def _index_entry(columns: np.ndarray) -> dict:
+        if len(columns) == 0:
+            return {"ids": [], "first_timestamp": 0.0, "last_timestamp": 0.0, "records": 0}
+        return {
+            "ids": sorted(raw_id.decode("utf-8") for raw_id in np.unique(columns["id"])),
+            "first_timestamp": float(columns["unix_timestamp"].min()),
+            "last_timestamp": float(columns["unix_timestamp"].max()),
+            "records": len(columns)
+        }
+
+    @staticmethod
+    def _read_index(series_dir: str) -> dict:
+        index_path = os.path.join(series_dir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {}
+        try:
+            with open(index_path, "r") as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning(f"Ignoring corrupt history index {index_path}")
+            return {}
+
+    @classmethod
+    def drop_index_entries(cls, series_dir: str, file_names: list):
+        """
+        Removes the index entries of deleted segments.
+        """
+        index = cls._read_index(series_dir)
+        if any(file_name in index for file_name in file_names):
+            for file_name in file_names:
+                index.pop(file_name, None)
+            cls._write_index(series_dir, index)
+
+    @staticmethod
+    def _write_index(series_dir: str, index: dict):
+        index_path = os.path.join(series_dir, INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+
+class MergedHistoryReader:
+    """
+    Reads the history of several backends (e.g. the shards of a sharded run) as if it was one.
+    """
+
+    def __init__(self, readers: list):
+        self.readers = readers
+
+    def series(self) -> list:
+        return sorted({series for reader in self.readers for series in reader.series()})
+
+    def load(self, exchange_name: str, algorithm_name: str, algo_id=None, start: float = None,
+             end: float = None) -> np.ndarray:
+        """
+        Same as HistoryReader.load, with the records of all backends ordered by unix_timestamp.
+        """
+        parts = [reader.load(exchange_name, algorithm_name, algo_id, start, end) for reader in self.readers]
+        parts = [part for part in parts if len(part)]
+        if len(parts) <= 1:
+            return parts[0] if parts else np.empty(0, dtype=HISTORY_DTYPE)
+        merged = np.concatenate(parts)
+        return merged[np.argsort(merged["unix_timestamp"], kind="stable")]
+
+
+def records_to_columns(records) -> np.ndarray:
+    """
+    Converts history records (the layout written by log_action) into a structured array with HISTORY_DTYPE.
+    """
+    rows = [(record["unix_timestamp"],
+             str(record["id"]).encode("utf-8"),
+             ACTIONS.index(record["action"]),
+             ACTION_RESULTS.index(record["action-result"]),
+             np.nan if record["transacted_amount"] is None else record["transacted_amount"],
+             record["current_price"],
+             record["crypto-wallet"],
+             record["fiat-wallet"]) for record in records]
+    return np.array(rows, dtype=HISTORY_DTYPE)
+
+
+def _record_mask(columns: np.ndarray, raw_id: bytes | None, start: float | None, end: float | None) -> np.ndarray:
+    mask = np.ones(len(columns), dtype=bool)
+    if raw_id is not None:
+        mask &= columns["id"] == raw_id
+    if start is not None:
+        mask &= columns["unix_timestamp"] >= start
+    if end is not None:
+        mask &= columns["unix_timestamp"] <= end
+    return mask
+
+
+def action_mask(columns: np.ndarray, action: str) -> np.ndarray:
+    return columns["action"] == ACTIONS.index(action)
+
+
+def parse_selector(selector: str) -> Tuple[str, str, str]:
+    """
+    Parses EXCHANGE[/ALGORITHM[/ID]] into (exchange, algorithm, id) patterns; missing parts match everything.
+    """
+    parts = selector.split("/")
+    if len(parts) > 3 or not all(parts):
+        raise ValueError(f"Invalid selector: {selector}. Use EXCHANGE[/ALGORITHM[/ID]]")
+    return tuple(parts + ["*"] * (3 - len(parts)))
+
+
+def id_sort_key(algo_id: str):
+    # numeric ids in numeric order before all other ids
+    return (0, int(algo_id), "") if algo_id.lstrip("-").isdigit() else (1, 0, algo_id)
@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from lib.candles import interval_seconds
+from lib.history_reader import HistoryReader, ROLLUP_BUCKETS_PER_PARTITION
+from lib.history_store import HistoryBackend, ACTIONS
+from lib.logger import logger
+
+# seconds between two compactions of the background compactor
+DEFAULT_COMPACT_INTERVAL = 3600
+
+_HOLD = ACTIONS.index("hold")
+
+
+def parse_retention(tiers: list) -> List[Tuple[int, int]]:
+    """
+    Parses the history_retention setting: a list of {"after": age, "resolution": interval} mappings with yahoo style
+    intervals (e.g. [{"after": "7d", "resolution": "1h"}, {"after": "90d", "resolution": "1d"}]). History older than
+    the age of a tier is rolled up to the resolution of the tier; history younger than the first tier stays raw.
+    :return: (age_seconds, resolution_seconds) tuples sorted by age
+    """
+    parsed = sorted((interval_seconds(str(tier["after"])), interval_seconds(str(tier["resolution"])))
+                    for tier in tiers)
+    for (_, resolution), (_, coarser_resolution) in zip(parsed, parsed[1:]):
+        # buckets of a tier must nest in the buckets of the next one, so rolling up twice keeps every extreme
+        if coarser_resolution <= resolution or coarser_resolution % resolution:
+            raise ValueError(f"Invalid history_retention: every tier needs a coarser resolution than the tier before "
+                             f"it that is a multiple of it, got {resolution}s followed by {coarser_resolution}s")
+    return parsed
+
+
+def rollup_records(columns: np.ndarray, resolution: int) -> np.ndarray:
+    """
+    Rolls history records up to buckets of resolution seconds: of every id and bucket only the first, last,
+    highest-priced and lowest-priced record are kept (the open, close, high and low of current_price, with the wallets
+    of the moment), plus every buy and sell verbatim. Rolling up a rollup again keeps the same records, so partitions
+    can be merged and rolled up repeatedly.
+    :param columns: Records with HISTORY_DTYPE
+    :return: The kept records sorted by unix_timestamp
+    """
+    if len(columns) == 0:
+        return np.asarray(columns)
+    columns = np.asarray(columns)
+    timestamps = columns["unix_timestamp"]
+    order = np.lexsort((timestamps, columns["id"]))
+    # records stored twice: rolled up again after a crash between writing the rollup and deleting its source
+    duplicate = (np.diff(timestamps[order]) == 0) & (columns["id"][order][1:] == columns["id"][order][:-1])
+    if duplicate.any():
+        columns = columns[np.sort(np.delete(order, np.flatnonzero(duplicate) + 1))]
+        timestamps = columns["unix_timestamp"]
+
+    buckets = timestamps // resolution
+    by_time = np.lexsort((timestamps, buckets, columns["id"]))
+    by_price = np.lexsort((columns["current_price"], buckets, columns["id"]))
+    # both orders group the records by (id, bucket), so the groups start and end at the same positions
+    ids = columns["id"][by_time]
+    sorted_buckets = buckets[by_time]
+    group_starts = np.flatnonzero(np.concatenate(([True], (ids[1:] != ids[:-1])
+                                                  | (sorted_buckets[1:] != sorted_buckets[:-1]))))
+    group_ends = np.append(group_starts[1:], len(columns)) - 1
+    keep = np.unique(np.concatenate((by_time[group_starts], by_time[group_ends], by_price[group_starts],
+                                     by_price[group_ends], np.flatnonzero(columns["action"] != _HOLD))))
+    kept = columns[keep]
+    return kept[np.argsort(kept["unix_timestamp"], kind="stable")]
+
+
+class HistoryCompactor:
+    """
+    Applies retention tiers to the history of HistoryBackends. Sealed segments whose records are all older than the
+    first tier are rolled up (see rollup_records) into partition files of the first tier and deleted; rollup partitions
+    older than the next tier are rolled up into that one. Only the oldest segments and partitions are rolled up, so
+    every tier stays older than the finer ones and HistoryReader can put them in front of each other. The segment that
+    is appended to is never touched.
+
+    Rollup files are written before their sources are deleted: a crash in between only rolls the same records up
+    twice, which rollup_records drops again.
+    """
+
+    def __init__(self, tiers: List[Tuple[int, int]]):
+        """
+        :param tiers: (age_seconds, resolution_seconds) tuples as returned by parse_retention
+        """
+        if not tiers:
+            raise ValueError("No history retention tiers configured")
+        self.tiers = tiers
+
+    def compact(self, backends: List[HistoryBackend], now: float = None) -> dict:
+        """
+        Compacts every series of the backends.
+        :param now: Reference time of the tier ages, defaults to the current time
+        :return: Totals of the compaction: sources (segments and rollup partitions) rolled up, records removed with
+            them, records added to rollups, bytes freed
+        """
+        now = time.time() if now is None else now
+        totals = {"sources": 0, "records": 0, "kept_records": 0, "freed_bytes": 0}
+        for backend in backends:
+            for exchange_name, algorithm_name in backend.list_series():
+                stats = self.compact_series(backend, exchange_name, algorithm_name, now)
+                for key, value in stats.items():
+                    totals[key] += value
+                if stats["sources"]:
+                    logger.info(f"Rolled up {stats['sources']} history files of {algorithm_name} on {exchange_name}: "
+                                f"{stats['records']} records replaced by {stats['kept_records']}, "
+                                f"{stats['freed_bytes'] / 1024 / 1024:.1f}MB freed")
+        return totals
+
+    def compact_series(self, backend: HistoryBackend, exchange_name: str, algorithm_name: str, now: float) -> dict:
+        stats = {"sources": 0, "records": 0, "kept_records": 0, "freed_bytes": 0}
+        reader = HistoryReader(backend)
+        raw_cutoff = now - self.tiers[0][0]
+        segments = backend.list_segments(exchange_name, algorithm_name)
+        removed_segments = []
+        # a segment ends before the next one starts, so it is old once the next one started before the cutoff
+        for (_, _, path), (_, next_first_timestamp, _) in zip(segments, segments[1:]):
+            if next_first_timestamp > raw_cutoff:
+                break
+            columns = reader.segment_columns(path, sealed=False)
+            self._store(backend, exchange_name, algorithm_name, self.tiers[0][1], columns, stats)
+            stats["records"] += len(columns)
+            stats["sources"] += 1
+            for file_path in (path, path + ".npy"):
+                if os.path.exists(file_path):
+                    stats["freed_bytes"] += os.path.getsize(file_path)
+                    os.remove(file_path)
+            removed_segments.append(os.path.basename(path))
+        if removed_segments:
+            HistoryReader.drop_index_entries(backend.series_dir(exchange_name, algorithm_name), removed_segments)
+
+        for (_, resolution), (age, coarser_resolution) in zip(self.tiers, self.tiers[1:]):
+            span = resolution * ROLLUP_BUCKETS_PER_PARTITION
+            for partition_resolution, partition_start, path in backend.list_rollups(exchange_name, algorithm_name):
+                if partition_resolution != resolution:
+                    continue
+                if partition_start + span > now - age:
+                    break
+                columns = np.load(path)
+                self._store(backend, exchange_name, algorithm_name, coarser_resolution, columns, stats)
+                stats["records"] += len(columns)
+                stats["sources"] += 1
+                stats["freed_bytes"] += os.path.getsize(path)
+                os.remove(path)
+        return stats
+
+    @staticmethod
+    def _store(backend: HistoryBackend, exchange_name: str, algorithm_name: str, resolution: int,
+               columns: np.ndarray, stats: dict):
+        """
+        Merges records into the rollup partitions of one resolution.
+        """
+        if len(columns) == 0:
+            return
+        rollup_dir = backend.rollup_dir(exchange_name, algorithm_name, resolution)
+        os.makedirs(rollup_dir, exist_ok=True)
+        span = resolution * ROLLUP_BUCKETS_PER_PARTITION
+        partition_starts = (columns["unix_timestamp"] // span * span).astype(np.int64)
+        for partition_start in np.unique(partition_starts).tolist():
+            path = os.path.join(rollup_dir, f"{partition_start}.npy")
+            records = columns[partition_starts == partition_start]
+            if os.path.exists(path):
+                existing = np.load(path)
+                stats["kept_records"] -= len(existing)
+                stats["freed_bytes"] += os.path.getsize(path)
+                records = np.concatenate((existing, records))
+            records = rollup_records(records, resolution)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, records)
+            os.replace(path + ".tmp", path)
+            stats["kept_records"] += len(records)
+            stats["freed_bytes"] -= os.path.getsize(path)
+
+
+def start_history_compactor(compactor: HistoryCompactor, backends: List[HistoryBackend],
+                            interval: float = DEFAULT_COMPACT_INTERVAL) -> threading.Thread:
+    """
+    Compacts the backends right away and then every interval seconds from a daemon thread.
+    """
+
+    def run():
+        while True:
+            try:
+                compactor.compact(backends)
+            except Exception as e:
+                logger.error(f"Compacting the history failed: {e!r}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="history-compactor", daemon=True)
+    thread.start()
+    return thread
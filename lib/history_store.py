@@ -0,0 +1,321 @@
+import json
+import math
+import os
+import struct
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Tuple
+
+from lib.logger import logger
+from lib.records import ActionRecord
+
+HISTORY_DIR = "cache/history"
+LEGACY_HISTORY_FILE = "cache/history.json"
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+# directory of the rolled up history in every series directory, see lib/history_retention.py
+ROLLUP_DIR = "rollups"
+
+# Order matters: the index of each entry is its on-disk code in binary segments
+ACTIONS = ("hold", "buy_crypto", "sell_crypto")
+ACTION_RESULTS = (None, "success", "failure", "partial")
+
+_ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+_ACTION_RESULT_CODES = {action_result: code for code, action_result in enumerate(ACTION_RESULTS)}
+
+# unix_timestamp, id, action, action-result, transacted_amount, current_price, crypto-wallet, fiat-wallet
+BINARY_RECORD = struct.Struct("<d32sBBdddd")
+
+
+class HistoryBackend(ABC):
+    """
+    Append-only store for the records produced by log_action. Records are grouped into series by exchange and
+    algorithm name and written into size-limited segment files. Appends are only buffered; commit() makes all pending
+    appends durable with a single fsync per touched segment.
+    """
+    extension: str
+
+    def __init__(self, root: str = HISTORY_DIR, segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.root = root
+        self.segment_size = segment_size
+        self._open_segments = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def encode_record(self, record: ActionRecord) -> bytes:
+        """
+        Serializes a single action record into the bytes appended to a segment.
+        :param record: An action record as returned by perform_action
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def decode_segment(self, path: str) -> Iterator[dict]:
+        """
+        Yields all history records stored in a segment file in insertion order.
+        :param path: Path of the segment file
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def complete_length(self, path: str) -> int:
+        """
+        Returns the length of a segment file up to the end of its last complete record.
+        :param path: Path of the segment file
+        :return:
+        """
+        pass
+
+    def series_dir(self, exchange_name: str, algorithm_name: str) -> str:
+        return os.path.join(self.root, exchange_name, algorithm_name)
+
+    def list_segments(self, exchange_name: str, algorithm_name: str) -> List[Tuple[int, float, str]]:
+        """
+        Returns the segments of one series sorted by sequence number.
+        :return: A list of (sequence_number, first_unix_timestamp, path) tuples
+        """
+        series_dir = self.series_dir(exchange_name, algorithm_name)
+        if not os.path.isdir(series_dir):
+            return []
+        segments = []
+        for file_name in os.listdir(series_dir):
+            name, extension = os.path.splitext(file_name)
+            if extension != self.extension:
+                continue
+            sequence, first_timestamp = name.split("-", 1)
+            segments.append((int(sequence), float(first_timestamp), os.path.join(series_dir, file_name)))
+        return sorted(segments)
+
+    def rollup_dir(self, exchange_name: str, algorithm_name: str, resolution: int) -> str:
+        return os.path.join(self.series_dir(exchange_name, algorithm_name), ROLLUP_DIR, str(resolution))
+
+    def list_rollups(self, exchange_name: str, algorithm_name: str) -> List[Tuple[int, int, str]]:
+        """
+        Returns the rollup partitions of one series (.npy files with history_reader.HISTORY_DTYPE records) sorted by
+        resolution and start.
+        :return: A list of (resolution, partition_start, path) tuples
+        """
+        rollups_root = os.path.join(self.series_dir(exchange_name, algorithm_name), ROLLUP_DIR)
+        if not os.path.isdir(rollups_root):
+            return []
+        rollups = []
+        for resolution in os.listdir(rollups_root):
+            for file_name in os.listdir(os.path.join(rollups_root, resolution)):
+                name, extension = os.path.splitext(file_name)
+                if extension == ".npy":
+                    rollups.append((int(resolution), int(name), os.path.join(rollups_root, resolution, file_name)))
+        return sorted(rollups)
+
+    def list_series(self) -> List[Tuple[str, str]]:
+        """
+        Returns all (exchange_name, algorithm_name) pairs that have stored history.
+        """
+        series = []
+        if not os.path.isdir(self.root):
+            return series
+        for exchange_name in sorted(os.listdir(self.root)):
+            exchange_dir = os.path.join(self.root, exchange_name)
+            if not os.path.isdir(exchange_dir):
+                continue
+            for algorithm_name in sorted(os.listdir(exchange_dir)):
+                if self.list_segments(exchange_name, algorithm_name) or \
+                        self.list_rollups(exchange_name, algorithm_name):
+                    series.append((exchange_name, algorithm_name))
+        return series
+
+    def _open_segment(self, key: Tuple[str, str], first_timestamp: float, force_new: bool = False):
+        segments = self.list_segments(*key)
+        if segments and not force_new and os.path.getsize(segments[-1][2]) < self.segment_size:
+            path = segments[-1][2]
+            # a crash between write and fsync can leave a torn last record, appending after it would corrupt the
+            # records that follow
+            complete_length = self.complete_length(path)
+            if complete_length < os.path.getsize(path):
+                logger.warning(f"Dropping a torn record at the end of {path}")
+                os.truncate(path, complete_length)
+        else:
+            sequence = segments[-1][0] + 1 if segments else 0
+            os.makedirs(self.series_dir(*key), exist_ok=True)
+            path = os.path.join(self.series_dir(*key), f"{sequence:08d}-{first_timestamp:.3f}{self.extension}")
+        handle = open(path, "ab")
+        self._open_segments[key] = handle
+        return handle
+
+    def append(self, exchange_name: str, algorithm_name: str, record: ActionRecord):
+        """
+        Buffers one record for the series. The record is only guaranteed to be on disk after commit().
+        """
+        key = (exchange_name, algorithm_name)
+        data = self.encode_record(record)
+        with self._lock:
+            handle = self._open_segments.get(key)
+            if handle is None:
+                handle = self._open_segment(key, record.unix_timestamp)
+            elif handle.tell() + len(data) > self.segment_size:
+                # rotate: make the full segment durable before switching to a new one
+                self._sync(handle)
+                handle.close()
+                self._dirty.discard(key)
+                handle = self._open_segment(key, record.unix_timestamp, force_new=True)
+            handle.write(data)
+            self._dirty.add(key)
+
+    def commit(self):
+        """
+        Writes all buffered records to disk. Meant to be called once per tick (group commit).
+        """
+        with self._lock:
+            for key in self._dirty:
+                self._sync(self._open_segments[key])
+            self._dirty.clear()
+
+    def close(self):
+        self.commit()
+        with self._lock:
+            for handle in self._open_segments.values():
+                handle.close()
+            self._open_segments.clear()
+
+    def read_records(self, exchange_name: str, algorithm_name: str) -> Iterator[dict]:
+        """
+        Yields all committed records of one series in insertion order.
+        """
+        for _, _, path in self.list_segments(exchange_name, algorithm_name):
+            yield from self.decode_segment(path)
+
+    @staticmethod
+    def _sync(handle):
+        handle.flush()
+        os.fsync(handle.fileno())
+
+
+class JsonlHistoryBackend(HistoryBackend):
+    """
+    Stores one JSON object per line. Human-readable and keeps the exact record layout of the old history.json.
+    """
+    extension = ".jsonl"
+
+    def encode_record(self, record: ActionRecord) -> bytes:
+        return (json.dumps(record.history_dict(), separators=(",", ":")) + "\n").encode("utf-8")
+
+    def complete_length(self, path: str) -> int:
+        with open(path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            # search backwards for the newline that ends the last complete line
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    return start + newline + 1
+                end = start
+        return 0
+
+    def decode_segment(self, path: str) -> Iterator[dict]:
+        with open(path, "r") as f:
+            for line in f:
+                # a crash between write and fsync can leave a torn last line
+                if line.endswith("\n"):
+                    yield json.loads(line)
+
+
+class BinaryHistoryBackend(HistoryBackend):
+    """
+    Stores fixed-width little-endian records (see BINARY_RECORD). Ids are stored as utf-8 strings of up to 32 bytes,
+    missing transacted amounts as NaN.
+    """
+    extension = ".bin"
+
+    def encode_record(self, record: ActionRecord) -> bytes:
+        transacted_amount = record.transacted_amount
+        return BINARY_RECORD.pack(
+            record.unix_timestamp,
+            str(record.id).encode("utf-8"),
+            _ACTION_CODES[record.action],
+            _ACTION_RESULT_CODES[record.action_result],
+            math.nan if transacted_amount is None else transacted_amount,
+            record.current_price,
+            record.wallet_crypto_amount,
+            record.wallet_fiat_amount
+        )
+
+    def complete_length(self, path: str) -> int:
+        size = os.path.getsize(path)
+        return size - size % BINARY_RECORD.size
+
+    def decode_segment(self, path: str) -> Iterator[dict]:
+        with open(path, "rb") as f:
+            data = f.read()
+        # ignore a torn trailing record
+        usable = len(data) - len(data) % BINARY_RECORD.size
+        for (unix_timestamp, algo_id, action, action_result, transacted_amount, current_price, crypto_wallet,
+             fiat_wallet) in BINARY_RECORD.iter_unpack(data[:usable]):
+            yield {
+                "unix_timestamp": unix_timestamp,
+                "id": decode_id(algo_id),
+                "action": ACTIONS[action],
+                "action-result": ACTION_RESULTS[action_result],
+                "transacted_amount": None if math.isnan(transacted_amount) else transacted_amount,
+                "current_price": current_price,
+                "crypto-wallet": crypto_wallet,
+                "fiat-wallet": fiat_wallet
+            }
+
+
+def decode_id(raw_id: bytes):
+    """
+    Converts a stored binary id back into the type used in settings.yaml (int if numeric, str otherwise).
+    """
+    algo_id = raw_id.rstrip(b"\0").decode("utf-8")
+    return int(algo_id) if algo_id.lstrip("-").isdigit() else algo_id
+
+
+BACKENDS = {
+    "jsonl": JsonlHistoryBackend,
+    "binary": BinaryHistoryBackend
+}
+
+_history_backend: HistoryBackend | None = None
+
+
+def configure_history(backend_name: str = "jsonl", segment_size: int = DEFAULT_SEGMENT_SIZE,
+                      root: str = HISTORY_DIR) -> HistoryBackend:
+    """
+    Replaces the process-wide history backend used by log_action.
+    """
+    global _history_backend
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown history backend: {backend_name}. Available: {', '.join(BACKENDS)}")
+    if _history_backend is not None:
+        _history_backend.close()
+    _history_backend = BACKENDS[backend_name](root, segment_size)
+    return _history_backend
+
+
+def get_history_backend() -> HistoryBackend:
+    if _history_backend is None:
+        return configure_history()
+    return _history_backend
+
+
+def migrate_legacy_history(backend: HistoryBackend, source: str = LEGACY_HISTORY_FILE) -> int:
+    """
+    Copies all records of the old single-file history.json layout into the backend and renames the source file to
+    <source>.migrated so it is never imported twice.
+    :return: The number of migrated records
+    """
+    with open(source, "r") as f:
+        history = json.load(f)
+
+    migrated = 0
+    for exchange_name, algorithms in history.items():
+        for algorithm_name, records in algorithms.items():
+            for record in records:
+                backend.append(exchange_name, algorithm_name, ActionRecord.from_history_dict(record))
+            migrated += len(records)
+            logger.info(f"Migrated {len(records)} records of {algorithm_name} on {exchange_name}")
+    backend.commit()
+    os.replace(source, source + ".migrated")
+    return migrated
@@ -0,0 +1,217 @@
+import gzip
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from abc import ABC, abstractmethod
+from typing import Dict, Tuple
+
+from lib.logger import logger
+from lib.metrics import metrics
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 10.0
+DEFAULT_POOL_SIZE = 16
+# statuses that are worth retrying, everything else >= 400 fails immediately
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+USER_AGENT = "Mozilla/5.0 (compatible; volatenium)"
+
+
+class HttpError(Exception):
+    def __init__(self, url: str, status: int, body: bytes):
+        super().__init__(f"{url} returned HTTP {status}")
+        self.url = url
+        self.status = status
+        self.body = body
+
+
+class HttpResponse:
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        """
+        :param headers: Response headers with lower case names
+        """
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def text(self) -> str:
+        return self.body.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class Transport(ABC):
+    """
+    Sends a single HTTP request. Retries, compression and error handling are done by HttpClient, so a transport only
+    has to move bytes, e.g. to a local stub server or an in-memory fake.
+    """
+
+    @abstractmethod
+    def request(self, method: str, url: str, headers: Dict[str, str], body: bytes | None,
+                timeout: float) -> HttpResponse:
+        pass
+
+    def close(self):
+        pass
+
+
+class PooledTransport(Transport):
+    """
+    Keeps up to pool_size idle keep-alive connections per (scheme, host, port), so repeated requests to the same host
+    skip the TCP and TLS handshakes. Safe to use from many threads.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self._pools: Dict[Tuple[str, str, int], queue.LifoQueue] = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, key: Tuple[str, str, int]) -> queue.LifoQueue:
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = queue.LifoQueue(self.pool_size)
+            return pool
+
+    def request(self, method: str, url: str, headers: Dict[str, str], body: bytes | None,
+                timeout: float) -> HttpResponse:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        pool = self._pool((parts.scheme, parts.hostname, port))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            try:
+                connection = pool.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+                connection = connection_class(parts.hostname, port, timeout=timeout)
+                reused = False
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response_body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                # the server closed an idle keep-alive connection, that is not a failed attempt
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return HttpResponse(response.status, {name.lower(): value for name, value in response.getheaders()},
+                            response_body)
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+class HttpClient:
+    """
+    HTTP client shared by all exchanges. Requests time out after timeout seconds and failed requests (connection
+    errors, timeouts and RETRY_STATUSES) are retried up to retries times with exponential backoff and full jitter.
+    Responses are requested gzip compressed and decompressed transparently.
+    """
+
+    def __init__(self, transport: Transport = None, timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF, max_backoff: float = DEFAULT_MAX_BACKOFF):
+        self.transport = transport if transport is not None else PooledTransport()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def request(self, method: str, url: str, params: dict = None, headers: dict = None,
+                body: bytes = None) -> HttpResponse:
+        """
+        Sends a request and returns the response of the first successful attempt.
+        :param params: Query parameters appended to url
+        :raises HttpError: If the server answered with a status >= 400 that is not retried or retries ran out
+        :raises OSError: If the last attempt failed to connect or timed out
+        """
+        if params:
+            url += ("&" if "?" in url else "?") + urllib.parse.urlencode(params)
+        request_headers = {"Accept-Encoding": "gzip", "User-Agent": USER_AGENT}
+        request_headers.update(headers or {})
+        host = urllib.parse.urlsplit(url).hostname
+
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = self.transport.request(method, url, request_headers, body, self.timeout)
+                if response.status < 400:
+                    if response.headers.get("content-encoding") == "gzip":
+                        response.body = gzip.decompress(response.body)
+                    return response
+                error = HttpError(url, response.status, response.body)
+                if response.status not in RETRY_STATUSES:
+                    raise error
+                retry_after = response.headers.get("retry-after")
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+
+            if attempt >= self.retries:
+                raise error
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            if retry_after is not None and retry_after.isdigit():
+                delay = min(self.max_backoff, float(retry_after))
+            attempt += 1
+            metrics.increment("http_retries_total", host=host)
+            logger.warning("Request to %s failed (%r), retry %s/%s in %.2fs", url, error, attempt, self.retries,
+                           delay)
+            time.sleep(delay)
+
+    def get(self, url: str, params: dict = None, headers: dict = None) -> HttpResponse:
+        return self.request("GET", url, params, headers)
+
+    def get_json(self, url: str, params: dict = None, headers: dict = None):
+        return self.get(url, params, headers).json()
+
+    def close(self):
+        self.transport.close()
+
+
+http_client = HttpClient()
+
+
+def configure_http_client(timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                          transport: Transport = None):
+    """
+    Changes the settings of the shared http_client. Passing a transport replaces (and closes) the current one.
+    """
+    http_client.timeout = timeout
+    http_client.retries = retries
+    if transport is not None:
+        http_client.transport.close()
+        http_client.transport = transport
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+
+def profile_imports(modules: List[str], cwd: str = None) -> List[Tuple[int, int, str]]:
+    """
+    Imports modules in a fresh interpreter with python -X importtime.
+    :param modules: Modules to import in this order, e.g. ["main", "algorithms.safe_trade"]
+    :param cwd: Working directory of the interpreter, defaults to the directory of main.py
+    :return: (cumulative microseconds, own microseconds, module) for every imported module, slowest first
+    """
+    if cwd is None:
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "; ".join(f"import {module}" for module in modules)
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd, capture_output=True,
+                               text=True, check=True)
+    timings = []
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        timings.append((int(cumulative), int(own), name.strip()))
+    return sorted(timings, reverse=True)
@@ -0,0 +1,409 @@
+import math
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from typing import Dict, Tuple
+
+# running sums are recomputed from the window after this many windows to stop floating point drift
+RESUM_WINDOWS = 64
+
+
+class RingBuffer:
+    """
+    Fixed size window of the last size floats, stored in an array('d').
+    """
+    __slots__ = ("size", "_values", "_head", "count")
+
+    def __init__(self, size: int):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.size = size
+        self._values = array("d", bytes(8 * size))
+        self._head = 0
+        self.count = 0
+
+    def push(self, value: float) -> float | None:
+        """
+        Appends value.
+        :return: The value that dropped out of the window, None while the window is not full yet
+        """
+        evicted = self._values[self._head] if self.count == self.size else None
+        self._values[self._head] = value
+        self._head = (self._head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        return evicted
+
+    def full(self) -> bool:
+        return self.count == self.size
+
+    def values(self) -> list:
+        # oldest first
+        if self.count < self.size:
+            return self._values[:self.count].tolist()
+        return self._values[self._head:].tolist() + self._values[:self._head].tolist()
+
+
+class Indicator(ABC):
+    """
+    Technical indicator over a rolling window that is updated with one price at a time in constant time. to_vars()
+    returns a compact JSON/YAML serializable state that load_vars() restores, so indicators can be stored through
+    AlgorithmInterface.get_current_vars and survive restarts.
+    """
+
+    @abstractmethod
+    def update(self, price: float, volume: float = 1.0):
+        pass
+
+    @property
+    @abstractmethod
+    def ready(self) -> bool:
+        """
+        True once enough prices were seen for value to be meaningful.
+        """
+        pass
+
+    @property
+    @abstractmethod
+    def value(self):
+        pass
+
+    @abstractmethod
+    def to_vars(self) -> dict:
+        pass
+
+    @abstractmethod
+    def load_vars(self, state: dict):
+        pass
+
+
+class _RunningSums:
+    """
+    Sums of the values and their squares in a RingBuffer, updated incrementally and recomputed every
+    RESUM_WINDOWS windows.
+    """
+    __slots__ = ("window", "total", "total_squares", "_updates")
+
+    def __init__(self, period: int):
+        self.window = RingBuffer(period)
+        self.total = 0.0
+        self.total_squares = 0.0
+        self._updates = 0
+
+    def push(self, value: float):
+        evicted = self.window.push(value)
+        self.total += value
+        self.total_squares += value * value
+        if evicted is not None:
+            self.total -= evicted
+            self.total_squares -= evicted * evicted
+        self._updates += 1
+        if self._updates >= RESUM_WINDOWS * self.window.size:
+            self.resum()
+
+    def resum(self):
+        values = self.window.values()
+        self.total = math.fsum(values)
+        self.total_squares = math.fsum(value * value for value in values)
+        self._updates = 0
+
+
+class SMA(Indicator):
+    """
+    Simple moving average of the last period prices.
+    """
+
+    def __init__(self, period: int):
+        self.period = period
+        self._sums = _RunningSums(period)
+
+    def update(self, price: float, volume: float = 1.0):
+        self._sums.push(price)
+
+    @property
+    def ready(self) -> bool:
+        return self._sums.window.full()
+
+    @property
+    def value(self) -> float | None:
+        count = self._sums.window.count
+        return self._sums.total / count if count else None
+
+    def to_vars(self) -> dict:
+        return {"window": self._sums.window.values()}
+
+    def load_vars(self, state: dict):
+        self._sums = _RunningSums(self.period)
+        for value in state.get("window", []):
+            self._sums.push(value)
+        self._sums.resum()
+
+
+class EMA(Indicator):
+    """
+    Exponential moving average with smoothing 2 / (period + 1), seeded with the SMA of the first period prices.
+    """
+
+    def __init__(self, period: int):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self._value = 0.0
+        self._count = 0
+
+    def update(self, price: float, volume: float = 1.0):
+        self._count += 1
+        if self._count <= self.period:
+            # running mean until the seed window is complete
+            self._value += (price - self._value) / self._count
+        else:
+            self._value += self.alpha * (price - self._value)
+
+    @property
+    def ready(self) -> bool:
+        return self._count >= self.period
+
+    @property
+    def value(self) -> float | None:
+        return self._value if self._count else None
+
+    def to_vars(self) -> dict:
+        return {"value": self._value, "count": min(self._count, self.period)}
+
+    def load_vars(self, state: dict):
+        self._value = state.get("value", 0.0)
+        self._count = state.get("count", 0)
+
+
+class _RollingExtreme(Indicator):
+    """
+    Rolling minimum or maximum with a monotonic deque of (position, price), amortized O(1) per update.
+    """
+
+    def __init__(self, period: int):
+        self.period = period
+        self._candidates = deque()
+        self._position = 0
+
+    @staticmethod
+    @abstractmethod
+    def _dominates(new: float, old: float) -> bool:
+        pass
+
+    def update(self, price: float, volume: float = 1.0):
+        candidates = self._candidates
+        while candidates and self._dominates(price, candidates[-1][1]):
+            candidates.pop()
+        candidates.append((self._position, price))
+        if candidates[0][0] <= self._position - self.period:
+            candidates.popleft()
+        self._position += 1
+
+    @property
+    def ready(self) -> bool:
+        return self._position >= self.period
+
+    @property
+    def value(self) -> float | None:
+        return self._candidates[0][1] if self._candidates else None
+
+    def to_vars(self) -> dict:
+        # positions relative to the next update, so the stored numbers stay small
+        return {"candidates": [[position - self._position, price] for position, price in self._candidates],
+                "count": min(self._position, self.period)}
+
+    def load_vars(self, state: dict):
+        self._position = state.get("count", 0)
+        self._candidates = deque((self._position + offset, price) for offset, price in state.get("candidates", []))
+
+
+class RollingMin(_RollingExtreme):
+    @staticmethod
+    def _dominates(new: float, old: float) -> bool:
+        return new <= old
+
+
+class RollingMax(_RollingExtreme):
+    @staticmethod
+    def _dominates(new: float, old: float) -> bool:
+        return new >= old
+
+
+class RollingStd(Indicator):
+    """
+    Population standard deviation of the last period prices.
+    """
+
+    def __init__(self, period: int):
+        self.period = period
+        self._sums = _RunningSums(period)
+
+    def update(self, price: float, volume: float = 1.0):
+        self._sums.push(price)
+
+    @property
+    def ready(self) -> bool:
+        return self._sums.window.full()
+
+    @property
+    def mean(self) -> float | None:
+        count = self._sums.window.count
+        return self._sums.total / count if count else None
+
+    @property
+    def value(self) -> float | None:
+        count = self._sums.window.count
+        if not count:
+            return None
+        mean = self._sums.total / count
+        # cancellation can make the variance slightly negative
+        return math.sqrt(max(0.0, self._sums.total_squares / count - mean * mean))
+
+    def to_vars(self) -> dict:
+        return {"window": self._sums.window.values()}
+
+    def load_vars(self, state: dict):
+        self._sums = _RunningSums(self.period)
+        for value in state.get("window", []):
+            self._sums.push(value)
+        self._sums.resum()
+
+
+class Bollinger(RollingStd):
+    """
+    Bollinger bands: the SMA of the last period prices plus/minus width standard deviations.
+    """
+
+    def __init__(self, period: int, width: float = 2.0):
+        super().__init__(period)
+        self.width = width
+
+    @property
+    def value(self) -> Tuple[float, float, float] | None:
+        """
+        :return: (lower, middle, upper)
+        """
+        deviation = super().value
+        if deviation is None:
+            return None
+        middle = self.mean
+        return middle - self.width * deviation, middle, middle + self.width * deviation
+
+
+class RSI(Indicator):
+    """
+    Relative strength index with Wilder's smoothing over period price changes, between 0 and 100.
+    """
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self._previous = None
+        self._average_gain = 0.0
+        self._average_loss = 0.0
+        self._changes = 0
+
+    def update(self, price: float, volume: float = 1.0):
+        if self._previous is not None:
+            change = price - self._previous
+            gain = change if change > 0 else 0.0
+            loss = -change if change < 0 else 0.0
+            self._changes += 1
+            # plain average for the first period changes, Wilder's smoothing afterwards
+            divisor = min(self._changes, self.period)
+            self._average_gain += (gain - self._average_gain) / divisor
+            self._average_loss += (loss - self._average_loss) / divisor
+        self._previous = price
+
+    @property
+    def ready(self) -> bool:
+        return self._changes >= self.period
+
+    @property
+    def value(self) -> float | None:
+        if not self._changes:
+            return None
+        if self._average_loss == 0.0:
+            return 100.0 if self._average_gain > 0.0 else 50.0
+        return 100.0 - 100.0 / (1.0 + self._average_gain / self._average_loss)
+
+    def to_vars(self) -> dict:
+        return {"previous": self._previous, "average_gain": self._average_gain, "average_loss": self._average_loss,
+                "count": min(self._changes, self.period)}
+
+    def load_vars(self, state: dict):
+        self._previous = state.get("previous", None)
+        self._average_gain = state.get("average_gain", 0.0)
+        self._average_loss = state.get("average_loss", 0.0)
+        self._changes = state.get("count", 0)
+
+
+class VWAP(Indicator):
+    """
+    Volume weighted average price of the last period updates. Exchanges that do not report volumes can leave volume
+    at 1.0, which makes this the SMA.
+    """
+
+    def __init__(self, period: int):
+        self.period = period
+        self._weighted = _RunningSums(period)
+        self._volumes = _RunningSums(period)
+
+    def update(self, price: float, volume: float = 1.0):
+        self._weighted.push(price * volume)
+        self._volumes.push(volume)
+
+    @property
+    def ready(self) -> bool:
+        return self._volumes.window.full()
+
+    @property
+    def value(self) -> float | None:
+        if not self._volumes.window.count or self._volumes.total <= 0.0:
+            return None
+        return self._weighted.total / self._volumes.total
+
+    def to_vars(self) -> dict:
+        return {"weighted": self._weighted.window.values(), "volumes": self._volumes.window.values()}
+
+    def load_vars(self, state: dict):
+        self._weighted = _RunningSums(self.period)
+        self._volumes = _RunningSums(self.period)
+        for weighted, volume in zip(state.get("weighted", []), state.get("volumes", [])):
+            self._weighted.push(weighted)
+            self._volumes.push(volume)
+        self._weighted.resum()
+        self._volumes.resum()
+
+
+class IndicatorSet:
+    """
+    Named indicators of one algorithm that are updated together, e.g.
+        self.indicators = IndicatorSet(fast=EMA(12), slow=EMA(26), rsi=RSI(14))
+    in set_current_vars, followed by self.indicators.load_vars(new_vars.get("indicators", {})), and
+    "indicators": self.indicators.to_vars() in get_current_vars.
+    """
+
+    def __init__(self, **indicators: Indicator):
+        self.indicators: Dict[str, Indicator] = indicators
+
+    def __getitem__(self, name: str) -> Indicator:
+        return self.indicators[name]
+
+    def update(self, price: float, volume: float = 1.0):
+        for indicator in self.indicators.values():
+            indicator.update(price, volume)
+
+    @property
+    def ready(self) -> bool:
+        return all(indicator.ready for indicator in self.indicators.values())
+
+    def values(self) -> dict:
+        return {name: indicator.value for name, indicator in self.indicators.items()}
+
+    def to_vars(self) -> dict:
+        return {name: indicator.to_vars() for name, indicator in self.indicators.items()}
+
+    def load_vars(self, state: dict):
+        # indicators added since the state was stored start empty, removed ones are dropped
+        for name, indicator_state in (state or {}).items():
+            if name in self.indicators:
+                self.indicators[name].load_vars(indicator_state)
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from lib.candles import configure_candles
+from lib.history_store import configure_history, get_history_backend
+from lib.logger import logger
+from lib.metrics import metrics
+from lib.mock_exchange import FaultProfile, MockYahooServer, PricePath
+from lib.plugins import load_class
+from lib.quote_cache import quote_cache
+from lib.scheduler import TickScheduler
+from lib.state_store import configure_state_store
+
+LOAD_TEST_OUTPUT = "cache/load_test.json"
+DEFAULT_JOBS = 500
+DEFAULT_SYMBOLS = 20
+DEFAULT_TICKS = 20
+DEFAULT_ACTION_INTERVAL = 2.0
+PERCENTILES = (50, 90, 99)
+
+
+def _percentiles(values: List[float]) -> dict:
+    ordered = sorted(values)
+    summary = {f"p{percentile}": ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+               for percentile in PERCENTILES}
+    summary.update({"mean": statistics.fmean(ordered), "max": ordered[-1]})
+    return summary
+
+
+def _create_jobs(job_count: int, symbol_count: int) -> list:
+    algorithm_class = load_class("algorithms", "SafeTrade")
+    simulator_class = load_class("exchanges", "Simulator")
+    jobs = []
+    for algo_id in range(job_count):
+        symbol = f"MOCK{algo_id % symbol_count}-EUR"
+        price = PricePath.base_price(symbol)
+        exchange = simulator_class({"crypto_codename": symbol, "exchange_fee": 0.001, "wallet_crypto_amount": 0.0,
+                                    "wallet_fiat_amount": 100.0})
+        # thresholds around the base price, so the scripted paths make jobs trade
+        jobs.append(algorithm_class(exchange, str(algo_id), {"last_bought_price": price,
+                                                             "last_sold_price": price * 1.01}))
+    return jobs
+
+
+def run_load_test(run_tick: Callable, persist_results: Callable, job_count: int = DEFAULT_JOBS,
+                  symbol_count: int = DEFAULT_SYMBOLS, ticks: int = DEFAULT_TICKS,
+                  action_interval: float = DEFAULT_ACTION_INTERVAL, job_timeout: float = None,
+                  price_path: PricePath = None, faults: FaultProfile = None, history_backend: str = "jsonl") -> dict:
+    """
+    Runs the tick loop of the threaded engine (prefetch, actions, persistence) with job_count Simulator jobs spread
+    over symbol_count symbols against a MockYahooServer for the given number of ticks. History and state are written to
+    a temporary directory, so neither the live state nor the history is touched.
+    :param run_tick: main.run_tick
+    :param persist_results: main.persist_results
+    :param job_timeout: Seconds a job may take per tick, defaults to half of action_interval like the trading loop
+    :return: The report: tick duration percentiles, overruns, failed and timed out jobs, retries and server counters
+    """
+    job_timeout = action_interval / 2 if job_timeout is None else job_timeout
+    server = MockYahooServer(price_path, faults).start()
+    simulator_class = load_class("exchanges", "Simulator")
+    previous_base_url = simulator_class.base_url
+    simulator_class.base_url = server.url
+    working_dir = os.getcwd()
+    previous_level = logger.level
+    # per-job log lines would only measure the console
+    logger.setLevel(logging.WARNING)
+    metrics.enabled = True
+    counters_before = {name: metrics.counter(name) for name in
+                       ("job_failures_total", "job_timeouts_total", "http_retries_total")}
+    durations = []
+    completed_jobs = []
+    logger.warning(f"Load test: {job_count} jobs on {symbol_count} symbols, {ticks} ticks every {action_interval}s "
+                   f"against {server.url}")
+    with tempfile.TemporaryDirectory(prefix="volatenium-load-test-") as directory:
+        os.chdir(directory)
+        executor = ThreadPoolExecutor()
+        try:
+            configure_history(history_backend, root=os.path.join("cache", "history"))
+            configure_state_store(root="cache")
+            configure_candles(root=os.path.join("cache", "candles"))
+            quote_cache.invalidate()
+            jobs = _create_jobs(job_count, symbol_count)
+            scheduler = TickScheduler(action_interval)
+            for tick in range(ticks):
+                tick_start = time.perf_counter()
+                completed = run_tick(executor, jobs, job_timeout=job_timeout)
+                persist_results(completed)
+                durations.append(time.perf_counter() - tick_start)
+                completed_jobs.append(len(completed))
+                metrics.tick_summary()
+                if tick + 1 < ticks:
+                    time.sleep(scheduler.time_until_next_tick())
+        finally:
+            # actions that hang on the server must not keep the load test from returning
+            executor.shutdown(wait=False, cancel_futures=True)
+            get_history_backend().close()
+            os.chdir(working_dir)
+            simulator_class.base_url = previous_base_url
+            server.stop()
+            logger.setLevel(previous_level)
+            metrics.enabled = False
+
+    counters = {name: metrics.counter(name) - before for name, before in counters_before.items()}
+    return {
+        "meta": {
+            "created": time.time(),
+            "jobs": job_count,
+            "symbols": symbol_count,
+            "ticks": ticks,
+            "action_interval": action_interval,
+            "job_timeout": job_timeout,
+            "price_path": server.price_path.kind,
+            "faults": {name: getattr(server.faults, name) for name in
+                       ("latency", "jitter", "error_rate", "timeout_rate", "hang_seconds")}
+        },
+        "tick_seconds": _percentiles(durations),
+        "overruns": scheduler.overruns,
+        "skipped_ticks": scheduler.skipped_ticks,
+        "completed_jobs": _percentiles(completed_jobs),
+        "failed_jobs": int(counters["job_failures_total"]),
+        "timed_out_jobs": int(counters["job_timeouts_total"]),
+        "http_retries": int(counters["http_retries_total"]),
+        "server": dict(server.stats)
+    }
+
+
+def write_report(report: dict, path: str = LOAD_TEST_OUTPUT):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + ".tmp", path)
@@ -1,13 +1,21 @@
+import atexit
 import json
 import logging
+import multiprocessing
 import os
+import queue
 import sys
-from datetime import datetime
-from logging.handlers import RotatingFileHandler
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
-import numpy as np
 import yaml
 
+from lib.metrics import instrument
+from lib.records import ActionRecord, JobState
+
+DEFAULT_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUP_COUNT = 4
+
 
 class CustomFormatter(logging.Formatter):
     COLORS = {
@@ -19,49 +27,95 @@ class CustomFormatter(logging.Formatter):
         "RESET": "\033[0m"  # Reset color
     }
 
+    def __init__(self, colored: bool = True):
+        super().__init__()
+        self.colored = colored
+        self._cached_second = None
+        self._cached_time = None
+
+    def format_time(self, created: float) -> str:
+        # records arrive in bursts within the same second, so only format each second once
+        second = int(created)
+        if second != self._cached_second:
+            self._cached_time = time.strftime("%Y-%b-%d %H:%M.%S", time.localtime(second))
+            self._cached_second = second
+        return self._cached_time
+
+    def format(self, record):
+        log_str = f"[{record.levelname[0]}] {self.format_time(record.created)} {record.getMessage()}"
+        if record.exc_info:
+            log_str += "\n" + self.formatException(record.exc_info)
+        # Write uncolored log to file
+        if not self.colored:
+            return log_str
+        return f"{self.COLORS.get(record.levelname, self.COLORS["RESET"])}{log_str}{self.COLORS["RESET"]}"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line for log processing tools.
+    """
+
     def format(self, record):
-        color = self.COLORS.get(record.levelname, self.COLORS["RESET"])
-        time = datetime.now().strftime("%Y-%b-%d %H:%M.%S")
-        log_str = f"{color}[{record.levelname[0]}] {time} {record.getMessage()}{self.COLORS["RESET"]}"
-        # Write uncolored log to file as well
-        if hasattr(record, "logfile") and record.logfile:
-            return f"[{record.levelname[0]}] {time} {record.getMessage()}"
-        return log_str
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Puts records on the queue unformatted. The default QueueHandler formats the message in the calling thread; here
+    formatting happens in the listener thread, off the trading threads.
+    """
+
+    def prepare(self, record):
+        return record
 
 
 def float_to_human_readable(number: float):
+    # numpy is only needed here, most log records never reach this
+    import numpy as np
+
     return np.format_float_positional(number, trim='-')
 
 
-def log_action(action_report: dict, exchange_name: str, algorithm_name: str):
-    history = {}
-
-    if not os.path.exists("cache"):
-        os.makedirs("cache")
-    if os.path.exists("cache/history.json"):
-        with open("cache/history.json", "r") as f:
-            history = json.load(f)
-
-    if exchange_name not in history:
-        history[exchange_name] = {}
-    if algorithm_name not in history[exchange_name]:
-        history[exchange_name][algorithm_name] = []
-    history[exchange_name][algorithm_name].append({
-        "unix_timestamp": action_report["unix_timestamp"],
-        "id": action_report["id"],
-        "action": action_report["action"],
-        "action-result": action_report["action_result"],
-        "transacted_amount": action_report["transacted_amount"],
-        "current_price": action_report["current_price"],
-        "crypto-wallet": action_report["wallet_crypto_amount"],
-        "fiat-wallet": action_report["wallet_fiat_amount"]
-    })
-
-    with open("cache/history.json", "w") as f:
-        json.dump(history, f, indent=4)
-        # immediately write to disk
-        f.flush()
-        os.fsync(f.fileno())
+class HumanReadableFloat:
+    """
+    Log argument that is only converted with float_to_human_readable if the record is actually emitted.
+    """
+    __slots__ = ("number",)
+
+    def __init__(self, number: float):
+        self.number = number
+
+    def __str__(self):
+        return float_to_human_readable(self.number)
+
+
+@instrument("persistence_seconds", operation="log_action")
+def log_action(action_report: ActionRecord, exchange_name: str, algorithm_name: str):
+    """
+    Appends the action report to the trade history. Call flush_history() once per tick to make it durable.
+    """
+    from lib.history_store import get_history_backend
+
+    if isinstance(action_report, dict):
+        action_report = ActionRecord.from_dict(action_report)
+    get_history_backend().append(exchange_name, algorithm_name, action_report)
+
+
+@instrument("persistence_seconds", operation="flush_history")
+def flush_history():
+    from lib.history_store import get_history_backend
+
+    # immediately write to disk
+    get_history_backend().commit()
 
 
 def read_settings() -> dict:
@@ -80,22 +134,60 @@ def store_settings(settings: dict):
         yaml.safe_dump(settings, f, indent=2)
 
 
+@instrument("persistence_seconds", operation="store_state")
 def store_state(variables: dict):
-    if not os.path.exists("cache"):
-        os.makedirs("cache")
-    with open("cache/state.yaml", "w") as f:
-        yaml.safe_dump(variables, f, indent=2)
-        # immediately write to disk
-        f.flush()
-        os.fsync(f.fileno())
+    """
+    Stores the state of all jobs in variables ({"exchanges": {exchange: {"algorithms": [entry, ...]}}}). Only jobs
+    whose state changed are written.
+    """
+    from lib.state_store import get_state_store
+
+    state_store = get_state_store()
+    for exchange_name, exchange in variables.get("exchanges", {}).items():
+        for entry in exchange["algorithms"]:
+            state_store.update(exchange_name, JobState.from_dict(entry))
+    state_store.commit()
 
 
+@instrument("persistence_seconds", operation="read_state")
 def read_state() -> dict:
-    cached_vars = {}
-    if os.path.exists("cache/state.yaml"):
-        with open("cache/state.yaml", "r") as f:
-            cached_vars = yaml.safe_load(f)
-    return cached_vars
+    from lib.state_store import get_state_store
+
+    return get_state_store().load()
+
+
+def configure_logging(max_bytes: int = DEFAULT_LOG_MAX_BYTES, backup_count: int = DEFAULT_LOG_BACKUP_COUNT,
+                      json_log_file: str = None, log_file_name: str = "current.log"):
+    """
+    Replaces the handlers behind the logging queue.
+    :param max_bytes: Size after which logs/current.log is rotated
+    :param backup_count: Number of rotated log files to keep
+    :param json_log_file: Optional path of an additional log file with one JSON object per record
+    :param log_file_name: Name of the text log file in the logs directory
+    """
+    global _listener
+    handlers = [console_handler, _file_handler(max_bytes, backup_count, log_file_name)]
+    if json_log_file is not None:
+        json_handler = RotatingFileHandler(json_log_file, maxBytes=max_bytes, backupCount=backup_count)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+    # stopping drains the queue into the old handlers first
+    _listener.stop()
+    for handler in _listener.handlers:
+        if handler is not console_handler:
+            handler.close()
+    _listener = QueueListener(_log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _file_handler(max_bytes: int, backup_count: int, log_file_name: str = "current.log") -> RotatingFileHandler:
+    handler = RotatingFileHandler(os.path.join(log_dir, log_file_name), maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(CustomFormatter(colored=False))
+    return handler
+
+
+def _stop_logging():
+    _listener.stop()
 
 
 # Create log directory if it doesn't exist
@@ -107,11 +199,18 @@ logger = logging.getLogger("custom_logger")
 logger.setLevel(logging.DEBUG)
 
 # Console handler for colored output
-ch = logging.StreamHandler(sys.stdout)
-ch.setFormatter(CustomFormatter())
-logger.addHandler(ch)
-
-# Rotate log files on each run
-fh = RotatingFileHandler(os.path.join(log_dir, "current.log"), maxBytes=1, backupCount=4)
-fh.setFormatter(CustomFormatter())
-logger.addHandler(fh)
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(CustomFormatter())
+
+# Rotate log files on each run and whenever they grow too large
+file_handler = _file_handler(DEFAULT_LOG_MAX_BYTES, DEFAULT_LOG_BACKUP_COUNT)
+# child processes (e.g. shards) must not rotate away the log of the running parent
+if multiprocessing.parent_process() is None and os.path.getsize(file_handler.baseFilename) > 0:
+    file_handler.doRollover()
+
+# Trading threads only put records on the queue, formatting and I/O happen in the listener thread
+_log_queue = queue.SimpleQueue()
+logger.addHandler(DeferredQueueHandler(_log_queue))
+_listener = QueueListener(_log_queue, console_handler, file_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_stop_logging)
@@ -0,0 +1,282 @@
+import json
+import math
+import os
+import threading
+import time
+import urllib.parse
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from lib.candles import interval_seconds
+from lib.logger import logger
+
+MARKET_DATA_DIR = "cache/market_data"
+DEFAULT_INTERVAL = "1m"
+# bars per partition file: one day of 1m bars, 60 days of 1h bars
+BARS_PER_PARTITION = 1440
+OHLCV_DTYPE = np.dtype([
+    ("unix_timestamp", "<f8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8")
+])
+INDEX_FILE = "index.json"
+
+
+def _merge_ranges(ranges: List[Tuple[float, float]]) -> List[List[float]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _subtract_ranges(start: float, end: float, ranges: List[List[float]]) -> List[Tuple[float, float]]:
+    """
+    Returns the parts of [start, end) not covered by the sorted, merged ranges.
+    """
+    missing = []
+    for covered_start, covered_end in ranges:
+        if covered_end <= start:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+class MarketDataStore:
+    """
+    Local OHLCV bars per (symbol, interval), synced incrementally from a chart source such as Simulator.fetch_chart.
+
+    Bars are stored in <root>/<symbol>/<interval>/ as partition files of BARS_PER_PARTITION bars, named after the
+    start of their time range, so the partitions of a query follow from its time range without any lookup. Complete
+    (sealed) partitions are compressed .npz files; the partition that is still filling up is a plain .npy file that is
+    memory-mapped for reads. index.json keeps the time ranges that the source already served (so sync fetches only what
+    is missing, even if the source had no bars inside a range) and the row count and time range of every partition. A
+    range counts as served from where the source started serving it to the end of its last bar, so ranges the source
+    skipped, left empty or cut short are requested again by the next sync.
+    """
+
+    def __init__(self, root: str = MARKET_DATA_DIR, fetch_chart: Callable = None):
+        """
+        :param fetch_chart: fetch_chart(symbol, start, end, interval) returning (bars, served_start): the bars with
+            OHLCV_DTYPE for [start, end) and the start of the part the source was asked for, later than start if it
+            skipped older bars. Defaults to Simulator.fetch_chart (yahoo).
+        """
+        self.root = root
+        self._fetch_chart = fetch_chart
+        self._lock = threading.Lock()
+
+    @property
+    def fetch_chart(self) -> Callable:
+        if self._fetch_chart is None:
+            from exchanges.simulator import Simulator
+
+            self._fetch_chart = Simulator.fetch_chart
+        return self._fetch_chart
+
+    def series_dir(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.root, urllib.parse.quote(symbol, safe="-_.=^"), interval)
+
+    def _read_index(self, series_dir: str) -> dict:
+        index_path = os.path.join(series_dir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {"covered": [], "partitions": {}}
+        with open(index_path, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_index(series_dir: str, index: dict):
+        index_path = os.path.join(series_dir, INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    @staticmethod
+    def _partition_span(interval: str) -> int:
+        return interval_seconds(interval) * BARS_PER_PARTITION
+
+    def _partition_path(self, series_dir: str, partition_start: int, sealed: bool) -> str:
+        return os.path.join(series_dir, f"{partition_start}{'.npz' if sealed else '.npy'}")
+
+    def _read_partition(self, series_dir: str, partition_start: int) -> np.ndarray:
+        # decided by the files instead of the index, which is written last and may lag behind after a crash
+        sealed_path = self._partition_path(series_dir, partition_start, True)
+        if os.path.exists(sealed_path):
+            with np.load(sealed_path) as data:
+                return data["bars"]
+        return np.load(self._partition_path(series_dir, partition_start, False), mmap_mode="r")
+
+    def _write_partition(self, series_dir: str, partition_start: int, bars: np.ndarray, sealed: bool):
+        path = self._partition_path(series_dir, partition_start, sealed)
+        with open(path + ".tmp", "wb") as f:
+            if sealed:
+                np.savez_compressed(f, bars=bars)
+            else:
+                np.save(f, bars)
+        os.replace(path + ".tmp", path)
+        if sealed:
+            # the uncompressed file of the partition while it was filling up
+            unsealed_path = self._partition_path(series_dir, partition_start, False)
+            if os.path.exists(unsealed_path):
+                os.remove(unsealed_path)
+
+    def sync(self, symbol: str, start: float, end: float = None, interval: str = DEFAULT_INTERVAL) -> int:
+        """
+        Fetches the bars of [start, end) that the source did not serve before and stores them. The bar that is still in
+        progress is never stored, so the next sync fetches it once it is complete.
+        :param end: Defaults to now
+        :return: The number of bars received from the source
+        """
+        step = interval_seconds(interval)
+        # only complete bars
+        end = min(time.time() if end is None else end, math.floor(time.time() / step) * step)
+        start = math.floor(start / step) * step
+        if start >= end:
+            return 0
+        series_dir = self.series_dir(symbol, interval)
+        with self._lock:
+            index = self._read_index(series_dir)
+            missing = _subtract_ranges(start, end, index["covered"])
+            received = 0
+            for missing_start, missing_end in missing:
+                bars, served_start = self.fetch_chart(symbol, missing_start, missing_end, interval)
+                bars = bars[(bars["unix_timestamp"] >= missing_start) & (bars["unix_timestamp"] < missing_end)]
+                if not len(bars):
+                    # an outage or a range the source does not serve (anymore), the next sync asks again
+                    continue
+                # only what the source served: not the skipped start and not the end after the last bar
+                served = (max(missing_start, math.ceil(served_start / step) * step),
+                          min(missing_end, float(bars["unix_timestamp"].max()) + step))
+                if served != (missing_start, missing_end):
+                    logger.info(f"{symbol}: the source served only {time.ctime(served[0])} to "
+                                f"{time.ctime(served[1])} of {time.ctime(missing_start)} to "
+                                f"{time.ctime(missing_end)}, the next sync requests the rest again")
+                os.makedirs(series_dir, exist_ok=True)
+                index["covered"] = _merge_ranges([tuple(covered) for covered in index["covered"]] + [served])
+                self._store_bars(series_dir, index, bars, interval)
+                # after the partitions, so a crash in between refetches the range instead of losing it
+                self._write_index(series_dir, index)
+                received += len(bars)
+            if missing:
+                logger.info(f"Synced {received} {interval} bars of {symbol} in {len(missing)} missing ranges")
+        return received
+
+    def _store_bars(self, series_dir: str, index: dict, bars: np.ndarray, interval: str):
+        span = self._partition_span(interval)
+        partition_starts = (bars["unix_timestamp"] // span * span).astype(np.int64)
+        for partition_start in np.unique(partition_starts).tolist():
+            new_bars = bars[partition_starts == partition_start]
+            if str(partition_start) in index["partitions"]:
+                new_bars = np.concatenate((np.array(self._read_partition(series_dir, partition_start)), new_bars))
+            new_bars = new_bars[np.argsort(new_bars["unix_timestamp"], kind="stable")]
+            # newer bars replace older ones with the same timestamp, e.g. the overlap of two chart requests
+            keep = np.append(new_bars["unix_timestamp"][1:] != new_bars["unix_timestamp"][:-1], True)
+            new_bars = new_bars[keep]
+            sealed = self._covered(index, partition_start, partition_start + span)
+            self._write_partition(series_dir, partition_start, new_bars, sealed)
+            index["partitions"][str(partition_start)] = {
+                "rows": len(new_bars),
+                "first_timestamp": float(new_bars["unix_timestamp"][0]),
+                "last_timestamp": float(new_bars["unix_timestamp"][-1]),
+                "sealed": sealed
+            }
+        # partitions whose remaining bars were covered without new bars landing in them
+        for key, entry in index["partitions"].items():
+            partition_start = int(key)
+            if not entry["sealed"] and self._covered(index, partition_start, partition_start + span):
+                self._write_partition(series_dir, partition_start,
+                                      np.array(self._read_partition(series_dir, partition_start)), True)
+                entry["sealed"] = True
+
+    @staticmethod
+    def _covered(index: dict, start: float, end: float) -> bool:
+        return any(covered_start <= start and end <= covered_end for covered_start, covered_end in index["covered"])
+
+    def load(self, symbol: str, start: float = None, end: float = None,
+             interval: str = DEFAULT_INTERVAL) -> np.ndarray:
+        """
+        Returns the stored bars with start <= unix_timestamp < end, sorted by timestamp. Only the partitions that
+        overlap the range are read.
+        :return: A structured array with OHLCV_DTYPE
+        """
+        series_dir = self.series_dir(symbol, interval)
+        index = self._read_index(series_dir)
+        span = self._partition_span(interval)
+        parts = []
+        for partition_start in sorted(int(key) for key in index["partitions"]):
+            if (start is not None and partition_start + span <= start) or (end is not None and partition_start >= end):
+                continue
+            bars = self._read_partition(series_dir, partition_start)
+            timestamps = bars["unix_timestamp"]
+            first = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+            last = len(bars) if end is None else int(np.searchsorted(timestamps, end, side="left"))
+            parts.append(np.asarray(bars[first:last]))
+        if not parts:
+            return np.empty(0, dtype=OHLCV_DTYPE)
+        return np.concatenate(parts)
+
+    def price_at(self, symbol: str, unix_timestamp: float, interval: str = DEFAULT_INTERVAL) -> float | None:
+        """
+        Close of the last bar that started at or before unix_timestamp, None if there is none within the partition of
+        unix_timestamp and the one before it.
+        """
+        span = self._partition_span(interval)
+        bars = self.load(symbol, unix_timestamp - span, np.nextafter(unix_timestamp, math.inf), interval)
+        return float(bars["close"][-1]) if len(bars) else None
+
+    def gaps(self, symbol: str, start: float, end: float,
+             interval: str = DEFAULT_INTERVAL) -> List[Tuple[float, float]]:
+        """
+        Finds the parts of [start, end) without bars: ranges that were never synced and missing bars inside synced
+        ranges (exchange downtime, or market closures for symbols that do not trade around the clock).
+        :return: Sorted (gap_start, gap_end) ranges
+        """
+        step = interval_seconds(interval)
+        index = self._read_index(self.series_dir(symbol, interval))
+        gaps = _subtract_ranges(start, end, index["covered"])
+        for covered_start, covered_end in index["covered"]:
+            range_start, range_end = max(start, covered_start), min(end, covered_end)
+            if range_start >= range_end:
+                continue
+            timestamps = self.load(symbol, range_start, range_end, interval)["unix_timestamp"]
+            edges = np.concatenate(([range_start - step], timestamps, [range_end]))
+            missing = np.flatnonzero(np.diff(edges) > step)
+            gaps.extend((float(edges[position] + step), float(edges[position + 1])) for position in missing)
+        return sorted(gaps)
+
+    def symbols(self) -> List[Tuple[str, str]]:
+        """
+        Lists the (symbol, interval) of every stored series.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted((urllib.parse.unquote(symbol_dir), interval)
+                      for symbol_dir in os.listdir(self.root)
+                      for interval in os.listdir(os.path.join(self.root, symbol_dir))
+                      if os.path.exists(os.path.join(self.root, symbol_dir, interval, INDEX_FILE)))
+
+
+_market_data_store: MarketDataStore | None = None
+
+
+def configure_market_data(root: str = MARKET_DATA_DIR, fetch_chart: Callable = None) -> MarketDataStore:
+    global _market_data_store
+    _market_data_store = MarketDataStore(root, fetch_chart)
+    return _market_data_store
+
+
+def get_market_data_store() -> MarketDataStore:
+    if _market_data_store is None:
+        return configure_market_data()
+    return _market_data_store
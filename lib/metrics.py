@@ -0,0 +1,180 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+METRIC_PREFIX = "volatenium_"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Collects latency histograms and counters in memory. Histograms and counters are cumulative (for the Prometheus
+    endpoint); additionally all observations since the last tick_summary() call are kept for the per-tick log line.
+    Recording is a no-op while enabled is False, so offline replays do not pay for it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._tick_observations: Dict[str, List[Tuple[float, Tuple]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        label_items = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._histograms.get((name, label_items))
+            if histogram is None:
+                histogram = self._histograms[(name, label_items)] = Histogram()
+            histogram.observe(value)
+            self._tick_observations.setdefault(name, []).append((value, label_items))
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name: str) -> float:
+        """
+        Returns the value of a counter summed over all of its labels.
+        """
+        with self._lock:
+            return sum(value for (counter_name, _), value in self._counters.items() if counter_name == name)
+
+    @contextmanager
+    def timed(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render_prometheus(self) -> str:
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                for (histogram_name, label_items), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bucket, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        bucket_labels = label_items + (("le", "+Inf" if bucket == float("inf") else repr(bucket)),)
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(label_items)} {histogram.sum}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(label_items)} {histogram.count}")
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+                for (counter_name, label_items), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{METRIC_PREFIX}{name}{_format_labels(label_items)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def tick_summary(self) -> str:
+        """
+        Summarizes the observations since the last call (count, mean, max and the labels of the slowest observation
+        per metric) into one line and starts a new tick.
+        """
+        with self._lock:
+            observations = self._tick_observations
+            self._tick_observations = {}
+        parts = []
+        for name, values in sorted(observations.items()):
+            slowest_value, slowest_labels = max(values)
+            mean = sum(value for value, _ in values) / len(values)
+            slowest = ",".join(f"{key}={value}" for key, value in slowest_labels)
+            parts.append(f"{name} n={len(values)} mean={mean * 1000:.1f}ms max={slowest_value * 1000:.1f}ms"
+                         + (f" ({slowest})" if slowest else ""))
+        return "; ".join(parts)
+
+
+def _format_labels(label_items: Tuple) -> str:
+    if not label_items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"") for _, value in label_items)
+    return "{" + ",".join(f"{key}=\"{value}\"" for (key, _), value in zip(label_items, escaped)) + "}"
+
+
+metrics = MetricsRegistry()
+
+
+def instrument(name: str, label_function=None, **labels):
+    """
+    Decorator that records the run time of every call in the histogram name.
+    :param label_function: Optional function (self) -> dict that adds labels derived from the instance
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            call_labels = dict(labels, **label_function(args[0])) if label_function is not None else labels
+            with metrics.timed(name, **call_labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_from_queue(func, submitted: float):
+    """
+    Runs func (in a worker thread) and records how long it waited in the executor queue before starting.
+    :param submitted: time.perf_counter() at submission
+    """
+    metrics.observe("queue_lag_seconds", time.perf_counter() - submitted)
+    return func()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """
+    Serves the registry at http://<host>:<port>/metrics from a daemon thread.
+    :return: The ThreadingHTTPServer
+    """
+    # http.server is slow to import and only needed if metrics are served
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes would otherwise be printed to stderr
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,232 @@
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from typing import Dict, List
+
+PRICE_PATHS = ("constant", "sine", "random_walk", "crash")
+# seconds between two steps of the random walk and between two prices of a replayed price file
+DEFAULT_STEP_SECONDS = 1.0
+
+
+class PricePath:
+    """
+    Scripted prices of the mock server, a pure function of symbol and time so that every request (and every rerun)
+    sees the same market. Every symbol starts at its own base price, derived from its name.
+
+    * constant: the base price
+    * sine: the base price +-amplitude with one oscillation per period seconds
+    * random_walk: a geometric random walk with volatility per step, seeded by the symbol
+    * crash: the base price until crash_after seconds, then drop lower
+    * a price file (see lib.price_series): its prices replayed one per step_seconds, looping at its end
+    """
+
+    def __init__(self, kind: str = "sine", start: float = None, step_seconds: float = DEFAULT_STEP_SECONDS,
+                 amplitude: float = 0.02, period: float = 60.0, volatility: float = 0.002, crash_after: float = 30.0,
+                 drop: float = 0.3):
+        """
+        :param kind: One of PRICE_PATHS or the path of a price file
+        :param start: Unix timestamp the path starts at, defaults to now
+        """
+        self.kind = kind
+        self.start = time.time() if start is None else start
+        self.step_seconds = step_seconds
+        self.amplitude = amplitude
+        self.period = period
+        self.volatility = volatility
+        self.crash_after = crash_after
+        self.drop = drop
+        self._file_prices = None
+        if kind not in PRICE_PATHS:
+            from lib.price_series import load_price_series
+
+            self._file_prices = load_price_series(kind)[1].tolist()
+        self._walks: Dict[str, List[float]] = {}
+        self._generators: Dict[str, random.Random] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def base_price(symbol: str) -> float:
+        return 100.0 + zlib.crc32(symbol.encode("utf-8")) % 50000
+
+    def price(self, symbol: str, unix_timestamp: float = None) -> float:
+        elapsed = max(0.0, (time.time() if unix_timestamp is None else unix_timestamp) - self.start)
+        step = int(elapsed // self.step_seconds)
+        if self._file_prices is not None:
+            return self._file_prices[step % len(self._file_prices)]
+        base = self.base_price(symbol)
+        if self.kind == "sine":
+            return base * (1 + self.amplitude * math.sin(2 * math.pi * elapsed / self.period))
+        if self.kind == "random_walk":
+            return self._walk(symbol, step)
+        if self.kind == "crash" and elapsed >= self.crash_after:
+            return base * (1 - self.drop)
+        return base
+
+    def _walk(self, symbol: str, step: int) -> float:
+        with self._lock:
+            walk = self._walks.get(symbol)
+            if walk is None:
+                walk = self._walks[symbol] = [self.base_price(symbol)]
+                self._generators[symbol] = random.Random(symbol)
+            generator = self._generators[symbol]
+            # extended incrementally, so a request only pays for the steps since the last one
+            while len(walk) <= step:
+                walk.append(walk[-1] * math.exp(generator.gauss(0.0, self.volatility)))
+            return walk[step]
+
+
+class FaultProfile:
+    """
+    Faults injected into the responses of the mock server. Every request is delayed by latency seconds (+-jitter),
+    then fails with HTTP error_status at error_rate or hangs for hang_seconds before answering at timeout_rate, so
+    clients with a shorter timeout give up on it.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 timeout_rate: float = 0.0, hang_seconds: float = 30.0, seed: int = None):
+        if not 0 <= error_rate + timeout_rate <= 1:
+            raise ValueError("error_rate and timeout_rate must add up to a fraction between 0 and 1")
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self) -> tuple:
+        """
+        :return: (delay, fault) of one request, fault is None, "error" or "timeout"
+        """
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            roll = self._random.random()
+        if roll < self.error_rate:
+            return delay, "error"
+        if roll < self.error_rate + self.timeout_rate:
+            return delay + self.hang_seconds, "timeout"
+        return delay, None
+
+
+class MockYahooServer:
+    """
+    Local HTTP server that answers the yahoo requests of Simulator (/v8/finance/chart/<symbol> with or without a
+    period, /v7/finance/spark) with prices of a PricePath and the faults of a FaultProfile. Point Simulator.base_url
+    (setting yahoo_base_url) at url to run jobs against it.
+    """
+
+    def __init__(self, price_path: PricePath = None, faults: FaultProfile = None, host: str = "127.0.0.1",
+                 port: int = 0):
+        """
+        :param port: Port to listen on, 0 picks a free one
+        """
+        self.price_path = price_path if price_path is not None else PricePath()
+        self.faults = faults if faults is not None else FaultProfile()
+        self.host = host
+        self.port = port
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0}
+        self._server = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def start(self) -> "MockYahooServer":
+        """
+        Serves from a daemon thread until stop() is called.
+        """
+        # http.server is slow to import and only needed for the mock server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        mock = self
+
+        class YahooHandler(BaseHTTPRequestHandler):
+            # keep-alive, like yahoo, so the pooled connections of http_client are reused
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                mock._count("requests")
+                delay, fault = mock.faults.draw()
+                if fault == "timeout":
+                    mock._count("timeouts")
+                time.sleep(delay)
+                parts = urllib.parse.urlsplit(self.path)
+                query = {key: values[-1] for key, values in urllib.parse.parse_qs(parts.query).items()}
+                if fault == "error":
+                    mock._count("errors")
+                    status, body = mock.faults.error_status, {"finance": {"error": "injected fault"}}
+                elif parts.path.startswith("/v8/finance/chart/"):
+                    status, body = 200, mock.chart(urllib.parse.unquote(parts.path[len("/v8/finance/chart/"):]),
+                                                   query)
+                elif parts.path == "/v7/finance/spark":
+                    status, body = 200, mock.spark(query.get("symbols", "").split(","))
+                else:
+                    status, body = 404, {"finance": {"error": "not found"}}
+                data = json.dumps(body).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # the client gave up on a hanging request
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), YahooHandler)
+        # hanging requests must not keep the process alive or block stop()
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="mock-yahoo-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def chart(self, symbol: str, query: dict) -> dict:
+        """
+        Body of a chart request: the current price in meta and, with period1/period2, one bar per interval.
+        """
+        from lib.candles import interval_seconds
+
+        now = time.time()
+        result = {"meta": {"symbol": symbol, "regularMarketPrice": self.price_path.price(symbol, now)}}
+        if "period1" in query:
+            step = interval_seconds(query.get("interval", "1m"))
+            first = math.ceil(int(query["period1"]) / step) * step
+            end = min(int(query.get("period2", now)), now)
+            timestamps = list(range(first, int(end), step))
+            quote = {"open": [], "high": [], "low": [], "close": [], "volume": []}
+            for bar_start in timestamps:
+                # sampled at the start, middle and end of the bar
+                prices = [self.price_path.price(symbol, bar_start + offset * step) for offset in (0, 0.5, 0.999)]
+                quote["open"].append(prices[0])
+                quote["high"].append(max(prices))
+                quote["low"].append(min(prices))
+                quote["close"].append(prices[-1])
+                quote["volume"].append(0)
+            result["timestamp"] = timestamps
+            result["indicators"] = {"quote": [quote]}
+        return {"chart": {"result": [result], "error": None}}
+
+    def spark(self, symbols: List[str]) -> dict:
+        now = time.time()
+        return {"spark": {"result": [
+            {"symbol": symbol, "response": [{"meta": {"regularMarketPrice": self.price_path.price(symbol, now)}}]}
+            for symbol in symbols if symbol]}}
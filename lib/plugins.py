@@ -0,0 +1,40 @@
+import importlib
+import re as regex
+import threading
+from typing import Dict, Tuple
+
+_CAMEL_CASE_BOUNDARY = regex.compile(r'([a-z])([A-Z])')
+
+# (package, codename) -> class, every plugin is resolved only once per process
+_registry: Dict[Tuple[str, str], type] = {}
+_registry_lock = threading.Lock()
+
+
+def module_name(package: str, codename: str) -> str:
+    """
+    Returns the module a plugin class lives in, e.g. ("algorithms", "SafeTrade") -> "algorithms.safe_trade"
+    """
+    return f"{package}.{_CAMEL_CASE_BOUNDARY.sub(r'\1_\2', codename).lower()}"
+
+
+def load_class(package: str, codename: str):
+    """
+    Imports a class from its package by codename, e.g. ("algorithms", "SafeTrade") -> algorithms.safe_trade.SafeTrade
+    """
+    plugin = _registry.get((package, codename))
+    if plugin is None:
+        with _registry_lock:
+            plugin = _registry.get((package, codename))
+            if plugin is None:
+                plugin = _registry[(package, codename)] = getattr(
+                    importlib.import_module(module_name(package, codename)), codename)
+    return plugin
+
+
+def register_class(package: str, codename: str, plugin: type):
+    """
+    Makes load_class return plugin for codename without importing a module, e.g. for exchanges defined outside the
+    exchanges package.
+    """
+    with _registry_lock:
+        _registry[(package, codename)] = plugin
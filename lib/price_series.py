@@ -0,0 +1,70 @@
+import csv
+import os
+from typing import Tuple
+
+import numpy as np
+
+TIMESTAMP_COLUMNS = ("unix_timestamp", "timestamp", "time", "date")
+PRICE_COLUMNS = ("current_price", "price", "close")
+
+
+def load_price_series(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Loads historical prices from a local file. Supported formats:
+        - .csv: a header row with a timestamp column (unix_timestamp/timestamp/time/date, unix seconds) and a price
+          column (current_price/price/close)
+        - .npy: an array of shape (n, 2) with unix timestamps in the first and prices in the second column
+        - .npz: arrays named "timestamps" and "prices"
+        - .parquet: the same columns as .csv (requires pyarrow)
+    :param path: Path of the price file
+    :return: A tuple (timestamps, prices) of float64 arrays sorted by timestamp
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        timestamps, prices = _load_csv(path)
+    elif extension == ".npy":
+        data = np.load(path)
+        timestamps, prices = data[:, 0], data[:, 1]
+    elif extension == ".npz":
+        with np.load(path) as data:
+            timestamps, prices = data["timestamps"], data["prices"]
+    elif extension == ".parquet":
+        timestamps, prices = _load_parquet(path)
+    else:
+        raise ValueError(f"Unsupported price file format: {extension}. Use .csv, .npy, .npz or .parquet")
+
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    if len(timestamps) == 0:
+        raise ValueError(f"{path} contains no prices")
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], prices[order]
+
+
+def _find_column(columns, candidates: Tuple[str, ...], path: str) -> str:
+    for candidate in candidates:
+        if candidate in columns:
+            return candidate
+    raise ValueError(f"{path} has none of the columns {', '.join(candidates)}")
+
+
+def _load_csv(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    with open(path, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = [column.strip().lower() for column in next(reader)]
+        timestamp_index = header.index(_find_column(header, TIMESTAMP_COLUMNS, path))
+        price_index = header.index(_find_column(header, PRICE_COLUMNS, path))
+        data = np.loadtxt(f, delimiter=",", usecols=(timestamp_index, price_index), ndmin=2)
+    return data[:, 0], data[:, 1]
+
+
+def _load_parquet(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading .parquet price files requires pyarrow: pip install pyarrow")
+    table = pq.read_table(path)
+    columns = [column.lower() for column in table.column_names]
+    timestamp_column = table.column_names[columns.index(_find_column(columns, TIMESTAMP_COLUMNS, path))]
+    price_column = table.column_names[columns.index(_find_column(columns, PRICE_COLUMNS, path))]
+    return table.column(timestamp_column).to_numpy(), table.column(price_column).to_numpy()
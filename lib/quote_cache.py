@@ -0,0 +1,123 @@
+import threading
+import time
+from typing import Callable, Dict, List
+
+DEFAULT_TTL = 5.0
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.price = None
+        self.error = None
+
+
+class QuoteCache:
+    """
+    Process-wide cache of the last known price per symbol. Concurrent misses for the same symbol are coalesced into a
+    single fetch (single-flight): the first caller fetches, all other callers wait for its result.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        self._quotes: Dict[str, tuple] = {}
+        self._in_flight: Dict[str, _InFlight] = {}
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+        self._listeners: List[Callable[[str, float, float], None]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[str, float, float], None]) -> Callable[[], None]:
+        """
+        Calls callback(symbol, price, unix_timestamp) for every stored price. Callbacks run in the storing thread and
+        must not block.
+        :return: A function that removes the subscription
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                self._listeners.remove(callback)
+
+        return unsubscribe
+
+    def get(self, symbol: str, fetch: Callable[[str], float]) -> float:
+        """
+        Returns the cached price of symbol if it is younger than ttl, otherwise calls fetch(symbol) once for all
+        concurrent callers.
+        :param symbol: Symbol to price, e.g. "BTC-EUR"
+        :param fetch: Function that fetches the current price of a symbol from the exchange
+        :return:
+        """
+        with self._lock:
+            quote = self._quotes.get(symbol)
+            if quote is not None and time.monotonic() - quote[1] < self.ttl:
+                self._hits[symbol] = self._hits.get(symbol, 0) + 1
+                return quote[0]
+            in_flight = self._in_flight.get(symbol)
+            is_leader = in_flight is None
+            # only the caller that actually fetches counts as a miss
+            if is_leader:
+                in_flight = self._in_flight[symbol] = _InFlight()
+                self._misses[symbol] = self._misses.get(symbol, 0) + 1
+            else:
+                self._hits[symbol] = self._hits.get(symbol, 0) + 1
+
+        if not is_leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.price
+
+        try:
+            in_flight.price = fetch(symbol)
+            self.put(symbol, in_flight.price)
+            return in_flight.price
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[symbol]
+            in_flight.done.set()
+
+    def put(self, symbol: str, price: float, unix_timestamp: float = None):
+        """
+        Stores a price that was obtained elsewhere, e.g. by a batch request.
+        :param unix_timestamp: Time of the price for the listeners, defaults to now
+        """
+        with self._lock:
+            self._quotes[symbol] = (price, time.monotonic())
+            listeners = list(self._listeners)
+        if listeners:
+            unix_timestamp = time.time() if unix_timestamp is None else unix_timestamp
+            for callback in listeners:
+                callback(symbol, price, unix_timestamp)
+
+    def invalidate(self, symbol: str = None):
+        with self._lock:
+            if symbol is None:
+                self._quotes.clear()
+            else:
+                self._quotes.pop(symbol, None)
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Returns the hit and miss counters per symbol, e.g. {"BTC-EUR": {"hits": 59, "misses": 1}}
+        """
+        with self._lock:
+            return {symbol: {"hits": self._hits.get(symbol, 0), "misses": self._misses.get(symbol, 0)}
+                    for symbol in sorted(self._hits.keys() | self._misses.keys())}
+
+    def reset_stats(self):
+        with self._lock:
+            self._hits.clear()
+            self._misses.clear()
+
+
+quote_cache = QuoteCache()
+
+
+def configure_quote_cache(ttl: float):
+    quote_cache.ttl = ttl
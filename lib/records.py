@@ -0,0 +1,111 @@
+class ActionRecord:
+    """
+    Result of one perform_action call. Slotted so the reports of every job and tick cost one small object instead of
+    several dictionaries; to_dict() and history_dict() convert it only where it is serialized.
+    """
+    __slots__ = ("action", "action_result", "transacted_amount", "wallet_fiat_amount", "wallet_crypto_amount",
+                 "current_price", "unix_timestamp", "id")
+
+    def __init__(self, action: str = "hold", action_result: str | None = None, transacted_amount: float | None = None,
+                 wallet_fiat_amount: float = 0.0, wallet_crypto_amount: float = 0.0, current_price: float = 0.0,
+                 unix_timestamp: float = 0.0, id=None):
+        """
+        :param action: "buy_crypto" | "sell_crypto" | "hold"
+        :param action_result: "success" | "failure" | "partial" or None for hold
+        :param transacted_amount: Amount that was bought or sold or None
+        :param wallet_fiat_amount: Fiat that is currently in the exchange wallet
+        :param wallet_crypto_amount: Crypto that is currently in the exchange wallet
+        :param current_price: Reported market price at time of action
+        :param unix_timestamp: The current unix timestamp
+        :param id: id of the algorithm
+        """
+        self.action = action
+        self.action_result = action_result
+        self.transacted_amount = transacted_amount
+        self.wallet_fiat_amount = wallet_fiat_amount
+        self.wallet_crypto_amount = wallet_crypto_amount
+        self.current_price = current_price
+        self.unix_timestamp = unix_timestamp
+        self.id = id
+
+    def __getitem__(self, key: str):
+        # read access for code written against the old dictionary reports
+        return getattr(self, key)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ActionRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"ActionRecord({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def history_dict(self) -> dict:
+        """
+        The record layout stored in the trade history.
+        """
+        return {
+            "unix_timestamp": self.unix_timestamp,
+            "id": self.id,
+            "action": self.action,
+            "action-result": self.action_result,
+            "transacted_amount": self.transacted_amount,
+            "current_price": self.current_price,
+            "crypto-wallet": self.wallet_crypto_amount,
+            "fiat-wallet": self.wallet_fiat_amount
+        }
+
+    @classmethod
+    def from_dict(cls, report: dict) -> "ActionRecord":
+        """
+        Converts a dictionary action report, e.g. returned by an algorithm written before ActionRecord existed.
+        """
+        return cls(**{name: report.get(name) for name in cls.__slots__})
+
+    @classmethod
+    def from_history_dict(cls, record: dict) -> "ActionRecord":
+        return cls(record["action"], record["action-result"], record["transacted_amount"], record["fiat-wallet"],
+                   record["crypto-wallet"], record["current_price"], record["unix_timestamp"], record["id"])
+
+
+class JobState:
+    """
+    Persisted state of one job: an entry of state.yaml's exchanges/<exchange>/algorithms lists. algorithm_vars and
+    exchange_vars are the dictionaries returned by get_current_vars of the algorithm and its exchange.
+    """
+    __slots__ = ("id", "codename", "algorithm_vars", "exchange_vars")
+
+    def __init__(self, id, codename: str, algorithm_vars: dict, exchange_vars: dict):
+        self.id = id
+        self.codename = codename
+        self.algorithm_vars = algorithm_vars
+        self.exchange_vars = exchange_vars
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, JobState):
+            return NotImplemented
+        return (self.id == other.id and self.codename == other.codename
+                and self.algorithm_vars == other.algorithm_vars and self.exchange_vars == other.exchange_vars)
+
+    def __repr__(self) -> str:
+        return (f"JobState(id={self.id!r}, codename={self.codename!r}, algorithm_vars={self.algorithm_vars!r}, "
+                f"exchange_vars={self.exchange_vars!r})")
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "codename": self.codename, "algorithm_vars": self.algorithm_vars,
+                "exchange_vars": self.exchange_vars}
+
+    @classmethod
+    def from_dict(cls, entry: dict) -> "JobState":
+        return cls(entry["id"], entry.get("codename"), entry.get("algorithm_vars"), entry.get("exchange_vars"))
+
+    @classmethod
+    def of(cls, algorithm) -> "JobState":
+        """
+        Captures the current state of an AlgorithmInterface instance and its exchange.
+        """
+        return cls(algorithm.id_in_list, algorithm.codename, algorithm.get_current_vars(),
+                   algorithm.exchange.get_current_vars())
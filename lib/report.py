@@ -0,0 +1,177 @@
+import csv
+import json
+import math
+import os
+from fnmatch import fnmatchcase
+from typing import List
+
+import numpy as np
+
+from lib.history_reader import id_sort_key, parse_selector
+from lib.history_store import ACTIONS, ACTION_RESULTS
+from lib.logger import logger
+
+REPORT_OUTPUT_FILE = "cache/report.json"
+# crypto markets trade every day of the year
+TRADING_DAYS_PER_YEAR = 365
+REPORT_COLUMNS = ("exchange", "algorithm", "id", "records", "first_timestamp", "last_timestamp", "start_value",
+                  "final_value", "pnl", "return_pct", "realized_pnl", "unrealized_pnl", "fees_paid", "trades", "buys",
+                  "sells", "failed_trades", "win_rate", "max_drawdown_pct", "sharpe", "sortino", "buy_and_hold_pct",
+                  "excess_return_pct")
+
+_HOLD = ACTIONS.index("hold")
+_BUY = ACTIONS.index("buy_crypto")
+_SELL = ACTIONS.index("sell_crypto")
+_FAILURE = ACTION_RESULTS.index("failure")
+
+
+def _risk_ratios(timestamps: np.ndarray, equity: np.ndarray) -> tuple:
+    """
+    Annualized Sharpe and Sortino ratios (risk-free rate 0) of the daily returns of the equity, measured at the last
+    record of every UTC day, so they do not depend on the tick interval or on rolled up history.
+    :return: (sharpe, sortino), None where there are not enough days or no variation
+    """
+    days = (timestamps // 86400).astype(np.int64)
+    day_ends = np.append(np.flatnonzero(days[1:] != days[:-1]), len(days) - 1)
+    daily_equity = np.concatenate(([equity[0]], equity[day_ends]))
+    if len(daily_equity) < 3 or np.any(daily_equity[:-1] <= 0):
+        return None, None
+    returns = daily_equity[1:] / daily_equity[:-1] - 1
+    annualization = math.sqrt(TRADING_DAYS_PER_YEAR)
+    deviation = returns.std(ddof=1)
+    downside_deviation = math.sqrt(np.mean(np.minimum(returns, 0.0) ** 2))
+    sharpe = float(returns.mean() / deviation * annualization) if deviation > 0 else None
+    sortino = float(returns.mean() / downside_deviation * annualization) if downside_deviation > 0 else None
+    return sharpe, sortino
+
+
+def job_metrics(columns: np.ndarray) -> dict:
+    """
+    Performance metrics of the history records of one id, sorted by time.
+
+    The wallets of a record are the wallets after its action, so the value of the first record is the starting value.
+    Fees are not stored in the history; the fee of a trade is the value lost by it at the trade price
+    (-(fiat change + crypto change * price)). Realized and unrealized PnL use the average cost of the held crypto,
+    with the crypto held at the first record valued at the first price.
+    :param columns: Records with HISTORY_DTYPE
+    """
+    timestamps = np.asarray(columns["unix_timestamp"], dtype=np.float64)
+    prices = np.asarray(columns["current_price"], dtype=np.float64)
+    fiat = np.asarray(columns["fiat_wallet"], dtype=np.float64)
+    crypto = np.asarray(columns["crypto_wallet"], dtype=np.float64)
+    actions = np.asarray(columns["action"])
+    equity = fiat + crypto * prices
+
+    fiat_change = np.diff(fiat, prepend=fiat[0])
+    crypto_change = np.diff(crypto, prepend=crypto[0])
+    trade_rows = np.flatnonzero((actions != _HOLD) & (np.asarray(columns["action_result"]) != _FAILURE))
+    # the wallets before the first record are unknown, so a trade in it is counted but not accounted
+    trades = trade_rows[trade_rows > 0]
+    fees = -(fiat_change[trades] + crypto_change[trades] * prices[trades])
+
+    # average cost accounting only visits the trades, which are few compared to the records
+    cost_basis = float(crypto[0] * prices[0])
+    realized_pnl = 0.0
+    sells = wins = 0
+    for fiat_delta, crypto_delta, crypto_before in zip(fiat_change[trades].tolist(), crypto_change[trades].tolist(),
+                                                       crypto[trades - 1].tolist()):
+        if crypto_delta > 0:
+            cost_basis += -fiat_delta
+        elif crypto_delta < 0 and crypto_before > 0:
+            sold_cost = cost_basis * min(1.0, -crypto_delta / crypto_before)
+            cost_basis -= sold_cost
+            realized_pnl += fiat_delta - sold_cost
+            sells += 1
+            wins += int(fiat_delta > sold_cost)
+    unrealized_pnl = crypto[-1] * prices[-1] - cost_basis
+
+    peaks = np.maximum.accumulate(equity)
+    drawdowns = np.divide(equity, peaks, out=np.ones_like(equity), where=peaks > 0) - 1
+    sharpe, sortino = _risk_ratios(timestamps, equity)
+    start_value, final_value = float(equity[0]), float(equity[-1])
+    return_pct = (final_value / start_value - 1) * 100 if start_value else 0.0
+    buy_and_hold_pct = (prices[-1] / prices[0] - 1) * 100 if prices[0] else 0.0
+    return {
+        "records": len(columns),
+        "first_timestamp": float(timestamps[0]),
+        "last_timestamp": float(timestamps[-1]),
+        "start_value": start_value,
+        "final_value": final_value,
+        "pnl": final_value - start_value,
+        "return_pct": return_pct,
+        "realized_pnl": realized_pnl,
+        "unrealized_pnl": float(unrealized_pnl),
+        "fees_paid": float(fees.sum()),
+        "trades": len(trade_rows),
+        "buys": int(np.count_nonzero(actions[trade_rows] == _BUY)),
+        "sells": int(np.count_nonzero(actions[trade_rows] == _SELL)),
+        "failed_trades": int(np.count_nonzero((actions != _HOLD) & (columns["action_result"] == _FAILURE))),
+        "win_rate": wins / sells if sells else None,
+        "max_drawdown_pct": float(drawdowns.min()) * 100,
+        "sharpe": sharpe,
+        "sortino": sortino,
+        "buy_and_hold_pct": float(buy_and_hold_pct),
+        "excess_return_pct": float(return_pct - buy_and_hold_pct)
+    }
+
+
+def _group_by_id(raw_ids: np.ndarray) -> tuple:
+    """
+    Groups records by id, keeping their order within every id.
+    :return: (order, boundaries): the records of the n-th id are order[boundaries[n]:boundaries[n + 1]]
+    """
+    words = np.ascontiguousarray(raw_ids).view("<u8").reshape(-1, raw_ids.dtype.itemsize // 8)
+    if len(raw_ids) and not words[:, 1:].any():
+        # ids of up to 8 bytes (all numeric ids) sort as integers, several times faster than as strings
+        keys = words[:, 0]
+    else:
+        keys = np.unique(raw_ids, return_inverse=True)[1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    group_starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    return order, np.append(group_starts, len(raw_ids))
+
+
+def build_report(reader, selectors: List[str] = ()) -> List[dict]:
+    """
+    Computes job_metrics for every id with history that matches at least one selector (EXCHANGE[/ALGORITHM[/ID]] with
+    shell-style wildcards, no selectors select everything). Every series is loaded once and split by id.
+    :param reader: A HistoryReader or MergedHistoryReader
+    :return: One row per id, with the columns of REPORT_COLUMNS
+    """
+    patterns = [parse_selector(selector) for selector in selectors] or [("*", "*", "*")]
+    rows = []
+    for exchange_name, algorithm_name in reader.series():
+        series_patterns = [pattern for pattern in patterns if fnmatchcase(exchange_name, pattern[0])
+                           and fnmatchcase(algorithm_name, pattern[1])]
+        if not series_patterns:
+            continue
+        columns = reader.load(exchange_name, algorithm_name)
+        order, boundaries = _group_by_id(columns["id"])
+        for group_start, group_end in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+            algo_id = columns["id"][order[group_start]].decode("utf-8")
+            if not any(fnmatchcase(algo_id, pattern[2]) for pattern in series_patterns):
+                continue
+            id_columns = columns[order[group_start:group_end]]
+            rows.append({"exchange": exchange_name, "algorithm": algorithm_name, "id": algo_id,
+                         **job_metrics(id_columns)})
+    rows.sort(key=lambda row: (row["exchange"], row["algorithm"], id_sort_key(row["id"])))
+    return rows
+
+
+def write_report(rows: List[dict], path: str = REPORT_OUTPUT_FILE):
+    """
+    Writes the report as a JSON list of rows, or as CSV with the columns of REPORT_COLUMNS if path ends with .csv.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", newline="") as f:
+        if path.endswith(".csv"):
+            writer = csv.writer(f)
+            writer.writerow(REPORT_COLUMNS)
+            for row in rows:
+                writer.writerow(["" if row[column] is None else row[column] for column in REPORT_COLUMNS])
+        else:
+            json.dump(rows, f, indent=2)
+    os.replace(temporary_path, path)
+    logger.info(f"Report of {len(rows)} jobs written to {path}")
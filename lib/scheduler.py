@@ -0,0 +1,35 @@
+import time
+
+from lib.logger import logger
+from lib.metrics import metrics
+
+
+class TickScheduler:
+    """
+    Computes drift-free tick deadlines. Ticks are aligned once to wall clock multiples of interval (e.g. full minutes
+    for 60 seconds) and from then on only the monotonic clock is used, so slow ticks and clock adjustments never shift
+    the schedule. Ticks that are missed because a tick overran are skipped, not run back to back.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self._next_tick = time.monotonic() + (interval - time.time() % interval)
+
+    def time_until_next_tick(self) -> float:
+        """
+        Returns the seconds to wait until the next tick deadline and advances the schedule by one tick.
+        """
+        now = time.monotonic()
+        if now > self._next_tick:
+            missed = int((now - self._next_tick) // self.interval) + 1
+            self.overruns += 1
+            metrics.increment("tick_overruns_total")
+            metrics.increment("ticks_skipped_total", missed)
+            self.skipped_ticks += missed
+            logger.warning(f"Tick overran its interval of {self.interval}s, skipping {missed} tick(s)")
+            self._next_tick += missed * self.interval
+        wait_time = self._next_tick - now
+        self._next_tick += self.interval
+        return wait_time
@@ -0,0 +1,258 @@
+import json
+import multiprocessing
+import os
+import time
+import zlib
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List
+
+from lib.logger import logger
+from lib.metrics import metrics
+from lib.quote_cache import quote_cache
+from lib.scheduler import TickScheduler
+from lib.state_store import StateStore, STATE_DIR
+
+SHARD_DIR = os.path.join(STATE_DIR, "shards")
+LAYOUT_FILE = os.path.join(SHARD_DIR, "layout.json")
+SHARD_BY = ("exchange", "id")
+# seconds to wait for a shard to initialize its jobs
+SHARD_START_TIMEOUT = 300
+
+
+def shard_root(index: int) -> str:
+    """
+    Directory of the state (state.json, state.wal) and history (history/) of one shard.
+    """
+    return os.path.join(SHARD_DIR, str(index))
+
+
+def shard_of(exchange_name: str, algo_id, shards: int, shard_by: str = "id") -> int:
+    # crc32 instead of hash(), which is salted per process
+    key = exchange_name if shard_by == "exchange" else f"{exchange_name}/{algo_id}"
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def partition_settings(settings: dict, shards: int, shard_by: str = "id") -> List[dict]:
+    """
+    Splits the exchanges/<exchange>/algorithms lists of settings into one settings dictionary per shard.
+    """
+    if shard_by not in SHARD_BY:
+        raise ValueError(f"Unknown shard_by: {shard_by}. Use {' or '.join(SHARD_BY)}")
+    partitions = [dict(settings, exchanges={}) for _ in range(shards)]
+    for exchange_name, exchange in settings["exchanges"].items():
+        for algorithm in exchange["algorithms"]:
+            partition = partitions[shard_of(exchange_name, algorithm["id"], shards, shard_by)]
+            partition["exchanges"].setdefault(exchange_name, dict(exchange, algorithms=[]))["algorithms"].append(
+                algorithm)
+    return partitions
+
+
+def read_layout() -> dict | None:
+    if not os.path.exists(LAYOUT_FILE):
+        return None
+    with open(LAYOUT_FILE, "r") as f:
+        return json.load(f)
+
+
+def write_layout(partitions: List[dict]):
+    """
+    Records which shard owns which job, so the next start knows where the newest state of every job is.
+    """
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    jobs = [[exchange_name, algorithm["id"], index]
+            for index, partition in enumerate(partitions)
+            for exchange_name, exchange in partition["exchanges"].items()
+            for algorithm in exchange["algorithms"]]
+    with open(LAYOUT_FILE + ".tmp", "w") as f:
+        json.dump({"shards": len(partitions), "jobs": jobs}, f)
+    os.replace(LAYOUT_FILE + ".tmp", LAYOUT_FILE)
+
+
+def clear_layout():
+    if os.path.exists(LAYOUT_FILE):
+        os.remove(LAYOUT_FILE)
+
+
+def read_merged_state(state: dict) -> dict:
+    """
+    Merges the state of the shards of the last sharded run over state (the state of the unsharded store). Every job
+    is taken from the shard that owned it according to the layout, so the shard count can change between runs.
+    :return: The merged state in the state.yaml layout
+    """
+    layout = read_layout()
+    if layout is None:
+        return state
+    entries = {(exchange_name, entry["id"]): entry
+               for exchange_name, exchange in (state.get("exchanges", {}) or {}).items()
+               for entry in exchange.get("algorithms", [])}
+    owners = {(exchange_name, algo_id): index for exchange_name, algo_id, index in layout["jobs"]}
+    for index in range(layout["shards"]):
+        shard_state = StateStore(shard_root(index)).load()
+        for exchange_name, exchange in shard_state.get("exchanges", {}).items():
+            for entry in exchange.get("algorithms", []):
+                key = (exchange_name, entry["id"])
+                if owners.get(key) == index:
+                    entries[key] = entry
+    merged = {"exchanges": {}}
+    for (exchange_name, _), entry in entries.items():
+        merged["exchanges"].setdefault(exchange_name, {"algorithms": []})["algorithms"].append(entry)
+    return merged
+
+
+def shard_indexes() -> List[int]:
+    """
+    Returns the index of every shard directory on disk, including those of earlier runs with more shards.
+    """
+    if not os.path.isdir(SHARD_DIR):
+        return []
+    return sorted(int(name) for name in os.listdir(SHARD_DIR)
+                  if name.isdigit() and os.path.isdir(os.path.join(SHARD_DIR, name)))
+
+
+def history_backends(backend) -> list:
+    """
+    Returns backend and a backend of the same class for the history of every shard that ever ran. Shard histories are
+    never moved into the main history, so they are found by their directories and not by the layout of the last run.
+    """
+    backend_class = type(backend)
+    return [backend] + [backend_class(os.path.join(shard_root(index), "history"), backend.segment_size)
+                        for index in shard_indexes()
+                        if os.path.isdir(os.path.join(shard_root(index), "history"))]
+
+
+def open_history_reader(backend):
+    """
+    Returns a HistoryReader over backend, merged with the history of every shard (see history_backends).
+    """
+    from lib.history_reader import HistoryReader, MergedHistoryReader
+
+    backends = history_backends(backend)
+    if len(backends) == 1:
+        return HistoryReader(backend)
+    return MergedHistoryReader([HistoryReader(shard_backend) for shard_backend in backends])
+
+
+class ShardCoordinator:
+    """
+    Runs the jobs of every partition in its own process and drives all of them from one TickScheduler: every tick the
+    prices of all shared_quotes exchanges are fetched once, sent to the shards with the tick command, and the shards
+    run their jobs and persist their results into their own history and state directories. A shard that has not
+    finished its previous tick by the next one skips it.
+
+    worker(index, partition, connection, *shard_arguments[index]) runs in the shard process and must answer ("ready", job_count)
+    once its jobs are initialized, then ("done", completed_count) after every ("tick", prices) message, and exit on
+    ("stop", None).
+    """
+
+    def __init__(self, partitions: List[dict], worker: Callable, shard_arguments: List[tuple], action_interval: float,
+                 price_fetchers: Dict[type, set]):
+        """
+        :param shard_arguments: Additional picklable arguments of worker per partition
+        :param price_fetchers: shared_quotes exchange class -> symbols to price once per tick
+        """
+        self.partitions = partitions
+        self.worker = worker
+        self.shard_arguments = shard_arguments
+        self.action_interval = action_interval
+        self.price_fetchers = price_fetchers
+        self.scheduler = TickScheduler(action_interval)
+        self._processes = []
+        self._connections = []
+        self._busy = set()
+
+    def start(self):
+        # spawn, so the shards do not inherit the threads (logging, metrics server) of this process
+        context = multiprocessing.get_context("spawn")
+        for index, partition in enumerate(self.partitions):
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(target=self.worker, name=f"shard-{index}", daemon=True,
+                                      args=(index, partition, child_connection) + tuple(self.shard_arguments[index]))
+            process.start()
+            child_connection.close()
+            self._processes.append(process)
+            self._connections.append(parent_connection)
+        job_count = 0
+        for index, connection in enumerate(self._connections):
+            if not connection.poll(SHARD_START_TIMEOUT):
+                raise RuntimeError(f"Shard {index} did not start within {SHARD_START_TIMEOUT}s")
+            message, count = self._receive(index)
+            job_count += count
+        logger.info(f"Started {len(self._processes)} shards with {job_count} jobs")
+
+    def _receive(self, index: int) -> tuple:
+        try:
+            message = self._connections[index].recv()
+        except EOFError:
+            raise RuntimeError(f"Shard {index} exited with code {self._processes[index].exitcode}")
+        if message[0] == "error":
+            raise RuntimeError(f"Shard {index} failed: {message[1]}")
+        return message
+
+    def fetch_prices(self) -> dict:
+        prices = {}
+        for exchange_class, symbols in self.price_fetchers.items():
+            try:
+                with metrics.timed("price_fetch_seconds", exchange=exchange_class.__name__):
+                    prices.update(exchange_class.get_current_prices(sorted(symbols)))
+            except Exception as e:
+                # the shards fall back to fetching prices themselves
+                logger.error(f"Fetching prices of {exchange_class.__name__} failed: {e!r}")
+        return prices
+
+    def run_tick(self) -> int:
+        """
+        Sends one tick to every idle shard and waits until all shards answered or the tick interval is over.
+        :return: Number of completed actions
+        """
+        tick_start = time.monotonic()
+        prices = self.fetch_prices()
+        for index, connection in enumerate(self._connections):
+            if index in self._busy:
+                logger.warning(f"Shard {index} is still running its previous tick, skipping this tick")
+                continue
+            connection.send(("tick", prices))
+            self._busy.add(index)
+
+        completed = 0
+        deadline = tick_start + self.action_interval
+        while self._busy:
+            ready = wait([self._connections[index] for index in self._busy], max(0.0, deadline - time.monotonic()))
+            if not ready:
+                break
+            for connection in ready:
+                index = self._connections.index(connection)
+                completed += self._receive(index)[1]
+                self._busy.discard(index)
+        return completed
+
+    def run_forever(self):
+        try:
+            while True:
+                logger.info(f"Performing actions on {len(self._processes)} shards...")
+                tick_start = time.perf_counter()
+                completed = self.run_tick()
+                metrics.observe("tick_seconds", time.perf_counter() - tick_start)
+                logger.info(f"Tick finished in {time.perf_counter() - tick_start:.2f}s, {completed} actions completed"
+                            f", {len(self._busy)} shards still busy")
+                logger.info(f"Tick metrics: {metrics.tick_summary()}")
+
+                wait_time = self.scheduler.time_until_next_tick()
+                logger.info(f"Sleeping until next action ({wait_time:.2f}s)")
+                time.sleep(wait_time)
+        finally:
+            self.stop()
+
+    def stop(self):
+        for connection in self._connections:
+            try:
+                connection.send(("stop", None))
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+
+
+def apply_prices(prices: dict):
+    # used by shards: prices fetched by the coordinator serve every get_current_price of the tick
+    for symbol, price in prices.items():
+        quote_cache.put(symbol, price)
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+
+import yaml
+
+from lib.logger import logger
+from lib.metrics import instrument
+from lib.records import JobState
+
+STATE_DIR = "cache"
+DEFAULT_COMPACT_INTERVAL = 60
+
+
+class StateStore:
+    """
+    Persists the state of every job (the entries of state.yaml's exchanges/<exchange>/algorithms lists) incrementally.
+    commit() appends only the entries that changed since the last commit to a write-ahead log (state.wal, one JSON
+    object per line) with a single fsync. Every compact_interval commits the full state is written to state.json with
+    an atomic write-rename, exported to state.yaml for humans, and the log is truncated.
+    """
+
+    def __init__(self, root: str = STATE_DIR, compact_interval: int = DEFAULT_COMPACT_INTERVAL):
+        self.root = root
+        self.compact_interval = compact_interval
+        self.snapshot_path = os.path.join(root, "state.json")
+        self.wal_path = os.path.join(root, "state.wal")
+        self.yaml_path = os.path.join(root, "state.yaml")
+        # (exchange, id) -> JobState, in insertion order
+        self._entries = {}
+        self._dirty = set()
+        self._commits_since_compaction = 0
+        self._wal = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """
+        Restores the state from state.json and state.wal. Falls back to the state.yaml of older versions if neither
+        exists.
+        :return: The state in the state.yaml layout: {"exchanges": {exchange: {"algorithms": [entry, ...]}}}
+        """
+        self._entries = {}
+        if os.path.exists(self.snapshot_path) or os.path.exists(self.wal_path):
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, "r") as f:
+                    self._set_state(json.load(f))
+            if os.path.exists(self.wal_path):
+                with open(self.wal_path, "r") as f:
+                    for line in f:
+                        # a crash between write and fsync can leave a torn last line
+                        if not line.endswith("\n"):
+                            break
+                        change = json.loads(line)
+                        entry = JobState.from_dict(change["entry"])
+                        self._entries[(change["exchange"], entry.id)] = entry
+        elif os.path.exists(self.yaml_path):
+            logger.info(f"Importing state from {self.yaml_path}")
+            with open(self.yaml_path, "r") as f:
+                self._set_state(yaml.safe_load(f) or {})
+            # the log only holds changes, so the imported state needs a snapshot to build on
+            self._compact()
+        return self.state()
+
+    def _set_state(self, state: dict):
+        for exchange_name, exchange in (state.get("exchanges", {}) or {}).items():
+            for entry in exchange.get("algorithms", []):
+                self._entries[(exchange_name, entry["id"])] = JobState.from_dict(entry)
+
+    def state(self) -> dict:
+        state = {"exchanges": {}}
+        for (exchange_name, _), entry in self._entries.items():
+            state["exchanges"].setdefault(exchange_name, {"algorithms": []})["algorithms"].append(entry.to_dict())
+        return state
+
+    def update(self, exchange_name: str, entry: JobState):
+        """
+        Sets the state of one job. Only entries that differ from the stored one are written on the next commit.
+        :param exchange_name: Exchange codename of the job
+        """
+        key = (exchange_name, entry.id)
+        with self._lock:
+            if self._entries.get(key) != entry:
+                self._entries[key] = entry
+                self._dirty.add(key)
+
+    def prune(self, keys: set):
+        """
+        Drops the state of all jobs whose (exchange, id) is not in keys, e.g. jobs removed from settings.yaml.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key not in keys]:
+                del self._entries[key]
+            # rewrite the snapshot so the removed jobs do not come back from it
+            self._compact()
+
+    @instrument("persistence_seconds", operation="state_commit")
+    def commit(self):
+        with self._lock:
+            if self._dirty:
+                if self._wal is None:
+                    os.makedirs(self.root, exist_ok=True)
+                    self._wal = open(self.wal_path, "a")
+                for key in self._dirty:
+                    self._wal.write(json.dumps({"exchange": key[0], "entry": self._entries[key].to_dict()}) + "\n")
+                # immediately write to disk
+                self._wal.flush()
+                os.fsync(self._wal.fileno())
+                self._dirty.clear()
+            self._commits_since_compaction += 1
+            if self._commits_since_compaction >= self.compact_interval:
+                self._compact()
+
+    def _compact(self):
+        os.makedirs(self.root, exist_ok=True)
+        state = self.state()
+        _atomic_write(self.snapshot_path, json.dumps(state))
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        if os.path.exists(self.wal_path):
+            os.remove(self.wal_path)
+        # human-readable export, never read back unless state.json is missing
+        _atomic_write(self.yaml_path, yaml.safe_dump(state, indent=2))
+        self._dirty.clear()
+        self._commits_since_compaction = 0
+
+
+def _atomic_write(path: str, content: str):
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+_state_store: StateStore | None = None
+
+
+def configure_state_store(compact_interval: int = DEFAULT_COMPACT_INTERVAL, root: str = STATE_DIR) -> StateStore:
+    global _state_store
+    _state_store = StateStore(root, compact_interval)
+    return _state_store
+
+
+def get_state_store() -> StateStore:
+    if _state_store is None:
+        return configure_state_store()
+    return _state_store
@@ -0,0 +1,248 @@
+import heapq
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from lib.logger import logger
+from lib.metrics import metrics, timed_from_queue
+from lib.price_series import load_price_series
+from lib.quote_cache import quote_cache
+
+DEFAULT_DEBOUNCE = 1.0
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_FLUSH_INTERVAL = 1.0
+MAX_WORKER_THREADS = 128
+
+
+class PriceBus:
+    """
+    In-process publish/subscribe channel for price ticks. Every published price is also put into the quote cache, so
+    get_current_price of shared_quotes exchanges returns the pushed price without a request.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Callable[[str, float, float], None]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, symbol: str, callback: Callable[[str, float, float], None]) -> Callable[[], None]:
+        """
+        Calls callback(symbol, price, unix_timestamp) for every price published for symbol. Callbacks run in the
+        publishing thread and must not block.
+        :return: A function that removes the subscription
+        """
+        with self._lock:
+            self._subscribers.setdefault(symbol, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers[symbol].remove(callback)
+
+        return unsubscribe
+
+    def publish(self, symbol: str, price: float, unix_timestamp: float = None):
+        quote_cache.put(symbol, price, unix_timestamp)
+        metrics.increment("price_events_total", symbol=symbol)
+        with self._lock:
+            subscribers = list(self._subscribers.get(symbol, ()))
+        for callback in subscribers:
+            callback(symbol, price, time.time() if unix_timestamp is None else unix_timestamp)
+
+
+class PriceFeed(ABC):
+    """
+    Source of price ticks that publishes into a PriceBus from its own thread.
+    """
+
+    def __init__(self, bus: PriceBus):
+        self.bus = bus
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_safely, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run_safely(self):
+        try:
+            self.run()
+        except Exception as e:
+            logger.critical(f"{self.__class__.__name__} stopped: {e!r}")
+
+    @abstractmethod
+    def run(self):
+        """
+        Publishes prices until self._stop is set.
+        """
+        pass
+
+
+class ReplayFeed(PriceFeed):
+    """
+    Local stand-in for a streaming exchange connection: publishes the prices of price files (see load_price_series) in
+    timestamp order, spaced like the original timestamps divided by speed.
+    """
+
+    def __init__(self, bus: PriceBus, price_files: Dict[str, str], speed: float = 1.0):
+        """
+        :param price_files: crypto_codename -> price file
+        :param speed: Replay speed factor, 0 publishes as fast as possible
+        """
+        super().__init__(bus)
+        self.speed = speed
+        symbols, timestamps, prices = [], [], []
+        for symbol, path in price_files.items():
+            series_timestamps, series_prices = load_price_series(path)
+            symbols.extend([symbol] * len(series_prices))
+            timestamps.append(series_timestamps)
+            prices.append(series_prices)
+        # merge all series into one stream ordered by timestamp
+        timestamps = np.concatenate(timestamps) if timestamps else np.empty(0)
+        order = np.argsort(timestamps, kind="stable")
+        self._symbols = [symbols[position] for position in order]
+        self._timestamps = timestamps[order].tolist()
+        self._prices = (np.concatenate(prices)[order] if prices else np.empty(0)).tolist()
+
+    def run(self):
+        if not self._prices:
+            return
+        start = time.monotonic()
+        first_timestamp = self._timestamps[0]
+        for symbol, unix_timestamp, price in zip(self._symbols, self._timestamps, self._prices):
+            if self.speed > 0:
+                wait_time = start + (unix_timestamp - first_timestamp) / self.speed - time.monotonic()
+                if wait_time > 0 and self._stop.wait(wait_time):
+                    return
+            elif self._stop.is_set():
+                return
+            self.bus.publish(symbol, price, unix_timestamp)
+        logger.info("Replay feed reached the end of its price files")
+
+
+class PollingFeed(PriceFeed):
+    """
+    Feed for exchanges without a push API: prices all symbols with one get_current_prices call per exchange class
+    every poll_interval seconds and publishes only prices that changed.
+    """
+
+    def __init__(self, bus: PriceBus, symbols_by_class: Dict[type, set], poll_interval: float = DEFAULT_POLL_INTERVAL):
+        super().__init__(bus)
+        self.symbols_by_class = symbols_by_class
+        self.poll_interval = poll_interval
+        self._last_prices = {}
+
+    def run(self):
+        while True:
+            poll_start = time.monotonic()
+            for exchange_class, symbols in self.symbols_by_class.items():
+                try:
+                    prices = exchange_class.get_current_prices(sorted(symbols))
+                except Exception as e:
+                    logger.error(f"Polling prices of {exchange_class.__name__} failed: {e!r}")
+                    continue
+                for symbol, price in prices.items():
+                    if self._last_prices.get(symbol) != price:
+                        self._last_prices[symbol] = price
+                        self.bus.publish(symbol, price)
+            if self._stop.wait(max(0.0, self.poll_interval - (time.monotonic() - poll_start))):
+                return
+
+
+class _ScheduledJob:
+    __slots__ = ("job", "last_start", "scheduled", "running", "pending")
+
+    def __init__(self, job):
+        self.job = job
+        self.last_start = float("-inf")
+        self.scheduled = False
+        self.running = False
+        self.pending = False
+
+
+class StreamingEngine:
+    """
+    Runs a job whenever a new price of its exchange's crypto_codename is published on the bus instead of on a fixed
+    interval. Jobs are debounced: a job starts at most once per debounce seconds and never runs concurrently with
+    itself; price events that arrive in between are coalesced into one trailing run with the newest price. Finished
+    action reports are handed to on_tick_complete in batches every flush_interval seconds.
+    """
+
+    def __init__(self, jobs: list, bus: PriceBus, debounce: float, on_tick_complete: Callable[[list], None],
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        """
+        :param jobs: AlgorithmInterface instances
+        :param on_tick_complete: Called with a list of (algorithm, action_report) tuples
+        """
+        self.bus = bus
+        self.debounce = debounce
+        self.on_tick_complete = on_tick_complete
+        self.flush_interval = flush_interval
+        self._states = [_ScheduledJob(job) for job in jobs]
+        self._due = []
+        self._completed = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=min(len(jobs) + 1, MAX_WORKER_THREADS))
+        states_by_symbol = {}
+        for state in self._states:
+            states_by_symbol.setdefault(state.job.exchange.crypto_codename, []).append(state)
+        for symbol, states in states_by_symbol.items():
+            bus.subscribe(symbol, lambda _, __, ___, states=states: self._on_price(states))
+
+    def _on_price(self, states: List[_ScheduledJob]):
+        with self._condition:
+            for state in states:
+                if state.running:
+                    # run once more with the newest price when the current action is done
+                    state.pending = True
+                    continue
+                if state.scheduled:
+                    # the scheduled action picks up the newest price
+                    continue
+                state.scheduled = True
+                heapq.heappush(self._due, (state.last_start + self.debounce, id(state), state))
+            self._condition.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._due or self._due[0][0] > time.monotonic():
+                    self._condition.wait(None if not self._due else self._due[0][0] - time.monotonic())
+                _, _, state = heapq.heappop(self._due)
+                state.scheduled = False
+                state.running = True
+                state.last_start = time.monotonic()
+            self._executor.submit(self._run_job, state, time.perf_counter())
+
+    def _run_job(self, state: _ScheduledJob, submitted: float):
+        try:
+            action_report = timed_from_queue(state.job.perform_action, submitted)
+            with self._condition:
+                self._completed.append((state.job, action_report))
+        except Exception as e:
+            logger.error(f"{state.job.codename} {state.job.id_in_list}: action failed: {e!r}")
+        finally:
+            with self._condition:
+                state.running = False
+                if state.pending:
+                    state.pending = False
+                    state.scheduled = True
+                    heapq.heappush(self._due, (state.last_start + self.debounce, id(state), state))
+                    self._condition.notify()
+
+    def run_forever(self):
+        threading.Thread(target=self._dispatch, name="streaming-dispatch", daemon=True).start()
+        while True:
+            time.sleep(self.flush_interval)
+            with self._condition:
+                completed, self._completed = self._completed, []
+            if completed:
+                self.on_tick_complete(completed)
+                logger.info(f"Stored {len(completed)} actions. Tick metrics: {metrics.tick_summary()}")
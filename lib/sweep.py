@@ -0,0 +1,189 @@
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+
+import numpy as np
+import yaml
+
+from lib.backtest import ReplayRun
+from lib.logger import logger
+from lib.plugins import load_class
+from lib.price_series import load_price_series
+
+SWEEP_OUTPUT_DIR = "cache/sweep"
+RANKED_COLUMNS = ("rank", "key", "codename", "crypto_codename", "final_value", "return_pct", "buy_and_hold_pct",
+                  "trades", "exchange_vars", "algorithm_vars")
+# seconds between rewrites of the ranked table while the sweep is running
+RANKED_REWRITE_INTERVAL = 5.0
+
+# price arrays of the worker process, attached from shared memory once per worker
+_worker_prices: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+_worker_segments: List[shared_memory.SharedMemory] = []
+
+
+def _grid(values: dict) -> List[dict]:
+    """
+    Expands {"a": [1, 2], "b": 3} into [{"a": 1, "b": 3}, {"a": 2, "b": 3}]. Non-list values are fixed.
+    """
+    values = values or {}
+    keys = list(values)
+    options = [value if isinstance(value, list) else [value] for value in values.values()]
+    return [dict(zip(keys, combination)) for combination in itertools.product(*options)]
+
+
+def expand_sweep(spec: dict) -> List[dict]:
+    """
+    Expands a sweep spec into one job per combination. Spec layout:
+        prices:
+          BTC-EUR: btc.npy        # crypto_codename -> price file (see load_price_series)
+        algorithms:
+          - codename: SafeTrade
+            exchange_vars:        # every list is a sweep dimension
+              exchange_fee: [0.0001, 0.001]
+              wallet_crypto_amount: 0.0
+              wallet_fiat_amount: [100.0, 1000.0]
+            algorithm_vars:
+              last_bought_price: 0.0
+    :return: A list of {"key", "codename", "exchange_vars", "algorithm_vars"} jobs. key is stable across runs and is
+        used to resume interrupted sweeps.
+    """
+    jobs = []
+    for algorithm in spec["algorithms"]:
+        for crypto_codename in spec["prices"]:
+            for exchange_vars, algorithm_vars in itertools.product(_grid(algorithm.get("exchange_vars")),
+                                                                   _grid(algorithm.get("algorithm_vars"))):
+                exchange_vars["crypto_codename"] = crypto_codename
+                job = {
+                    "codename": algorithm["codename"],
+                    "exchange_vars": exchange_vars,
+                    "algorithm_vars": algorithm_vars
+                }
+                job["key"] = hashlib.sha1(json.dumps(job, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+                jobs.append(job)
+    return jobs
+
+
+def _share_prices(price_files: Dict[str, str]) -> Tuple[Dict[str, Tuple[str, int]], List[shared_memory.SharedMemory]]:
+    """
+    Loads every price file once and copies (timestamps, prices) into a shared memory segment per symbol.
+    """
+    layout = {}
+    segments = []
+    for crypto_codename, path in price_files.items():
+        timestamps, prices = load_price_series(path)
+        segment = shared_memory.SharedMemory(create=True, size=max(1, 2 * len(prices) * 8))
+        shared = np.ndarray((2, len(prices)), dtype=np.float64, buffer=segment.buf)
+        shared[0] = timestamps
+        shared[1] = prices
+        layout[crypto_codename] = (segment.name, len(prices))
+        segments.append(segment)
+    return layout, segments
+
+
+def _attach_prices(layout: Dict[str, Tuple[str, int]]):
+    # worker initializer: map the parent's price arrays without copying them
+    logger.setLevel(logging.ERROR)
+    for crypto_codename, (name, length) in layout.items():
+        segment = shared_memory.SharedMemory(name=name)
+        _worker_segments.append(segment)
+        shared = np.ndarray((2, length), dtype=np.float64, buffer=segment.buf)
+        _worker_prices[crypto_codename] = (shared[0], shared[1])
+
+
+def _evaluate(job: dict) -> dict:
+    algorithm_class = load_class("algorithms", job["codename"])
+    exchange_vars = job["exchange_vars"]
+    timestamps, prices = _worker_prices[exchange_vars["crypto_codename"]]
+    if algorithm_class.supports_vectorized:
+        result = algorithm_class.evaluate_vectorized(timestamps, prices, exchange_vars, job["algorithm_vars"])
+        wallet_crypto_amount = result["wallet_crypto_amount_final"]
+        wallet_fiat_amount = result["wallet_fiat_amount_final"]
+        trades = int(np.count_nonzero(result["action"]))
+    else:
+        replay = ReplayRun(algorithm_class, job["key"], exchange_vars, job["algorithm_vars"], timestamps, prices)
+        trades = sum(1 for action_report in replay if action_report.action != "hold")
+        wallet_crypto_amount = replay.exchange.get_crypto_wallet_amount()
+        wallet_fiat_amount = replay.exchange.get_fiat_wallet_amount()
+
+    first_price = float(prices[0])
+    last_price = float(prices[-1])
+    start_value = exchange_vars["wallet_fiat_amount"] + exchange_vars["wallet_crypto_amount"] * first_price
+    final_value = wallet_fiat_amount + wallet_crypto_amount * last_price
+    return {
+        "key": job["key"],
+        "codename": job["codename"],
+        "crypto_codename": exchange_vars["crypto_codename"],
+        "final_value": final_value,
+        "return_pct": (final_value / start_value - 1) * 100 if start_value else 0.0,
+        "buy_and_hold_pct": (last_price / first_price - 1) * 100,
+        "trades": trades,
+        "exchange_vars": exchange_vars,
+        "algorithm_vars": job["algorithm_vars"]
+    }
+
+
+def _write_ranked(results: List[dict], path: str):
+    ranked = sorted(results, key=lambda result: result["return_pct"], reverse=True)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(RANKED_COLUMNS)
+        for rank, result in enumerate(ranked, start=1):
+            writer.writerow([rank] + [json.dumps(result[column], sort_keys=True)
+                                      if isinstance(result[column], dict) else result[column]
+                                      for column in RANKED_COLUMNS[1:]])
+    os.replace(temporary_path, path)
+
+
+def run_sweep(spec_file: str, output_dir: str = SWEEP_OUTPUT_DIR, workers: int = None) -> List[dict]:
+    """
+    Runs every job of a sweep spec over replayed prices in a process pool. Each finished job is appended to
+    <output_dir>/results.jsonl immediately; jobs already in that file are skipped, so an interrupted sweep resumes
+    where it stopped. <output_dir>/ranked.csv holds all results ranked by return and is rewritten as results arrive.
+    :return: All results (including resumed ones)
+    """
+    with open(spec_file, "r") as f:
+        spec = yaml.safe_load(f)
+    jobs = expand_sweep(spec)
+
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, "results.jsonl")
+    ranked_path = os.path.join(output_dir, "ranked.csv")
+    results = []
+    if os.path.exists(results_path):
+        with open(results_path, "r") as f:
+            results = [json.loads(line) for line in f if line.endswith("\n")]
+    finished_keys = {result["key"] for result in results}
+    pending = [job for job in jobs if job["key"] not in finished_keys]
+    logger.info(f"Sweep has {len(jobs)} jobs, {len(jobs) - len(pending)} already finished, running {len(pending)}")
+
+    layout, segments = _share_prices(spec["prices"])
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_prices, initargs=(layout,)) as executor, \
+                open(results_path, "a") as results_file:
+            futures = [executor.submit(_evaluate, job) for job in pending]
+            last_rewrite = time.monotonic()
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                results.append(result)
+                results_file.write(json.dumps(result, sort_keys=True) + "\n")
+                results_file.flush()
+                if time.monotonic() - last_rewrite > RANKED_REWRITE_INTERVAL:
+                    _write_ranked(results, ranked_path)
+                    last_rewrite = time.monotonic()
+                    logger.info(f"Sweep progress: {done}/{len(pending)} jobs")
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    _write_ranked(results, ranked_path)
+    logger.info(f"Sweep finished, ranked results written to {ranked_path}")
+    return results
@@ -0,0 +1,122 @@
+from typing import Iterator
+
+import numpy as np
+
+from lib.history_store import ACTIONS, ACTION_RESULTS
+from lib.records import ActionRecord
+
+HOLD = ACTIONS.index("hold")
+BUY = ACTIONS.index("buy_crypto")
+SELL = ACTIONS.index("sell_crypto")
+SUCCESS = ACTION_RESULTS.index("success")
+
+_MIN_SEARCH_CHUNK = 1024
+_MAX_SEARCH_CHUNK = 1 << 20
+
+
+def threshold_kernel(timestamps: np.ndarray, prices: np.ndarray, exchange_fee: float, last_bought_price: float,
+                     last_sold_price: float, wallet_crypto_amount: float, wallet_fiat_amount: float) -> dict:
+    """
+    Evaluates a last-price threshold strategy over a whole price series: sell the entire crypto wallet once
+    price * (1 - 2 * fee) exceeds the last buy price, buy with the entire fiat wallet once price * (1 + 2 * fee) drops
+    below the last sell price, otherwise hold. Fills are computed like in the Simulator/Replay exchanges.
+
+    Only trades are evaluated one by one; the hold stretches between them are found with array scans, so the cost
+    grows with the number of trades instead of the number of ticks. All arithmetic is done in the same order as
+    SafeTrade.perform_action, so the results are bit-for-bit identical to a tick-by-tick replay.
+    :return: A dictionary with one array per action report field ("unix_timestamp", "action", "action_result",
+        "transacted_amount", "current_price", "wallet_crypto_amount", "wallet_fiat_amount") and the final
+        "last_bought_price", "last_sold_price", "wallet_crypto_amount_final" and "wallet_fiat_amount_final" values.
+        Actions and action results are encoded as indices into ACTIONS and ACTION_RESULTS, missing transacted amounts
+        as NaN.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    n = len(prices)
+    sell_prices = prices * (1 - exchange_fee * 2)
+    buy_prices = prices * (1 + exchange_fee * 2)
+
+    actions = np.full(n, HOLD, dtype=np.uint8)
+    action_results = np.zeros(n, dtype=np.uint8)
+    transacted_amounts = np.full(n, np.nan)
+    wallet_crypto = np.empty(n)
+    wallet_fiat = np.empty(n)
+
+    position = 0
+    while position < n:
+        event = _next_event(sell_prices, buy_prices, position, last_bought_price, last_sold_price,
+                            wallet_crypto_amount != 0, wallet_fiat_amount != 0)
+        wallet_crypto[position:event] = wallet_crypto_amount
+        wallet_fiat[position:event] = wallet_fiat_amount
+        if event == n:
+            break
+
+        current_price = float(prices[event])
+        if wallet_crypto_amount != 0 and float(sell_prices[event]) > last_bought_price:
+            wallet_fiat_amount = current_price * wallet_crypto_amount * (1 - exchange_fee)
+            wallet_crypto_amount = 0.0
+            last_sold_price = current_price
+            actions[event] = SELL
+            transacted_amounts[event] = wallet_fiat_amount
+        else:
+            wallet_crypto_amount = 1 / current_price * wallet_fiat_amount * (1 - exchange_fee)
+            wallet_fiat_amount = 0.0
+            last_bought_price = current_price
+            actions[event] = BUY
+            transacted_amounts[event] = wallet_crypto_amount
+        # simulated fills always match the expected amount
+        action_results[event] = SUCCESS
+        wallet_crypto[event] = wallet_crypto_amount
+        wallet_fiat[event] = wallet_fiat_amount
+        position = event + 1
+
+    return {
+        "unix_timestamp": np.asarray(timestamps, dtype=np.float64),
+        "action": actions,
+        "action_result": action_results,
+        "transacted_amount": transacted_amounts,
+        "current_price": prices,
+        "wallet_crypto_amount": wallet_crypto,
+        "wallet_fiat_amount": wallet_fiat,
+        "last_bought_price": last_bought_price,
+        "last_sold_price": last_sold_price,
+        "wallet_crypto_amount_final": wallet_crypto_amount,
+        "wallet_fiat_amount_final": wallet_fiat_amount
+    }
+
+
+def _next_event(sell_prices: np.ndarray, buy_prices: np.ndarray, start: int, last_bought_price: float,
+                last_sold_price: float, can_sell: bool, can_buy: bool) -> int:
+    """
+    Returns the index of the first tick at or after start that triggers a trade, or len(sell_prices) if none does.
+    Scans in growing chunks so that frequent trades do not pay for scanning the whole remaining series each time.
+    """
+    n = len(sell_prices)
+    if not can_sell and not can_buy:
+        return n
+    chunk = _MIN_SEARCH_CHUNK
+    while start < n:
+        end = min(n, start + chunk)
+        if can_sell and can_buy:
+            mask = (sell_prices[start:end] > last_bought_price) | (buy_prices[start:end] < last_sold_price)
+        elif can_sell:
+            mask = sell_prices[start:end] > last_bought_price
+        else:
+            mask = buy_prices[start:end] < last_sold_price
+        hit = int(mask.argmax())
+        if mask[hit]:
+            return start + hit
+        start = end
+        chunk = min(chunk * 2, _MAX_SEARCH_CHUNK)
+    return n
+
+
+def iter_action_records(result: dict, algo_id) -> Iterator[ActionRecord]:
+    """
+    Yields the action records of a threshold_kernel result, as replaying it tick by tick would have returned them.
+    """
+    columns = zip(result["unix_timestamp"].tolist(), result["action"].tolist(), result["action_result"].tolist(),
+                  result["transacted_amount"].tolist(), result["current_price"].tolist(),
+                  result["wallet_crypto_amount"].tolist(), result["wallet_fiat_amount"].tolist())
+    for unix_timestamp, action, action_result, transacted_amount, current_price, crypto, fiat in columns:
+        yield ActionRecord(ACTIONS[action], ACTION_RESULTS[action_result], None if action == HOLD else transacted_amount,
+                           fiat, crypto, current_price, unix_timestamp, algo_id)
@@ -1,37 +1,623 @@
 #!/usr/bin/python3
 
 import argparse
-import importlib
-import re as regex
+import json
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-from lib.graph_generator import generate_graph
+# Modules only needed by single commands or engines (matplotlib, numpy, asyncio) are imported where
+# they are used, so the trading loop starts without them.
+from lib.candles import configure_candles, get_candle_aggregator, CANDLE_DIR, \
+    DEFAULT_CAPACITY as DEFAULT_CANDLE_CAPACITY, DEFAULT_TIMEFRAMES as DEFAULT_CANDLE_TIMEFRAMES
+from lib.exchange_interface import prefetch_prices
+from lib.http_client import configure_http_client, DEFAULT_TIMEOUT as DEFAULT_HTTP_TIMEOUT, \
+    DEFAULT_RETRIES as DEFAULT_HTTP_RETRIES
+from lib.history_store import configure_history, get_history_backend, migrate_legacy_history, \
+    DEFAULT_SEGMENT_SIZE, HISTORY_DIR, LEGACY_HISTORY_FILE, BACKENDS as HISTORY_BACKENDS
 from lib.logger import *
+from lib.metrics import metrics, start_metrics_server, timed_from_queue
+from lib.plugins import load_class, module_name
+from lib.quote_cache import configure_quote_cache, quote_cache, DEFAULT_TTL
+from lib.records import JobState
+from lib.scheduler import TickScheduler
+from lib.sharding import ShardCoordinator, apply_prices, clear_layout, history_backends, open_history_reader, \
+    partition_settings, read_merged_state, shard_root, write_layout
+from lib.state_store import configure_state_store, get_state_store, DEFAULT_COMPACT_INTERVAL
+
+
+def resolve_jobs(settings: dict, cached_vars: dict) -> list:
+    """
+    Loads the classes of all configured jobs and picks their variables from the cached state or settings.
+    :return: A list of (algorithm_class, exchange_class, id, algorithm_vars, exchange_vars) tuples
+    """
+    # index the cached state once instead of scanning it for every algorithm
+    cached_entries = {(exchange_name, entry["id"]): entry
+                      for exchange_name, exchange in (cached_vars.get("exchanges", {}) or {}).items()
+                      for entry in exchange.get("algorithms", [])}
+
+    job_arguments = []
+    for exchange in settings["exchanges"]:
+        logger.info(f"Initializing exchange: {exchange}")
+
+        # Import the exchange class
+        exchange_class = load_class("exchanges", exchange)
+        initialized_ids = set()
+        for algorithm in settings["exchanges"][exchange]["algorithms"]:
+            algorithm_name = algorithm["codename"]
+            logger.debug(f"Initializing {algorithm_name} on {exchange}")
+            if algorithm["id"] in initialized_ids:
+                logger.error(
+                    f"Duplicate algorithm id found for {algorithm_name} on {exchange}. Duplicate id: {algorithm["id"]}")
+                logger.error("Duplicate ids can lead to data loss and unexpected behavior.")
+                logger.critical("Exiting...")
+                exit(1)
+            initialized_ids.add(algorithm["id"])
+            # Import the algorithm class
+            algorithm_class = load_class("algorithms", algorithm_name)
+
+            # use cached values if they exist, otherwise use values from settings
+            cached_entry = cached_entries.get((exchange, algorithm["id"]), {})
+            algorithm_vars = cached_entry.get("algorithm_vars", None)
+            exchange_vars = cached_entry.get("exchange_vars", None)
+            if algorithm_vars is None or algorithm_vars == {}:
+                algorithm_vars = algorithm.get("algorithm_vars", None)
+            if exchange_vars is None or exchange_vars == {}:
+                exchange_vars = algorithm.get("exchange_vars", None)
+            job_arguments.append((algorithm_class, exchange_class, algorithm["id"], algorithm_vars, exchange_vars))
+    return job_arguments
+
+
+def initialize_jobs(settings: dict, cached_vars: dict) -> list:
+    job_arguments = resolve_jobs(settings, cached_vars)
+    # Create a separate object for each enabled exchange for this algorithm. Constructors may block on the exchange,
+    # so all jobs are created concurrently.
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(
+            lambda arguments: arguments[0](arguments[1](arguments[4]), arguments[2], arguments[3]), job_arguments))
+
+
+# jobs whose action outlived the job_timeout of its tick -> the future of that action
+unfinished_jobs = {}
+
+
+def persist_results(completed: list):
+    """
+    Logs the action reports of one tick and stores the state of every job.
+    :param completed: A list of (algorithm, action_report) tuples
+    """
+    state_store = get_state_store()
+    for algorithm, action_report in completed:
+        log_action(action_report, algorithm.exchange.codename, algorithm.codename)
+        state_store.update(algorithm.exchange.codename, JobState.of(algorithm))
+
+    # store history and the variables of jobs that changed
+    flush_history()
+    state_store.commit()
+    get_candle_aggregator().commit()
+
+    for symbol, counters in quote_cache.stats().items():
+        logger.debug(f"Quote cache {symbol}: {counters['hits']} hits, {counters['misses']} misses")
+    quote_cache.reset_stats()
+
+
+def run_backtests(settings: dict, price_file: str, output_dir: str, vectorized: bool, verify_vectorized: bool):
+    from lib.backtest import run_backtest, verify_vectorized_parity
+    from lib.price_series import load_price_series
+
+    logger.info(f"Loading prices from {price_file}")
+    timestamps, prices = load_price_series(price_file)
+    history_backend = HISTORY_BACKENDS[(settings.get("general_settings", {}) or {}).get("history_backend", "jsonl")](
+        output_dir)
+    logger.info(f"Replaying {len(prices)} prices, writing history to {output_dir}")
+    for exchange in settings["exchanges"]:
+        for algorithm in settings["exchanges"][exchange]["algorithms"]:
+            algorithm_class = load_class("algorithms", algorithm["codename"])
+            if verify_vectorized and algorithm_class.supports_vectorized:
+                mismatches = verify_vectorized_parity(algorithm_class, algorithm["id"],
+                                                      algorithm.get("exchange_vars", None),
+                                                      algorithm.get("algorithm_vars", None), timestamps, prices)
+                if mismatches:
+                    logger.critical(f"Vectorized evaluation of {algorithm['codename']} {algorithm['id']} differs "
+                                    f"from the tick-by-tick replay in {mismatches} ticks. Exiting...")
+                    sys.exit(1)
+                logger.info(f"Vectorized evaluation of {algorithm['codename']} {algorithm['id']} matches the "
+                            f"tick-by-tick replay")
+            summary = run_backtest(algorithm_class, algorithm["id"],
+                                   algorithm.get("exchange_vars", None), algorithm.get("algorithm_vars", None),
+                                   timestamps, prices, history_backend, vectorized)
+            logger.info(f"Backtested {summary['codename']} {summary['id']} ({exchange} settings): "
+                        f"{summary['ticks']} ticks in {summary['seconds']:.2f}s, "
+                        f"final wallets: {summary['exchange_vars']['wallet_fiat_amount']} fiat, "
+                        f"{summary['exchange_vars']['wallet_crypto_amount']} crypto")
+    history_backend.close()
+
+
+def sync_market_data(settings: dict, days: float, interval: str):
+    from lib.market_data import get_market_data_store
+
+    store = get_market_data_store()
+    symbols = sorted({(algorithm.get("exchange_vars") or {}).get("crypto_codename")
+                      for exchange in settings["exchanges"].values() for algorithm in exchange["algorithms"]} - {None})
+    end = time.time()
+    start = end - days * 86400
+    for symbol in symbols:
+        try:
+            store.sync(symbol, start, end, interval)
+        except Exception as e:
+            logger.error(f"Syncing market data of {symbol} failed: {e!r}")
+            continue
+        gaps = store.gaps(symbol, start, end, interval)
+        if gaps:
+            missing_hours = sum(gap_end - gap_start for gap_start, gap_end in gaps) / 3600
+            longest_gap = max(gaps, key=lambda gap: gap[1] - gap[0])
+            logger.info(f"{symbol}: {len(gaps)} gaps, {missing_hours:.1f}h without bars, the longest from "
+                        f"{time.ctime(longest_gap[0])} to {time.ctime(longest_gap[1])}")
+
+
+def history_compactor(general_settings: dict):
+    """
+    :return: A HistoryCompactor for the history_retention setting or None if no retention is configured
+    """
+    retention = general_settings.get("history_retention", None)
+    if not retention:
+        return None
+    from lib.history_retention import HistoryCompactor, parse_retention
+
+    return HistoryCompactor(parse_retention(retention))
+
+
+def prefetch_job_prices(jobs: list):
+    # one batch price request per exchange class instead of one request per symbol
+    try:
+        prefetch_prices(algorithm.exchange for algorithm in jobs)
+    except Exception as e:
+        # jobs fall back to fetching their own price
+        logger.error(f"Prefetching prices failed: {e!r}")
+
+
+def perform_timed_action(algorithm, starts: dict, submitted: float):
+    """
+    Runs the action of algorithm in a worker thread and records when it started, so that job_timeout is measured from
+    the start of the action instead of its submission.
+    :param starts: algorithm -> time.perf_counter() at the start of its action
+    """
+    starts[algorithm] = time.perf_counter()
+    return timed_from_queue(algorithm.perform_action, submitted)
+
+
+def run_tick(executor: ThreadPoolExecutor, jobs: list, prefetch: bool = True, job_timeout: float = None) -> list:
+    """
+    Performs the actions of all jobs concurrently. A job that fails is left out of the results, a job whose action is
+    still running job_timeout seconds after it started is left out too and not started again until its action
+    finished; its result is returned by the tick after that. Actions that have not started while no other action
+    started or finished for job_timeout seconds (all workers busy with timed out actions) are cancelled and submitted
+    again next tick.
+    :return: A list of (algorithm, action_report) tuples
+    """
+    if prefetch:
+        prefetch_job_prices(jobs)
+    futures = {}
+    for algorithm in jobs:
+        future = unfinished_jobs.get(algorithm)
+        if future is not None:
+            if not future.done():
+                logger.warning(f"{algorithm.codename} {algorithm.id_in_list}: previous action still running, "
+                               f"skipping this tick")
+                continue
+            del unfinished_jobs[algorithm]
+            futures[future] = algorithm
+    # Execute all algorithms at the same time
+    starts = {}
+    futures.update({executor.submit(perform_timed_action, algorithm, starts, time.perf_counter()): algorithm
+                    for algorithm in jobs if algorithm not in unfinished_jobs})
+
+    completed = []
+    pending = set(futures)
+    progress = time.perf_counter()
+    while pending:
+        timeout = None
+        if job_timeout is not None:
+            deadlines = [starts[futures[future]] + job_timeout for future in pending if futures[future] in starts]
+            timeout = max(0.0, min(deadlines + [progress + job_timeout]) - time.perf_counter())
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            algorithm = futures[future]
+            try:
+                completed.append((algorithm, future.result()))
+            except Exception as e:
+                metrics.increment("job_failures_total", job=f"{algorithm.codename}:{algorithm.id_in_list}")
+                logger.error(f"{algorithm.codename} {algorithm.id_in_list}: action failed: {e!r}")
+        if job_timeout is None:
+            continue
+        now = time.perf_counter()
+        started = {future: starts[futures[future]] for future in pending if futures[future] in starts}
+        if done:
+            progress = now
+        progress = max([progress] + list(started.values()))
+        for future, start in started.items():
+            if now - start >= job_timeout:
+                algorithm = futures[future]
+                pending.discard(future)
+                unfinished_jobs[algorithm] = future
+                metrics.increment("job_timeouts_total", job=f"{algorithm.codename}:{algorithm.id_in_list}")
+                logger.error(f"{algorithm.codename} {algorithm.id_in_list}: action timed out after {job_timeout}s")
+        if now - progress >= job_timeout:
+            for future in list(pending):
+                # cancel() fails if the action started in the meantime
+                if futures[future] not in starts and future.cancel():
+                    algorithm = futures[future]
+                    pending.discard(future)
+                    metrics.increment("job_deferrals_total", job=f"{algorithm.codename}:{algorithm.id_in_list}")
+                    logger.warning(f"{algorithm.codename} {algorithm.id_in_list}: no free worker for {job_timeout}s, "
+                                   f"retrying next tick")
+    return completed
+
+
+def run_threaded(jobs: list, action_interval: float, job_timeout: float = None):
+    scheduler = TickScheduler(action_interval)
+    with ThreadPoolExecutor() as executor:
+        while True:
+            logger.info(f"Performing actions...")
+            tick_start = time.perf_counter()
+            persist_results(run_tick(executor, jobs, job_timeout=job_timeout))
+            metrics.observe("tick_seconds", time.perf_counter() - tick_start)
+            logger.info(f"Tick metrics: {metrics.tick_summary()}")
+
+            wait_time = scheduler.time_until_next_tick()
+            logger.info(f"Sleeping until next action ({wait_time:.2f}s)")
+            time.sleep(wait_time)
+
+
+def configure_process(general_settings: dict, history_root: str = HISTORY_DIR, candle_root: str = CANDLE_DIR):
+    """
+    Applies the settings that configure the shared services of a process (history, quote cache, candles, http client).
+    """
+    configure_history(general_settings.get("history_backend", "jsonl"),
+                      int(general_settings.get("history_segment_size", DEFAULT_SEGMENT_SIZE)), history_root)
+    configure_quote_cache(float(general_settings.get("quote_cache_ttl", DEFAULT_TTL)))
+    configure_candles(general_settings.get("candle_timeframes", DEFAULT_CANDLE_TIMEFRAMES),
+                      int(general_settings.get("candle_capacity", DEFAULT_CANDLE_CAPACITY)), candle_root)
+    configure_http_client(float(general_settings.get("http_timeout", DEFAULT_HTTP_TIMEOUT)),
+                          int(general_settings.get("http_retries", DEFAULT_HTTP_RETRIES)))
+    yahoo_base_url = general_settings.get("yahoo_base_url", None)
+    if yahoo_base_url is not None:
+        # e.g. the mock server of --mock-server
+        load_class("exchanges", "Simulator").base_url = yahoo_base_url.rstrip("/")
+
+
+def run_shard(index: int, partition: dict, connection, cached_vars: dict):
+    """
+    Entry point of a shard process of the sharded engine, see ShardCoordinator.
+    """
+    try:
+        general_settings = partition.get("general_settings", {}) or {}
+        json_log_file = general_settings.get("log_json_file", None)
+        if json_log_file is not None:
+            json_log_file = "{0}-shard-{2}{1}".format(*os.path.splitext(json_log_file), index)
+        configure_logging(int(general_settings.get("log_max_bytes", DEFAULT_LOG_MAX_BYTES)),
+                          int(general_settings.get("log_backup_count", DEFAULT_LOG_BACKUP_COUNT)),
+                          json_log_file, f"shard-{index}.log")
+        configure_process(general_settings, os.path.join(shard_root(index), "history"),
+                          os.path.join(shard_root(index), "candles"))
+        state_store = configure_state_store(
+            int(general_settings.get("state_compact_interval", DEFAULT_COMPACT_INTERVAL)), shard_root(index))
+        state_store.load()
+        jobs = initialize_jobs(partition, cached_vars)
+        # take over the state of jobs that were moved here from another shard
+        state_store.prune({(job.exchange.codename, job.id_in_list) for job in jobs})
+        for job in jobs:
+            state_store.update(job.exchange.codename, JobState.of(job))
+        state_store.commit()
+        metrics.enabled = True
+    except BaseException as e:
+        connection.send(("error", repr(e)))
+        return
+
+    connection.send(("ready", len(jobs)))
+    job_timeout = float(general_settings.get("job_timeout", float(general_settings.get("action_interval", 60)) / 2))
+    with ThreadPoolExecutor() as executor:
+        while True:
+            message, prices = connection.recv()
+            if message == "stop":
+                break
+            apply_prices(prices)
+            completed = run_tick(executor, jobs, prefetch=False, job_timeout=job_timeout)
+            persist_results(completed)
+            logger.debug(f"Shard {index} tick metrics: {metrics.tick_summary()}")
+            connection.send(("done", len(completed)))
+    get_history_backend().close()
+
+
+def start_shards(settings: dict, cached_vars: dict, action_interval: float) -> ShardCoordinator:
+    general_settings = settings.get("general_settings", {}) or {}
+    partitions = partition_settings(settings, int(general_settings.get("shards", os.cpu_count())),
+                                    general_settings.get("shard_by", "id"))
+    price_fetchers = {}
+    for _, exchange_class, _, _, exchange_vars in resolve_jobs(settings, cached_vars):
+        if exchange_class.shared_quotes and exchange_vars:
+            price_fetchers.setdefault(exchange_class, set()).add(exchange_vars["crypto_codename"])
+    cached_entries = {(exchange_name, entry["id"]): entry
+                      for exchange_name, exchange in (cached_vars.get("exchanges", {}) or {}).items()
+                      for entry in exchange.get("algorithms", [])}
+    shard_arguments = []
+    for partition in partitions:
+        # only send every shard the cached state of its own jobs
+        shard_state = {"exchanges": {}}
+        for exchange_name, exchange in partition["exchanges"].items():
+            shard_state["exchanges"][exchange_name] = {"algorithms": [
+                cached_entries[(exchange_name, algorithm["id"])] for algorithm in exchange["algorithms"]
+                if (exchange_name, algorithm["id"]) in cached_entries]}
+        shard_arguments.append((shard_state,))
+
+    write_layout(partitions)
+    coordinator = ShardCoordinator(partitions, run_shard, shard_arguments, action_interval, price_fetchers)
+    coordinator.start()
+    return coordinator
+
+
+def run_streaming(jobs: list, general_settings: dict):
+    from lib.streaming import PriceBus, ReplayFeed, PollingFeed, StreamingEngine, DEFAULT_DEBOUNCE, \
+        DEFAULT_POLL_INTERVAL
+
+    bus = PriceBus()
+    price_files = general_settings.get("stream_price_files", None)
+    if price_files:
+        logger.info(f"Streaming replayed prices of {', '.join(price_files)}")
+        feed = ReplayFeed(bus, price_files, float(general_settings.get("stream_replay_speed", 1.0)))
+    else:
+        symbols_by_class = {}
+        for algorithm in jobs:
+            if algorithm.exchange.shared_quotes:
+                symbols_by_class.setdefault(type(algorithm.exchange), set()).add(algorithm.exchange.crypto_codename)
+        feed = PollingFeed(bus, symbols_by_class,
+                           float(general_settings.get("stream_poll_interval", DEFAULT_POLL_INTERVAL)))
+    for algorithm in jobs:
+        if not algorithm.exchange.shared_quotes:
+            logger.warning(f"{algorithm.codename} {algorithm.id_in_list}: {algorithm.exchange.codename} does not read "
+                           f"prices from the stream, its actions are only triggered by it")
+    engine = StreamingEngine(jobs, bus, float(general_settings.get("stream_debounce", DEFAULT_DEBOUNCE)),
+                             persist_results)
+    feed.start()
+    engine.run_forever()
+
 
 if __name__ == '__main__':
     logger.info("Starting script")
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--generate-graph", action="store_true",
-                        help="Generate graphs using cache/history.json and exit.")
+                        help="Generate the graph of one interactively chosen job using the stored history and exit.")
+    parser.add_argument("--graphs", nargs="*", metavar="SELECTOR",
+                        help="Render the price and equity graphs of every job matching EXCHANGE[/ALGORITHM[/ID]] "
+                             "(shell-style wildcards, default: all jobs) without prompting and exit.")
+    parser.add_argument("--graph-output", metavar="DIR",
+                        help="Output directory for --graphs (default: cache/graphs).")
+    parser.add_argument("--graph-format", choices=("auto", "png", "svg"), default="auto",
+                        help="Image format of graphs, auto uses PNG for long histories (default: auto).")
+    parser.add_argument("--graph-points", type=int, default=2000,
+                        help="Points per graph line after downsampling (default: 2000).")
+    parser.add_argument("--report", nargs="*", metavar="SELECTOR",
+                        help="Compute PnL, fees, trades, win rate, drawdown, Sharpe/Sortino and buy-and-hold "
+                             "comparison of every job matching EXCHANGE[/ALGORITHM[/ID]] from the stored history, "
+                             "write them to --report-output and exit (default: all jobs).")
+    parser.add_argument("--report-output", metavar="FILE",
+                        help="Output file of --report, .json or .csv (default: cache/report.json).")
+    parser.add_argument("--migrate-history", action="store_true",
+                        help="Import cache/history.json into the configured history backend and exit.")
+    parser.add_argument("--compact-history", action="store_true",
+                        help="Roll up the history older than the history_retention tiers once and exit.")
+    parser.add_argument("--backtest", metavar="PRICE_FILE",
+                        help="Replay a .csv/.npy/.npz/.parquet price file through every configured algorithm and exit.")
+    parser.add_argument("--backtest-output", metavar="DIR",
+                        help="History directory for --backtest results (default: cache/backtest/history).")
+    parser.add_argument("--sweep", metavar="SPEC_FILE",
+                        help="Run a parameter sweep described by a yaml spec over replayed prices and exit.")
+    parser.add_argument("--sweep-output", metavar="DIR",
+                        help="Output directory for --sweep results (default: cache/sweep).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes for --sweep and --graphs (default: number of CPUs).")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="Use the bulk array evaluation of algorithms that support it for --backtest.")
+    parser.add_argument("--verify-vectorized", action="store_true",
+                        help="Check that the bulk array evaluation matches the tick-by-tick replay before --backtest.")
+    parser.add_argument("--sync-market-data", nargs="?", type=float, const=7.0, metavar="DAYS",
+                        help="Download the missing market data bars of the last DAYS days of every configured crypto "
+                             "into cache/market_data and exit (default: 7).")
+    parser.add_argument("--benchmark", metavar="OUTPUT_FILE", nargs="?", const="cache/benchmark.json",
+                        help="Benchmark the tick loop, persistence, history loading and startup with a network-free "
+                             "stub exchange, write the results as json and exit (default: cache/benchmark.json).")
+    parser.add_argument("--benchmark-baseline", metavar="FILE",
+                        help="Compare --benchmark results with an earlier results file and exit with an error if a "
+                             "benchmark regressed.")
+    parser.add_argument("--load-test", metavar="OUTPUT_FILE", nargs="?", const="cache/load_test.json",
+                        help="Run the tick loop with many Simulator jobs against a local mock yahoo server, write "
+                             "tick duration percentiles, overruns and failures as json and exit "
+                             "(default: cache/load_test.json).")
+    parser.add_argument("--load-test-jobs", type=int, default=500,
+                        help="Number of jobs of --load-test (default: 500).")
+    parser.add_argument("--load-test-symbols", type=int, default=20,
+                        help="Number of cryptos the --load-test jobs are spread over (default: 20).")
+    parser.add_argument("--load-test-ticks", type=int, default=20,
+                        help="Number of ticks of --load-test (default: 20).")
+    parser.add_argument("--load-test-interval", type=float, default=2.0,
+                        help="Seconds between the ticks of --load-test (default: 2.0).")
+    parser.add_argument("--mock-server", nargs="?", type=int, const=8765, metavar="PORT",
+                        help="Serve scripted prices with the yahoo API on 127.0.0.1:PORT until interrupted, for "
+                             "yahoo_base_url (default: 8765).")
+    parser.add_argument("--mock-price-path", default="sine",
+                        help="Prices of the mock server: constant, sine, random_walk, crash or a price file "
+                             "(default: sine).")
+    parser.add_argument("--mock-latency", type=float, default=0.0,
+                        help="Seconds the mock server delays every response (default: 0).")
+    parser.add_argument("--mock-error-rate", type=float, default=0.0,
+                        help="Fraction of mock server requests that fail with HTTP 503 (default: 0).")
+    parser.add_argument("--mock-timeout-rate", type=float, default=0.0,
+                        help="Fraction of mock server requests that hang for 30 seconds (default: 0).")
+    parser.add_argument("--profile-imports", nargs="?", type=int, const=25, metavar="COUNT",
+                        help="Print the COUNT slowest imports of starting the trading loop with the configured "
+                             "algorithms and exchanges and exit (default: 25).")
+    parser.add_argument("--benchmark-repeat", type=int, default=5,
+                        help="Number of measurements per benchmark (default: 5).")
 
     args = parser.parse_args()
 
+    startup_start = time.perf_counter()
+    logger.info("Reading settings")
+    settings = read_settings()
+    settings_seconds = time.perf_counter() - startup_start
+    general_settings = settings.get("general_settings", {}) or {}
+    configure_logging(int(general_settings.get("log_max_bytes", DEFAULT_LOG_MAX_BYTES)),
+                      int(general_settings.get("log_backup_count", DEFAULT_LOG_BACKUP_COUNT)),
+                      general_settings.get("log_json_file", None))
+
+    if args.profile_imports:
+        from lib.import_profile import profile_imports
+
+        plugin_modules = {module_name("exchanges", exchange) for exchange in settings["exchanges"]} | {
+            module_name("algorithms", algorithm["codename"]) for exchange in settings["exchanges"].values()
+            for algorithm in exchange["algorithms"]}
+        timings = profile_imports(["main"] + sorted(plugin_modules))
+        for cumulative, own, name in timings[:args.profile_imports]:
+            logger.info(f"{cumulative / 1000:8.1f}ms cumulative {own / 1000:8.1f}ms self  {name}")
+        logger.info(f"Importing took {sum(own for _, own, _ in timings) / 1000:.1f}ms in total. Exiting...")
+        exit()
+
+    configure_process(general_settings)
+    history_backend = get_history_backend()
+    compactor = history_compactor(general_settings)
+    if args.migrate_history:
+        if not os.path.exists(LEGACY_HISTORY_FILE):
+            logger.error(f"{LEGACY_HISTORY_FILE} not found, nothing to migrate")
+            sys.exit(1)
+        logger.info(f"Migrating {LEGACY_HISTORY_FILE} into {history_backend.root}")
+        migrated_records = migrate_legacy_history(history_backend)
+        logger.info(f"Migrated {migrated_records} records. Exiting...")
+        exit()
+    if args.compact_history:
+        if compactor is None:
+            logger.error("history_retention is not set, nothing to compact")
+            sys.exit(1)
+        totals = compactor.compact(history_backends(history_backend))
+        logger.info(f"Rolled up {totals['sources']} history files: {totals['records']} records replaced by "
+                    f"{totals['kept_records']}, {totals['freed_bytes'] / 1024 / 1024:.1f}MB freed. Exiting...")
+        exit()
+    if os.path.exists(LEGACY_HISTORY_FILE):
+        logger.warning(f"Found legacy {LEGACY_HISTORY_FILE}. Run with --migrate-history to import it.")
+
     if args.generate_graph:
         # read algo name and exchange name from cli
         exchange_name = input("Enter exchange name: ")
         algorithm_name = input("Enter algorithm name: ")
         algo_id = input("Enter algorithm id (check settings.yaml): ")
         logger.info(f"Generating graphs for {algorithm_name} on {exchange_name}")
-        generate_graph(algorithm_name, exchange_name, algo_id)
+        from lib.graph_generator import generate_graph
+
+        generate_graph(algorithm_name, exchange_name, algo_id, open_history_reader(history_backend),
+                       image_format=args.graph_format, max_points=args.graph_points)
         logger.info("Graphs generated. Exiting...")
         exit()
 
-    logger.info("Reading settings")
-    settings = read_settings()
+    if args.graphs is not None:
+        from lib.graph_generator import generate_graphs, GRAPH_OUTPUT_DIR
+
+        graph_paths = generate_graphs(history_backend, args.graphs, args.graph_output or GRAPH_OUTPUT_DIR,
+                                      args.workers, args.graph_format, args.graph_points)
+        logger.info(f"Rendered {len(graph_paths)} graphs. Exiting...")
+        exit()
+
+    if args.report is not None:
+        from lib.report import build_report, write_report as write_performance_report, REPORT_OUTPUT_FILE
+
+        report_rows = build_report(open_history_reader(history_backend), args.report)
+        for row in report_rows:
+            logger.info(f"{row['algorithm']} {row['id']} on {row['exchange']}: {row['return_pct']:+.2f}% "
+                        f"(buy and hold {row['buy_and_hold_pct']:+.2f}%), {row['trades']} trades, "
+                        f"max drawdown {row['max_drawdown_pct']:.2f}%")
+        write_performance_report(report_rows, args.report_output or REPORT_OUTPUT_FILE)
+        exit()
+
+    if args.sync_market_data is not None:
+        from lib.market_data import DEFAULT_INTERVAL as DEFAULT_MARKET_DATA_INTERVAL
+
+        sync_market_data(settings, args.sync_market_data,
+                         general_settings.get("market_data_interval", DEFAULT_MARKET_DATA_INTERVAL))
+        logger.info("Market data synced. Exiting...")
+        exit()
+
+    if args.benchmark:
+        from lib.benchmark import run_benchmarks, compare_with_baseline, write_report
+
+        report = run_benchmarks(run_tick, persist_results, general_settings.get("history_backend", "jsonl"),
+                                args.benchmark_repeat)
+        write_report(report, args.benchmark)
+        for name, result in report["results"].items():
+            logger.info(f"{name}: median {result['median'] * 1000:.2f}ms, min {result['min'] * 1000:.2f}ms")
+        logger.info(f"Benchmark results written to {args.benchmark}")
+        if args.benchmark_baseline:
+            with open(args.benchmark_baseline, "r") as f:
+                comparison = compare_with_baseline(report, json.load(f))
+            for name, change in comparison.items():
+                log = logger.error if change["regression"] else logger.info
+                log(f"{name}: {change['ratio']:.2f}x baseline ({change['baseline'] * 1000:.2f}ms -> "
+                    f"{change['median'] * 1000:.2f}ms)")
+            if any(change["regression"] for change in comparison.values()):
+                logger.critical("Benchmarks regressed against the baseline. Exiting...")
+                sys.exit(1)
+        exit()
+
+    if args.mock_server is not None or args.load_test:
+        from lib.mock_exchange import FaultProfile, PricePath
 
-    action_interval = (settings.get("general_settings", {}) or {}).get("action_interval", None)
+        mock_price_path = PricePath(args.mock_price_path)
+        mock_faults = FaultProfile(args.mock_latency, error_rate=args.mock_error_rate,
+                                   timeout_rate=args.mock_timeout_rate)
+    if args.mock_server is not None:
+        from lib.mock_exchange import MockYahooServer
+
+        mock_server = MockYahooServer(mock_price_path, mock_faults, port=args.mock_server).start()
+        logger.info(f"Serving {args.mock_price_path} prices at {mock_server.url}, set yahoo_base_url to use them. "
+                    f"Stop with Ctrl+C")
+        try:
+            while True:
+                time.sleep(60)
+                logger.info(f"Mock server: {mock_server.stats}")
+        except KeyboardInterrupt:
+            mock_server.stop()
+        exit()
+
+    if args.load_test:
+        from lib.load_test import run_load_test, write_report as write_load_test_report
+
+        load_test_report = run_load_test(run_tick, persist_results, args.load_test_jobs, args.load_test_symbols,
+                                         args.load_test_ticks, args.load_test_interval,
+                                         float(general_settings["job_timeout"]) if "job_timeout" in general_settings
+                                         else None, mock_price_path, mock_faults,
+                                         general_settings.get("history_backend", "jsonl"))
+        write_load_test_report(load_test_report, args.load_test)
+        tick_seconds = load_test_report["tick_seconds"]
+        logger.info(f"Tick duration: p50 {tick_seconds['p50']:.3f}s, p90 {tick_seconds['p90']:.3f}s, "
+                    f"p99 {tick_seconds['p99']:.3f}s, max {tick_seconds['max']:.3f}s; "
+                    f"{load_test_report['overruns']} overruns, {load_test_report['failed_jobs']} failed and "
+                    f"{load_test_report['timed_out_jobs']} timed out actions, "
+                    f"{load_test_report['http_retries']} retries, server: {load_test_report['server']}")
+        logger.info(f"Load test results written to {args.load_test}")
+        exit()
+
+    if args.sweep:
+        from lib.sweep import run_sweep, SWEEP_OUTPUT_DIR
+
+        run_sweep(args.sweep, args.sweep_output or SWEEP_OUTPUT_DIR, args.workers)
+        exit()
+
+    if args.backtest:
+        from lib.backtest import BACKTEST_HISTORY_DIR
+
+        run_backtests(settings, args.backtest, args.backtest_output or BACKTEST_HISTORY_DIR, args.vectorized,
+                      args.verify_vectorized)
+        logger.info("Backtests finished. Exiting...")
+        exit()
+
+    action_interval = general_settings.get("action_interval", None)
     if action_interval is None:
         logger.warning("action_interval not set, using 60 seconds as default")
         action_interval = 60
@@ -39,96 +625,62 @@ if __name__ == '__main__':
         logger.info(f"action_interval set to {action_interval} seconds")
 
     logger.info("Reading cached variables")
-    cached_vars = read_state()
+    phase_start = time.perf_counter()
+    configure_state_store(int(general_settings.get("state_compact_interval", DEFAULT_COMPACT_INTERVAL)))
+    # the newest state of jobs that ran sharded last time is in the shard directories
+    cached_vars = read_merged_state(read_state())
+    state_seconds = time.perf_counter() - phase_start
 
+    engine = general_settings.get("engine", "threaded")
     logger.info("Initiating algorithms")
-    jobs = []
-    for exchange in settings["exchanges"]:
-        logger.info(f"Initializing exchange: {exchange}")
+    phase_start = time.perf_counter()
+    if engine == "sharded":
+        coordinator = start_shards(settings, cached_vars, action_interval)
+        jobs = []
+    else:
+        jobs = initialize_jobs(settings, cached_vars)
+        state_store = get_state_store()
+        # take over the state of jobs that ran sharded last time, so the layout pointing to it can be removed
+        for exchange_name, exchange in (cached_vars.get("exchanges", {}) or {}).items():
+            for entry in exchange.get("algorithms", []):
+                state_store.update(exchange_name, JobState.from_dict(entry))
+        # prune writes a snapshot of the remaining jobs, after it the merged state is in the unsharded store
+        state_store.prune({(job.exchange.codename, job.id_in_list) for job in jobs})
+        clear_layout()
+    jobs_seconds = time.perf_counter() - phase_start
+    logger.info(f"Startup took {time.perf_counter() - startup_start:.3f}s: settings {settings_seconds:.3f}s, "
+                f"state {state_seconds:.3f}s, jobs {jobs_seconds:.3f}s")
 
-        # load the cached values for this algorithm
-        if exchange not in cached_vars:
-            cached_vars[exchange] = {}
+    metrics.enabled = True
+    metrics_port = general_settings.get("metrics_port", None)
+    if metrics_port is not None:
+        start_metrics_server(int(metrics_port))
+        logger.info(f"Serving metrics at http://127.0.0.1:{metrics_port}/metrics")
 
-        # Import the exchange class
-        exchange_module = importlib.import_module(
-            f"exchanges.{regex.sub(r'([a-z])([A-Z])', r'\1_\2', exchange).lower()}")
-        exchange_class = getattr(exchange_module, exchange)
-        initialized_ids = []
-        for algorithm in settings["exchanges"][exchange]["algorithms"]:
-            algorithm_name = algorithm["codename"]
-            logger.info(f"Initializing {algorithm_name} on {exchange}")
-            # Import the algorithm class
-            algo_module = importlib.import_module(
-                f"algorithms.{regex.sub(r'([a-z])([A-Z])', r'\1_\2', algorithm_name).lower()}")
-            algorithm_class = getattr(algo_module, algorithm_name)
+    if compactor is not None:
+        from lib.history_retention import start_history_compactor, DEFAULT_COMPACT_INTERVAL as \
+            DEFAULT_HISTORY_COMPACT_INTERVAL
 
-            # use cached values if they exist, otherwise use values from settings
-            algorithm_vars = None
-            exchange_vars = None
-            if cached_vars.get("exchanges", {}).get(exchange, {}) != {}:
-                if initialized_ids.__contains__(algorithm["id"]):
-                    logger.error(
-                        f"Duplicate algorithm id found for {algorithm_name} on {exchange}. Duplicate id: {algorithm["id"]}")
-                    logger.error("Duplicate ids can lead to data loss and unexpected behavior.")
-                    logger.critical("Exiting...")
-                    exit(1)
-                initialized_ids.append(algorithm["id"])
-                exchange_vars = next(
-                    (entry for entry in cached_vars["exchanges"][exchange]["algorithms"] if
-                     entry["id"] == algorithm["id"]),
-                    {}).get("exchange_vars", None)
-                algorithm_vars = next(
-                    (entry for entry in cached_vars["exchanges"][exchange]["algorithms"] if
-                     entry["id"] == algorithm["id"]),
-                    {}).get("algorithm_vars", None)
-            if algorithm_vars is None or algorithm_vars == {}:
-                algorithm_vars = algorithm.get("algorithm_vars", None)
-            if exchange_vars is None or exchange_vars == {}:
-                exchange_vars = algorithm.get("exchange_vars", None)
+        # the history of every shard is compacted from here, shards only append
+        start_history_compactor(compactor, history_backends(history_backend),
+                                float(general_settings.get("history_compact_interval",
+                                                           DEFAULT_HISTORY_COMPACT_INTERVAL)))
+        logger.info("Compacting the history in the background")
 
-            # Create a separate object for each enabled exchange for this algorithm
-            jobs.append(algorithm_class(exchange_class(exchange_vars), algorithm["id"], algorithm_vars))
+    logger.info(f"Starting main loop with {action_interval} seconds between actions and the {engine} engine")
+    job_timeout = float(general_settings.get("job_timeout", action_interval / 2))
+    if engine == "sharded":
+        coordinator.run_forever()
+    elif engine == "async":
+        import asyncio
+        from lib.async_engine import AsyncEngine
 
-    logger.info(f"Starting main loop with {len(jobs)} jobs and {action_interval} seconds between actions")
-    while True:
-        logger.info(f"Performing actions...")
-        state_vars = {
-            "exchanges": {}
-        }
-        # Execute all algorithms at the same time
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(algorithm.perform_action): algorithm for algorithm in jobs}
-
-            for future in as_completed(futures):
-                algorithm = futures[future]
-                log_action(future.result(), algorithm.exchange.codename, algorithm.codename)
-
-                exchange_exists = False
-                for exchange in state_vars["exchanges"]:
-                    if algorithm.exchange.codename == exchange:
-                        exchange_exists = True
-                        state_vars["exchanges"][exchange]["algorithms"].append({
-                            "id": algorithm.id_in_list,
-                            "codename": algorithm.codename,
-                            "algorithm_vars": algorithm.get_current_vars(),
-                            "exchange_vars": algorithm.exchange.get_current_vars()
-                        })
-                    break
-                if not exchange_exists:
-                    state_vars["exchanges"][algorithm.exchange.codename] = {
-                        "algorithms": [{
-                            "id": algorithm.id_in_list,
-                            "codename": algorithm.codename,
-                            "algorithm_vars": algorithm.get_current_vars(),
-                            "exchange_vars": algorithm.exchange.get_current_vars()
-                        }]
-                    }
-
-        # store variables
-        store_state(state_vars)
-
-        # wait until the next minute
-        wait_time = action_interval - time.localtime().tm_sec
-        logger.info(f"Sleeping until next minute ({wait_time}s)")
-        time.sleep(wait_time)
+        asyncio.run(AsyncEngine(jobs, action_interval, job_timeout, persist_results,
+                                prefetch_job_prices).run_forever())
+    elif engine == "threaded":
+        run_threaded(jobs, action_interval, job_timeout)
+    elif engine == "streaming":
+        run_streaming(jobs, general_settings)
+    else:
+        logger.critical(f"Unknown engine: {engine}. Use threaded, async, streaming or sharded. Exiting...")
+        sys.exit(1)
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from lib.history_store import BinaryHistoryBackend, JsonlHistoryBackend
+from lib.records import ActionRecord
+
+
+def _record(price: float) -> ActionRecord:
+    return ActionRecord("hold", None, None, 100.0, 0.0, price, 1700000000.0 + price, "1")
+
+
+class TornSegmentTest(unittest.TestCase):
+    """
+    A crash between write and fsync can leave a torn last record; appending after a restart must not corrupt the
+    records that follow it.
+    """
+
+    def _append_after_tear(self, backend_class: type) -> list:
+        with tempfile.TemporaryDirectory() as root:
+            backend = backend_class(root)
+            for price in (1000.0, 1001.0, 1002.0):
+                backend.append("Simulator", "SafeTrade", _record(price))
+            backend.close()
+            path = backend.list_segments("Simulator", "SafeTrade")[-1][2]
+            os.truncate(path, os.path.getsize(path) - 5)
+
+            backend = backend_class(root)
+            for price in (2000.0, 2001.0):
+                backend.append("Simulator", "SafeTrade", _record(price))
+            backend.close()
+            return [record["current_price"] for record in backend.read_records("Simulator", "SafeTrade")]
+
+    def test_jsonl_append_after_torn_record(self):
+        self.assertEqual(self._append_after_tear(JsonlHistoryBackend), [1000.0, 1001.0, 2000.0, 2001.0])
+
+    def test_binary_append_after_torn_record(self):
+        self.assertEqual(self._append_after_tear(BinaryHistoryBackend), [1000.0, 1001.0, 2000.0, 2001.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
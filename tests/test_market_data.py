@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.market_data import MarketDataStore, OHLCV_DTYPE
+
+START = 1700006400
+STEP = 60
+
+
+def _bars(start: float, end: float) -> np.ndarray:
+    timestamps = np.arange(start, end, STEP, dtype=np.float64)
+    bars = np.zeros(len(timestamps), dtype=OHLCV_DTYPE)
+    bars["unix_timestamp"] = timestamps
+    bars["close"] = 100.0
+    return bars
+
+
+class ChartSource:
+    """
+    Serves bars up to served_end, starting at served_start, and records every request.
+    """
+
+    def __init__(self, served_start: float = None, served_end: float = None):
+        self.served_start = served_start
+        self.served_end = served_end
+        self.requests = []
+
+    def __call__(self, symbol: str, start: float, end: float, interval: str):
+        self.requests.append((start, end))
+        served_start = start if self.served_start is None else max(start, self.served_start)
+        served_end = end if self.served_end is None else min(end, self.served_end)
+        return _bars(served_start, served_end), served_start
+
+
+class SyncTest(unittest.TestCase):
+    """
+    sync must only mark what the source served as covered, so the next sync requests the rest.
+    """
+
+    def _sync_twice(self, first_source: ChartSource) -> tuple:
+        with tempfile.TemporaryDirectory() as root:
+            end = START + 100 * STEP
+            MarketDataStore(root, first_source).sync("BTC-EUR", START, end)
+            second_source = ChartSource()
+            store = MarketDataStore(root, second_source)
+            store.sync("BTC-EUR", START, end)
+            return second_source.requests, store.gaps("BTC-EUR", START, end), len(store.load("BTC-EUR", START, end))
+
+    def test_complete_response_is_not_requested_again(self):
+        self.assertEqual(self._sync_twice(ChartSource()), ([], [], 100))
+
+    def test_empty_response_is_requested_again(self):
+        self.assertEqual(self._sync_twice(ChartSource(served_end=START)),
+                         ([(START, START + 100 * STEP)], [], 100))
+
+    def test_truncated_response_is_requested_again(self):
+        self.assertEqual(self._sync_twice(ChartSource(served_end=START + 40 * STEP)),
+                         ([(START + 40 * STEP, START + 100 * STEP)], [], 100))
+
+    def test_skipped_start_is_requested_again(self):
+        self.assertEqual(self._sync_twice(ChartSource(served_start=START + 30 * STEP)),
+                         ([(START, START + 30 * STEP)], [], 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+
+class SleepingJob:
+    codename = "Sleeping"
+
+    def __init__(self, id_in_list: int, seconds: float):
+        self.id_in_list = id_in_list
+        self.seconds = seconds
+
+    def perform_action(self):
+        time.sleep(self.seconds)
+        return self.id_in_list
+
+
+class BlockedJob(SleepingJob):
+    def __init__(self, id_in_list: int, release: threading.Event):
+        super().__init__(id_in_list, 0.0)
+        self.release = release
+
+    def perform_action(self):
+        self.release.wait()
+        return self.id_in_list
+
+
+class JobTimeoutTest(unittest.TestCase):
+    """
+    job_timeout limits how long a single action may run, not how long a job may wait for a worker.
+    """
+
+    def setUp(self):
+        main.unfinished_jobs.clear()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+        main.unfinished_jobs.clear()
+
+    def test_queued_jobs_do_not_time_out(self):
+        jobs = [SleepingJob(algo_id, 0.05) for algo_id in range(40)]
+        completed = main.run_tick(self.executor, jobs, prefetch=False, job_timeout=0.2)
+        self.assertEqual(sorted(result for _, result in completed), list(range(40)))
+        self.assertEqual(main.unfinished_jobs, {})
+
+    def test_long_action_times_out(self):
+        blocked = BlockedJob(0, self.release)
+        jobs = [blocked] + [SleepingJob(algo_id, 0.05) for algo_id in range(1, 20)]
+        completed = main.run_tick(self.executor, jobs, prefetch=False, job_timeout=0.2)
+        self.assertEqual(sorted(result for _, result in completed), list(range(1, 20)))
+        self.assertEqual(list(main.unfinished_jobs), [blocked])
+
+        # the late result is returned by the next tick, next to the result of its next action
+        self.release.set()
+        main.unfinished_jobs[blocked].result()
+        completed = main.run_tick(self.executor, jobs, prefetch=False, job_timeout=0.2)
+        self.assertEqual(sorted(result for _, result in completed), [0, 0] + list(range(1, 20)))
+
+    def test_jobs_without_free_worker_are_retried(self):
+        blocked = [BlockedJob(algo_id, self.release) for algo_id in range(4)]
+        waiting = [SleepingJob(algo_id, 0.0) for algo_id in range(4, 8)]
+        completed = main.run_tick(self.executor, blocked + waiting, prefetch=False, job_timeout=0.2)
+        self.assertEqual(completed, [])
+        self.assertEqual(set(main.unfinished_jobs), set(blocked))
+
+        self.release.set()
+        for future in main.unfinished_jobs.values():
+            future.result()
+        completed = main.run_tick(self.executor, waiting, prefetch=False, job_timeout=0.2)
+        self.assertEqual(sorted(result for _, result in completed), list(range(4, 8)))
+
+
+if __name__ == "__main__":
+    unittest.main()
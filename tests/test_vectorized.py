@@ -0,0 +1,38 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from algorithms.safe_trade import SafeTrade
+from lib.backtest import verify_vectorized_parity
+
+
+def _random_walk(seed: int, length: int = 2000) -> tuple:
+    generator = np.random.default_rng(seed)
+    prices = 20000.0 * np.exp(np.cumsum(generator.normal(0.0, 0.004, length)))
+    timestamps = 1700000000.0 + 60.0 * np.arange(length)
+    return timestamps, prices
+
+
+class SafeTradeParityTest(unittest.TestCase):
+    """
+    evaluate_vectorized must return exactly the action reports of perform_action, tick by tick.
+    """
+
+    def test_parity_with_perform_action(self):
+        fees = (0.0, 0.001, 0.0025)
+        wallets = ((0.0, 0.0), (100.0, 0.0), (0.0, 0.01), (250.0, 0.005))
+        for seed, fee, (fiat, crypto), cached in itertools.product(range(3), fees, wallets, (False, True)):
+            timestamps, prices = _random_walk(seed)
+            exchange_vars = {"crypto_codename": "BTC-EUR", "exchange_fee": fee, "wallet_fiat_amount": fiat,
+                             "wallet_crypto_amount": crypto}
+            # without a cached last_bought_price the first action forces a purchase
+            algorithm_vars = {"last_bought_price": float(prices[0]) * 0.99,
+                              "last_sold_price": float(prices[0]) * 1.01} if cached else {}
+            with self.subTest(seed=seed, fee=fee, fiat=fiat, crypto=crypto, cached=cached):
+                self.assertEqual(verify_vectorized_parity(SafeTrade, "1", exchange_vars, algorithm_vars, timestamps,
+                                                          prices), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()